@@ -4,8 +4,12 @@
 # @Software   : PyCharm
 """
 计算x小时恒定流条件(x>=24)（100流量计算至9000，每300一步）下的指定网格是否淹没，返回淹没时的流量
+各流量工况在相互独立的模型工作目录中并行计算，按完成的先后汇总，所有关注点的安全泄量都确定后取消其余的计算
 """
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import pandas as pd
 from flask import Flask, request, jsonify
@@ -14,7 +18,10 @@ from flask_cors import CORS
 from hdf_handler import HDFHandler
 from post_processor import PostProcessor
 from ras_handler_safety_discharge import RASHandler
+from ras_runner import RASRunner, ModelDivergedError
 from time_format_converter import TimeFormatConverter
+from warm_start import SPINUP_HOURS, spinup_key, cached_restart, save_restart, attach_restart
+from workspace_pool import WorkspacePool
 from logger import logger
 from datetime import datetime, timedelta
 
@@ -22,14 +29,211 @@ RAS_PATH = "/root/safety_discharge"
 b01_path = os.path.join(RAS_PATH, f"FZLall.b01")
 p01_hdf_path = os.path.join(RAS_PATH, f"FZLall.p01.hdf")
 initial_data_path = "data.xlsx"
+# HEC-RAS超过该时间(s)没有任何新的输出时判定为发散，提前结束计算后换流量重新试算，为None时不检查
+# 输出经管道块缓冲、可能长时间没有新输出，按真实计算日志标定之前保持关闭（见config.py中的RAS_STALL_TIMEOUT）
+RAS_STALL_TIMEOUT = None
+ras_runner = RASRunner(os.path.join(RAS_PATH, "ras_jobs"), logger=logger, stall_timeout=RAS_STALL_TIMEOUT)
+# 热启动：每个流量工况的12小时预热期（佛子岭零出流，白莲崖和磨子潭入流与该工况相同）只计算一次并缓存restart文件，
+# 之后同样初始条件的试算都从预热期末开始；为False时每次试算都从头模拟预热期
+# b01中restart的设置尚未在Linux计算引擎上核实（见warm_start），核实前保持关闭
+WARM_START = False
+restart_cache_dir = os.path.join(RAS_PATH, "restart")
+# 并行试算的模型工作目录份数，即同时运行的HEC-RAS计算数
+SWEEP_WORKERS = 4
+workspace_pool = WorkspacePool(RAS_PATH, RAS_PATH + "_workspaces", SWEEP_WORKERS)
+# 试算的流量，某一流量计算不收敛时改算该流量加SWEEP_RETRY_STEP，不超过SWEEP_Q_MAX
+# 原来逐个试算时，不收敛后其后的整个流量序列都加100（100、400、700不收敛后改为800、1100……）；
+# 并行试算时整个序列已同时提交，这里只补算不收敛的那一个流量，其余流量仍按原序列计算，
+# 因此某一流量不收敛时的结果可能与原来差一个SWEEP_RETRY_STEP，试算的分辨率不变
+SWEEP_Q = range(100, 9001, 300)
+SWEEP_RETRY_STEP = 100
+SWEEP_Q_MAX = 9000
 
 ymdhm_start = "2025-03-22 23:00"
 start_dt = datetime.strptime(ymdhm_start, "%Y-%m-%d %H:%M")
 
 FID = [2407, 8428, 1943, 5749, 10625]
 FID_name = ["两河口", "霍山县中学", "青山乡", "下符桥镇政府", "迎驾酒厂"]
-# 存储各点的安全泄量
-flood_Q = {name: None for name in FID_name}
+
+
+def prepare_model(workspace, xq_list_bly, xq_list_mzt, xq_list_fzl, xq_list_xhd, ymdhm_run_start, ymdhm_run_end,
+                  restart_file=None, write_restart=False):
+    """
+    把边界条件、模拟时段和初始条件写入工作目录中的b01和.p01.tmp.hdf
+    :param workspace: 模型工作目录
+    :param ymdhm_run_start: 本次模拟的开始时刻，yyyy-mm-dd hh:mm，流量过程的第一个值对应该时刻
+    :param restart_file: 热启动的restart文件名，为None时冷启动
+    :param write_restart: 是否在模拟结束时写出restart文件
+    :return: (ras_handler, hdf_handler)
+    """
+    workspace_b01_path = os.path.join(workspace, os.path.basename(b01_path))
+    ras_handler = RASHandler(xq_list_fzl)
+    time_format_converter = TimeFormatConverter()
+    # 修改b01文件
+    start_time_b01_and_hdf = time_format_converter.convert(ymdhm_run_start, 'b01')
+    end_time_b01_and_hdf = time_format_converter.convert(ymdhm_run_end, 'b01')
+    ras_handler.modify_b01(workspace_b01_path, workspace_b01_path, start_time_b01_and_hdf, end_time_b01_and_hdf,
+                           '1MIN', '1HOUR')
+    ras_handler.modify_restart(workspace_b01_path, workspace_b01_path, restart_file, write_restart)
+
+    # 修改.p01.hdf文件，修改其中的边界条件并把Results删除后改名为.p01.tmp.hdf
+    hdf_handler = HDFHandler(os.path.join(workspace, os.path.basename(p01_hdf_path)), ymdhm_run_start, ymdhm_run_end)
+    # 修改佛子岭水库出库边界
+    hdf_handler.modify_boundary_conditions_with_xhd_hpt_rating_curve(xq_list_bly, xq_list_mzt, xq_list_fzl,
+                                                                     xq_list_xhd, start_time_b01_and_hdf,
+                                                                     end_time_b01_and_hdf)
+
+    # 获取符合hdf_handler.modify_plan_data方法要求的start_date和end_date，为该方法的调用做好准备
+    start_time_plan_data = time_format_converter.convert(ymdhm_run_start, 'simulation')
+    end_time_plan_data = time_format_converter.convert(ymdhm_run_end, 'simulation')
+    # 修改p01.hdf文件中的Plan Data->Plan Information中的Simulation End Time、Simulation Start Time和Time Window
+    hdf_handler.modify_plan_data(start_time_plan_data, end_time_plan_data)
+
+    # 得到.p01.tmp.hdf供Linux ras调用
+    hdf_handler.remove_hdf_results()
+    return ras_handler, hdf_handler
+
+
+def run_job(ras_handler, workspace, job_id, i, cancelled, sim_start, sim_end):
+    """
+    启动工作目录中的计算并等待结束
+    取消可能发生在调用方检查cancelled之后、任务登记到ras_runner之前，此时ras_runner.cancel找不到任务，
+    因此任务登记后再检查一次，已取消时立即结束
+    :return: 进程返回值
+    :raises ModelDivergedError: 计算发散，已被看门狗提前结束
+    """
+    runner, job = ras_handler.start_model(os.path.join(workspace, 'run_unsteady.sh'), runner=ras_runner,
+                                          job_id=job_id, sim_start=sim_start, sim_end=sim_end)
+    if i in cancelled:
+        runner.cancel(job_id)
+    return runner.wait(job)
+
+
+def spinup_restart(workspace, job_id, i, cancelled, xq_list_bly, xq_list_mzt, xq_list_xhd):
+    """
+    取预热期末的restart文件，这组初始条件没有缓存时先在工作目录中计算一次预热期
+    :param workspace: 已借用的模型工作目录
+    :param job_id: 预热期计算的任务编号
+    :param i: 佛子岭出流，取消时按该流量查找
+    :param cancelled: 已取消的流量集合
+    :param xq_list_bly: 本工况的白莲崖入流过程，只用预热期内的值，下同
+    :return: 缓存的restart文件路径
+    """
+    n = SPINUP_HOURS + 1
+    key = spinup_key(ymdhm_start, xq_list_bly[:n], xq_list_mzt[:n], xq_list_xhd[:n])
+    restart = cached_restart(restart_cache_dir, key)
+    if restart is not None:
+        logger.info(f"使用缓存的预热期restart文件: {restart}")
+        return restart
+
+    logger.info(f"没有这组初始条件的预热期restart文件，开始计算{SPINUP_HOURS}小时预热期...")
+    spinup_end_dt = start_dt + timedelta(hours=SPINUP_HOURS)
+    ras_handler, _ = prepare_model(workspace, xq_list_bly[:n], xq_list_mzt[:n], np.zeros(n), xq_list_xhd[:n],
+                                   ymdhm_start, spinup_end_dt.strftime("%Y-%m-%d %H:%M"), write_restart=True)
+    since = time.time()
+    return_code = run_job(ras_handler, workspace, job_id, i, cancelled, start_dt, spinup_end_dt)
+    if return_code != 0:
+        raise RuntimeError(f"预热期计算失败，返回值: {return_code}")
+    return save_restart(restart_cache_dir, key, workspace, since)
+
+
+def run_level(i, job_id, cancelled, xq_list_initial_bly, xq_list_initial_mzt, xq_list_xhd, hours, end_dt):
+    """
+    借用一份工作目录计算佛子岭出流为i的工况，热启动时先在同一工作目录中取得该工况的预热期restart文件
+    :param job_id: 计算的任务编号，在所有请求中唯一，预热期计算的任务编号为job_id加"_spinup"
+    :param cancelled: 已取消的流量集合，计算开始前、启动后和结束后检查
+    :return: 各关注点是否淹没（bool数组）；计算不收敛或已取消时返回None
+    :raises RuntimeError: 计算过程中出现错误，异常信息为返回给调用方的错误提示
+    """
+    with workspace_pool.acquire() as workspace:
+        if i in cancelled:
+            return None
+        logger.info(f"开始模拟Q = {i}的工况，工作目录: {workspace}")
+        # 构造hours+12小时恒定流ndarray
+        xq_list_fzl = np.ones(hours + 12) * i
+        # 佛子岭水库的泄流过程推迟12小时，以确保水库中有足够的水量
+        xq_list_fzl[:12] = 0
+
+        # 修改白莲崖、磨子潭边界条件，响洪甸边界条件不变
+        xq_list_bly = xq_list_initial_bly + i / 2
+        xq_list_mzt = xq_list_initial_mzt + i / 2
+
+        # 热启动时试算从预热期末开始，流量过程去掉预热期的部分
+        skip = 0
+        restart_file = None
+        if WARM_START:
+            try:
+                restart_file = attach_restart(spinup_restart(workspace, f"{job_id}_spinup", i, cancelled,
+                                                             xq_list_bly, xq_list_mzt, xq_list_xhd), workspace)
+                skip = SPINUP_HOURS
+            except ModelDivergedError as e:
+                logger.info(f"Q = {i}条件下，预热期{e.reason}，模型计算不收敛")
+                return None
+            except Exception as e:
+                if i in cancelled:
+                    return None
+                logger.error(f"Q = {i}的预热期restart文件准备失败，改为冷启动: {e}")
+        run_start_dt = start_dt + timedelta(hours=skip)
+        if i in cancelled:
+            return None
+
+        try:
+            logger.info(f"将Q = {i}写入佛子岭水库边界条件中...")
+            # 修改边界条件
+            ras_handler, hdf_handler = prepare_model(workspace, xq_list_bly[skip:], xq_list_mzt[skip:],
+                                                     xq_list_fzl[skip:], xq_list_xhd[skip:],
+                                                     run_start_dt.strftime("%Y-%m-%d %H:%M"),
+                                                     end_dt.strftime("%Y-%m-%d %H:%M"), restart_file)
+        except Exception as e:
+            logger.error(e)
+            raise RuntimeError("修改模型边界条件时出现错误")
+
+        # 调用run_unsteady.sh进行计算
+        try:
+            if i in cancelled:
+                return None
+            logger.info(f"Q = {i}开始调用HEC-RAS计算...")
+            run_job(ras_handler, workspace, job_id, i, cancelled, run_start_dt, end_dt)
+            logger.info(f"Q = {i}的HEC-RAS计算完成")
+        except ModelDivergedError as e:
+            # 看门狗已提前结束发散的计算，不必等到计算结束
+            logger.info(f"Q = {i}条件下，{e.reason}，模型计算不收敛")
+            return None
+        except Exception as e:
+            logger.error(e)
+            raise RuntimeError("HEC-RAS计算中出现错误")
+        if i in cancelled:
+            return None
+
+        try:
+            logger.info(f"开始提取Q = {i}条件下全部网格的水深数据......")
+            # 从.p01.hdf结果文件中读取需要的数据
+            cells_minimum_elevation_data = hdf_handler.read_dataset(
+                'Cells Minimum Elevation')
+            wse_data = hdf_handler.read_dataset('Water Surface')
+
+            post_processor = PostProcessor()
+            # 将Cells中多余的高程为nan的空网格删去
+            real_mesh = post_processor.get_real_mesh(cells_minimum_elevation_data)
+            # 调用generating_depth方法，用水位减去高程，即得水深值
+            depth_data, _ = post_processor.generating_depth(
+                cells_minimum_elevation_data, wse_data, real_mesh)
+            logger.info(f"Q = {i}条件下，depth_data中总共含有{depth_data.shape[0]}行数据")
+        except Exception as e:
+            logger.error(e)
+            raise RuntimeError("水深数据提取过程中出现错误")
+
+    if depth_data.shape[0] != (hours + 12 - skip) * 6 - 5:
+        # 此时，模型计算发散，需要丢弃此次数据
+        logger.info(f"Q = {i}条件下，模型计算不收敛，将丢弃此次结果")
+        return None
+
+    try:
+        # 判断每个关注点是否淹没
+        return (depth_data[:, FID] >= 0.2).any(axis=0)
+    except Exception as e:
+        logger.error(e)
+        raise RuntimeError("处理关注点的淹没判断逻辑时出现错误")
 
 
 app = Flask(__name__)
@@ -84,111 +288,77 @@ def safety_discharge():
         logger.error(e)
         return jsonify({"error": "无法序列化初始流量"}), 400
 
-    # 开始试算
-    i = 100
-    while i <= 9000:
-        logger.info(f"开始模拟Q = {i}的工况...")
-        # 构造hours+12小时恒定流ndarray
-        xq_list_fzl = np.ones(hours + 12) * i
-        # 佛子岭水库的泄流过程推迟12小时，以确保水库中有足够的水量
-        xq_list_fzl[:12] = 0
-
-        # 修改白莲崖、磨子潭边界条件，响洪甸边界条件不变
-        xq_list_bly = xq_list_initial_bly + i / 2
-        xq_list_mzt = xq_list_initial_mzt + i / 2
-
-        try:
-            logger.info(f"将Q = {i}写入佛子岭水库边界条件中...")
-            # 修改边界条件
-            ras_handler = RASHandler(xq_list_fzl)
-            time_format_converter = TimeFormatConverter()
-            # 修改b01文件
-            start_time_b01_and_hdf = time_format_converter.convert(ymdhm_start, 'b01')
-            end_time_b01_and_hdf = time_format_converter.convert(ymdhm_end, 'b01')
-            ras_handler.modify_b01(b01_path, b01_path, start_time_b01_and_hdf, end_time_b01_and_hdf, '1MIN', '1HOUR')
-
-            # 修改.p01.hdf文件，修改其中的边界条件并把Results删除后改名为.p01.tmp.hdf
-            hdf_handler = HDFHandler(p01_hdf_path, ymdhm_start, ymdhm_end)
-            # 修改佛子岭水库出库边界
-            hdf_handler.modify_boundary_conditions_with_xhd_hpt_rating_curve(xq_list_bly, xq_list_mzt, xq_list_fzl,
-                                                                             xq_list_xhd, start_time_b01_and_hdf,
-                                                                             end_time_b01_and_hdf)
-
-            # 获取符合hdf_handler.modify_plan_data方法要求的start_date和end_date，为该方法的调用做好准备
-            start_time_plan_data = time_format_converter.convert(ymdhm_start, 'simulation')
-            end_time_plan_data = time_format_converter.convert(ymdhm_end, 'simulation')
-            # 修改p01.hdf文件中的Plan Data->Plan Information中的Simulation End Time、Simulation Start Time和Time Window
-            hdf_handler.modify_plan_data(start_time_plan_data, end_time_plan_data)
-
-            # 得到.p01.tmp.hdf供Linux ras调用
-            hdf_handler.remove_hdf_results()
-        except Exception as e:
-            logger.error(e)
-            return jsonify({"error": "修改模型边界条件时出现错误"}), 400
-
-        # 调用run_unsteady.sh进行计算
-        try:
-            logger.info("开始调用HEC-RAS计算...")
-            sh_path = os.path.dirname(b01_path) + os.path.sep + 'run_unsteady.sh'
-            return_code = ras_handler.run_model(sh_path)
-            logger.info("HEC-RAS计算完成")
-        except Exception as e:
-            logger.error(e)
-            return jsonify({"error": "HEC-RAS计算中出现错误"}), 400
+    # 开始并行试算，各流量的结果按完成的先后汇总
+    flood_Q = {name: None for name in FID_name}
+    # 各关注点已知淹没的最小流量；某点的所有更小流量都已算完时，该点的安全泄量即确定
+    min_drown_Q = [None] * len(FID)
+    cancelled = set()
+    running = {}
+    # 计算任务编号的前缀，同时处理的多个请求中相同流量的计算互不影响
+    sweep_id = uuid.uuid4().hex[:8]
+    started = time.perf_counter()
 
-        try:
-            logger.info("开始提取全部网格的水深数据......")
-            # 从.p01.hdf结果文件中读取需要的数据
-            cells_minimum_elevation_data = hdf_handler.read_dataset(
-                'Cells Minimum Elevation')
-            wse_data = hdf_handler.read_dataset('Water Surface')
+    def useless(q):
+        """所有关注点都已知在不大于q的流量下淹没时，流量q不必再算"""
+        return all(m is not None and m <= q for m in min_drown_Q)
 
-            post_processor = PostProcessor()
-            # 将Cells中多余的高程为nan的空网格删去
-            real_mesh = post_processor.get_real_mesh(cells_minimum_elevation_data)
-            # 调用generating_depth方法，用水位减去高程，即得水深值
-            depth_data = post_processor.generating_depth(
-                cells_minimum_elevation_data, wse_data, real_mesh)
-            logger.info("全部网格的水深数据已提取完成")
-            logger.info(f"Q = {i}条件下，depth_data中总共含有{depth_data.shape[0]}行数据")
-        except Exception as e:
-            logger.error(e)
-            return jsonify({"error": "水深数据提取过程中出现错误"}), 400
+    with ThreadPoolExecutor(max_workers=SWEEP_WORKERS) as executor:
+        def job_name(q):
+            return f"{sweep_id}_Q{q}"
 
+        def submit(q):
+            future = executor.submit(run_level, q, job_name(q), cancelled, xq_list_initial_bly, xq_list_initial_mzt,
+                                     xq_list_xhd, hours, end_dt)
+            running[future] = q
 
-        if depth_data.shape[0] != (hours + 12) * 6 - 5:
-            # 此时，模型计算发散，需要丢弃此次数据，稍微改变流量过程重新试算
-            logger.info(f"Q = {i}条件下，模型计算不收敛，将丢弃此次结果，采用较小步长重新试算...")
-            i += 100
-            continue
+        def cancel(qs):
+            for future, q in list(running.items()):
+                if q in qs and q not in cancelled:
+                    cancelled.add(q)
+                    future.cancel()
+                    ras_runner.cancel(job_name(q))
+                    ras_runner.cancel(f"{job_name(q)}_spinup")
 
-        try:
-            logger.info("开始提取关注点的水深数据...")
-            # 提取指定位置的水深时序数据
-            depth_data_FID = depth_data[:, FID]
-            # 判断每个位置是否淹没
-            is_drown = (depth_data_FID >= 0.2).any(axis=0)
-            for j, drown in enumerate(is_drown):
-                if drown:
-                    if flood_Q[FID_name[j]] is None:
-                        logger.info(f"Q = {i}条件下，{FID_name[j]} 已经计算出不为0的淹没水深...")
-                        flood_Q[FID_name[j]] = i
-        except Exception as e:
-            logger.error(e)
-            return jsonify({"error": "处理关注点的淹没判断逻辑时出现错误"}), 400
+        for q in SWEEP_Q:
+            submit(q)
 
-        i += 300
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                q = running.pop(future)
+                if future.cancelled() or q in cancelled:
+                    continue
+                try:
+                    is_drown = future.result()
+                except Exception as e:
+                    cancel(set(running.values()))
+                    return jsonify({"error": str(e)}), 400
 
-        # 判断是否已经得到所有的安全泄量
-        if all(value is not None for value in flood_Q.values()):
-            logger.info("已试算得到所有关注点的安全泄量，程序提前终止...")
-            break
+                if is_drown is None:
+                    # 模型计算不收敛，稍微改变流量重新试算；只补算这一个流量，其余流量不平移（见SWEEP_Q）
+                    retry_q = q + SWEEP_RETRY_STEP
+                    if retry_q <= SWEEP_Q_MAX and retry_q not in running.values() and not useless(retry_q):
+                        logger.info(f"Q = {q}的结果已丢弃，改算Q = {retry_q}")
+                        submit(retry_q)
+                    continue
+                for j, drown in enumerate(is_drown):
+                    if drown and (min_drown_Q[j] is None or q < min_drown_Q[j]):
+                        logger.info(f"Q = {q}条件下，{FID_name[j]} 已经计算出不为0的淹没水深...")
+                        min_drown_Q[j] = q
 
-        logger.info("------------------------")
+            # 比某点已知淹没流量更小的流量都算完时，该点的安全泄量确定
+            for j, m in enumerate(min_drown_Q):
+                if m is not None and flood_Q[FID_name[j]] is None and all(q >= m for q in running.values()):
+                    flood_Q[FID_name[j]] = m
+                    logger.info(f"{FID_name[j]} 的安全泄量已确定为Q = {m}，已用时{time.perf_counter() - started:.0f}s")
+            useless_qs = {q for q in running.values() if q not in cancelled and useless(q)}
+            if useless_qs:
+                logger.info(f"所有关注点的安全泄量都已不受流量{sorted(useless_qs)}影响，取消这些计算...")
+                cancel(useless_qs)
 
+    logger.info(f"试算结束，耗时{time.perf_counter() - started:.0f}s，结果: {flood_Q}")
     return jsonify(flood_Q), 200
 
-
 if __name__ == '__main__':
     # 调试时用这行代码启动服务器
     app.run(host="0.0.0.0", port=19997, debug=False)
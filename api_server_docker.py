@@ -3,7 +3,9 @@ import os
 import shutil
 import zipfile
 import json
+import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
@@ -14,137 +16,77 @@ from output_hdf_handler import create_output_hdf5
 from sqlserver_handler import SQLServerHandler
 from sqlserver_handler import NoArraysInDictionaryError, ArrayLengthsMismatchError, NegativeFlowError, CalInfoDataError
 from post_processor import PostProcessor
+from flood_stats import compute_cell_stats, cell_stats_attributes, output_interval_hours
+from depth_classes import compute_class_areas
+from cell_area import load_cell_areas
+from section_mapping import load_section_index, build_flood_section_records
 from ras_handler import RASHandler
+from ras_runner import RASRunner, ModelDivergedError
 from time_format_converter import TimeFormatConverter
-from velocity_to_cells import velocity_to_cells
+from hazard import compute_hazard_from_hdf, hazard_attributes
+from geometry_store import load_geometry_store
+from village_impact import load_village_index, village_impacts, format_village_info
+from zonal_stats import load_zone_index, compute_zone_stats
+from vector_writer import write_layers
+from gis_worker import GISWorkerPool
+from flood_extent import save_mesh_topology
 from config import *
 from logger import logger
-import geopandas as gpd
 import numpy as np
-import pandas as pd
-import threading
 import requests
 
 
-class NoReferenceShapefileError(Exception):
-    def __init__(self, message="参考shp网格文件不存在"):
-        self.message = message
-        super().__init__(self.message)
-
-
+app = Flask(__name__)
 
-class NoAreaInShapefileError(Exception):
-    def __init__(self, message="参考shp网格文件中没有'Area'列"):
-        self.message = message
-        super().__init__(self.message)
+# Enable CORS for the entire app
+CORS(app)
 
+# GIS后处理进程池，任务文件持久化在GIS_TASK_DIR中，结束超过GIS_TASK_RETENTION_DAYS天的任务文件自动清理
+gis_worker_pool = GISWorkerPool(GIS_TASK_DIR, max_workers=GIS_MAX_WORKERS, retention_days=GIS_TASK_RETENTION_DAYS)
+# HEC-RAS计算进程管理，每个方案的完整输出写入RAS_JOB_LOG_DIR，计算进度可通过/ras_status查询
+ras_runner = RASRunner(RAS_JOB_LOG_DIR, stall_timeout=RAS_STALL_TIMEOUT)
 
 
-def load_section_mapping():
+def init_app():
     """
-    加载断面ID和名称的映射关系
-    从断面id名称对应关系.xlsx文件中读取映射
-    
-    :return: 字典，key为cross_sections_name（字节串），value为(SECTION_ID, SECTION_NAME)元组
+    服务启动时的初始化：预加载断面映射、网格几何缓存和村庄网格对应关系，重新提交上次退出时未完成的GIS任务
+    GIS进程池使用spawn，子进程会以__mp_main__重新导入本文件，所以这些步骤不能放在模块顶层，
+    只能由__main__或create_app调用，子进程中直接跳过
     """
+    if multiprocessing.parent_process() is not None:
+        return
+
+    # 预编译断面映射索引，之后只在映射文件变化时重新加载
     try:
-        import pandas as pd
-        import os
-        
-        # 断面映射文件路径（相对于当前工作目录）
-        mapping_file = os.path.join(os.path.dirname(__file__), "断面id名称对应关系.xlsx")
-        
-        if not os.path.exists(mapping_file):
-            logger.warning(f"断面映射文件不存在: {mapping_file}")
-            return {}
-        
-        # 读取Excel文件
-        df = pd.read_excel(mapping_file, sheet_name='FLOODAREA')
-        
-        # 建立映射字典
-        section_map = {}
-        for _, row in df.iterrows():
-            cross_sections_id = row['cross_sections_id']
-            # 跳过cross_sections_id为"无"的记录
-            if pd.isna(cross_sections_id) or str(cross_sections_id).strip() == "无":
-                continue
-            
-            cross_sections_name = row['cross_sections_name']
-            section_id = int(row['SECTION_ID'])
-            section_name = str(row['SECTION_NAME'])
-            
-            # 将cross_sections_name转为字节串作为key（与HDF5中的格式一致）
-            key = cross_sections_name.encode('utf-8') if isinstance(cross_sections_name, str) else cross_sections_name
-            section_map[key] = (section_id, section_name)
-        
-        logger.info(f"成功加载{len(section_map)}个断面映射")
-        return section_map
-        
+        load_section_index()
     except Exception as e:
         logger.error(f"加载断面映射失败: {e}")
-        return {}
 
-
-def postprocess_max_water_area_shp(output_path, logger):
+    # 加载参考shp网格的几何缓存，之后只在fanwei.shp变化时重新读取和投影
     try:
-        import geopandas as gpd
-        shp_path = os.path.join(output_path, "max_water_area.shp")
-        geojson_path = os.path.join(output_path, "max_water_area_union.geojson")
-        geojson_path2 = os.path.join(output_path, "max_water_area_union_simplify.geojson")
-
-        logger.info("开始异步处理max_water_area.shp...")
-
-        # 1. 读取shp
-        gdf = gpd.read_file(shp_path)
-        logger.info(f"读取shp成功，面数: {len(gdf)}")
-
-        # 2. 转为EPSG:4326
-        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-            # 若没有坐标系或不是4326则转换
-            gdf = gdf.to_crs(epsg=4326)
-            logger.info("坐标系已转换为EPSG:4326")
-        else:
-            logger.info("原始shp已为EPSG:4326")
-
-        # 3. 筛选水深>0.2的面
-        # 找到 depth_* 列
-        depth_col = [c for c in gdf.columns if c.startswith('depth_')]
-        assert len(depth_col) == 1, f"未找到唯一的水深列，找到: {depth_col}"
-        depth_col = depth_col[0]
-        gdf_filtered = gdf[gdf[depth_col] > 0.2].copy()
-        logger.info(f"筛选后面数: {len(gdf_filtered)}")
-
-        if gdf_filtered.empty:
-            logger.warning("筛选后无水深大于0.2的面，未生成geojson")
-            return
-
-        # 4. 融合所有面
-        union_geom = gdf_filtered.unary_union
-        # union_geom 可能是 Polygon 或 MultiPolygon
-        out_gdf = gpd.GeoDataFrame(geometry=[union_geom], crs="EPSG:4326")
-
-        # 5. 输出为geojson
-        out_gdf.to_file(geojson_path, driver="GeoJSON")
-        logger.info(f"融合后geojson已输出到 {geojson_path}")
-
-        # ---------关键：边界简化----------
-        # 你可以根据需要调整 tolerance 参数
-        tolerance = 0.001  # 约100米
-        union_geom_simplified = union_geom.simplify(tolerance, preserve_topology=True)
-        logger.info(
-            f"简化后点数：{len(union_geom_simplified.exterior.coords) if union_geom_simplified.geom_type == 'Polygon' else 'MultiPolygon'}")
-        out_gdf2 = gpd.GeoDataFrame(geometry=[union_geom_simplified], crs="EPSG:4326")
-        out_gdf2.to_file(geojson_path2, driver="GeoJSON")
-        logger.info(f"融合并简化后geojson已输出到 {geojson_path2}")
-
+        load_geometry_store(os.path.join(RAS_PATH, 'fanwei', 'fanwei.shp'))
     except Exception as e:
-        logger.error(f"max_water_area.shp异步处理失败: {e}")
+        logger.error(f"加载网格几何缓存失败: {e}")
 
+    # 加载村庄与网格的对应关系，之后只在村庄shp或fanwei.shp变化时重新匹配
+    if os.path.exists(VILLAGE_SHP_PATH):
+        try:
+            load_village_index(VILLAGE_SHP_PATH, os.path.join(RAS_PATH, 'fanwei', 'fanwei.shp'),
+                               VILLAGE_NAME_FIELD, VILLAGE_MAX_DISTANCE)
+        except Exception as e:
+            logger.error(f"加载村庄网格对应关系失败: {e}")
 
-app = Flask(__name__)
+    # 重新提交上次服务退出时未完成的GIS任务
+    try:
+        gis_worker_pool.recover()
+    except Exception as e:
+        logger.error(f"重新提交未完成的GIS任务失败: {e}")
 
-# Enable CORS for the entire app
-CORS(app)
+
+def create_app():
+    """WSGI服务器加载应用的入口，例如gunicorn "api_server_docker:create_app()"，先完成init_app再返回app"""
+    init_app()
+    return app
 
 
 @app.route('/set_2d_hydrodynamic_data', methods=['post'])
@@ -174,7 +116,7 @@ def set_2d_hydrodynamic_data():
     # 向FLOOD_REHEARSAL表中写入初始状态
     try:
         logger.info("开始写入FLOOD_REHEARSAL初始状态...")
-        success = sqlserver_handler.insert_flood_rehearsal(
+        success = sqlserver_handler.upsert_flood_rehearsal(
             flood_dispatch_name=scheme_name,
             flood_path=outside_path,
             flood_name=scheme_name,
@@ -258,8 +200,14 @@ def set_2d_hydrodynamic_data():
     try:
         logger.info("开始调用HEC-RAS计算...")
         sh_path = os.path.dirname(b01_path) + os.path.sep + 'run_unsteady.sh'
-        return_code = ras_handler.run_model(sh_path)
+        return_code = ras_handler.run_model(
+            sh_path, runner=ras_runner, job_id=scheme_name,
+            sim_start=datetime.strptime(ymdhm_start, "%Y-%m-%d %H:%M"),
+            sim_end=datetime.strptime(ymdhm_end, "%Y-%m-%d %H:%M"))
         logger.info("HEC-RAS计算完成")
+    except ModelDivergedError as e:
+        logger.error(e)
+        return "Failed: HEC-RAS计算不收敛"
     except Exception as e:
         logger.error(e)
         return "Failed: HEC-RAS计算中出现错误"
@@ -270,8 +218,6 @@ def set_2d_hydrodynamic_data():
         cells_minimum_elevation_data = hdf_handler.read_dataset(
             'Cells Minimum Elevation')
         wse_data = hdf_handler.read_dataset('Water Surface')
-        # velocity_u = hdf_handler.read_dataset('Velocity X')
-        # velocity_v = hdf_handler.read_dataset('Velocity Y')
         # facepoints_coordinate_data = hdf_handler.read_dataset(
         #     'FacePoints Coordinate')
         # cells_coordinate_data = hdf_handler.read_dataset(
@@ -288,6 +234,12 @@ def set_2d_hydrodynamic_data():
         depth_data, new_wse_data = post_processor.generating_depth(
             cells_minimum_elevation_data, wse_data, real_mesh)
         logger.info(f"水深和水位数据提取完成，形状: {depth_data.shape}")
+
+        # 一次遍历计算逐网格淹没统计，供HDF5输出、GIS图层和数据库汇总共用
+        # 淹没历时按结果文件中实际的输出间隔换算
+        interval_hours = output_interval_hours(hdf_handler.read_dataset('Time Date Stamp'))
+        cell_stats = compute_cell_stats(depth_data, thresholds=FLOOD_STATS_THRESHOLDS, interval_hours=interval_hours)
+        logger.info(f"逐网格淹没统计完成，阈值: {FLOOD_STATS_THRESHOLDS}，输出间隔: {interval_hours * 60:.0f}分钟")
         
         # # 保留原CSV输出（暂时不变）
         # csv_path = output_path + os.path.sep + "output.csv"
@@ -297,6 +249,21 @@ def set_2d_hydrodynamic_data():
         logger.error(e)
         return "Failed: 水深和水位数据提取和存储过程中出现错误"
 
+    # ========== 由顶点流速计算每个网格的最大危险度（水深×流速） ==========
+    hazard = None
+    if ENABLE_HAZARD:
+        try:
+            logger.info("开始计算洪水危险度...")
+            hazard = compute_hazard_from_hdf(p01_hdf_path, depth_data)
+            if hazard is None:
+                logger.warning("结果文件中没有顶点流速（Node Velocity），跳过危险度计算")
+            else:
+                logger.info(f"洪水危险度计算完成，最高等级: H{int(hazard['max_hazard'].max())}")
+        except Exception as e:
+            # 危险度计算失败不影响主流程
+            logger.error(f"洪水危险度计算失败: {e}")
+            hazard = None
+
     try:
         # ========== 提取坝下水位 ==========
         logger.info("开始提取坝下水位...")
@@ -322,90 +289,68 @@ def set_2d_hydrodynamic_data():
         return f"Failed: {e}"
 
     # ========== 计算最大淹没面积和每个时刻的淹没面积 ==========
+    shp_path = RAS_PATH + os.path.sep + 'fanwei' + os.path.sep + 'fanwei.shp'
     try:
-        flooded_area = None  # 初始化
-
-        shp_path = RAS_PATH + os.path.sep + 'fanwei' + os.path.sep + 'fanwei.shp'
-        
-        if not os.path.exists(shp_path):
-            logger.error(f"参考shp网格不存在: {shp_path}")
-            shp_exists = False
-            raise NoReferenceShapefileError(f"参考shp网格不存在: {shp_path}")
-        else:
-            shp_exists = True
-        
-        if shp_exists:
-            logger.info("开始计算最大淹没面积和淹没面积...")
-            
-            # 读取shapefile
-            gdf = gpd.read_file(shp_path)
-            attributes_df = gdf
-            
-            # 提取面积数据 - 直接读取Area列
-            if 'Area' not in attributes_df.columns:
-                logger.error("Shapefile中未找到'Area'列！")
-                logger.info(f"可用的列: {attributes_df.columns.tolist()}")
-                raise NoAreaInShapefileError("参考Shp网格文件中未找到'Area'列！")
-            
-            area_data = attributes_df[['Area']].to_numpy()
-            
-            depth_data_transposed = depth_data.T
-            # depth_data_final: 行=网格FID，列=时间步
-            # 第一列为面积，后续列为各时间步的水深
-            depth_data_final = np.hstack((area_data, depth_data_transposed))
-            
-            num_shapefiles = len(depth_data)
-            logger.info(f"时间步数: {num_shapefiles}")
-            
-            # 计算每个网格在每个时间步的受淹面积
-            depth_count = np.zeros((len(depth_data_final), num_shapefiles))
-            for i in range(len(depth_data_final)):
-                for j in range(num_shapefiles):
-                    x = depth_data_final[i, j + 1]  # 获取水深值
-                    if x > 0.2:  # 水深>0.2m
-                        depth_count[i][j] = depth_data_final[i][0] * 0.001 * 0.001  # 转换为km²
-                    else:
-                        depth_count[i][j] = 0
-            
-            depth_count_final = depth_count.sum(axis=0)
-            max_index = np.argmax(depth_count_final)
-            
-            # 添加最大淹没时刻的水深到shapefile
-            attributes_df[f'depth_{max_index}'] = depth_data_final[:, max_index + 1]
-            
-            # 保存最大淹没面积shapefile
-            max_shp_path = os.path.join(output_path, "max_water_area.shp")
-            gdf.to_file(max_shp_path)
-            logger.info(f"最大淹没面积shp文件已保存: {max_shp_path}")
-            logger.info(f"最大淹没发生在第{max_index}个时间步")
-            
-            # ========== 计算每个时刻的淹没面积 ==========
-            logger.info("开始计算每个时刻的淹没面积...")
-            grid_areas = attributes_df['Area'].values
-            flooded_area = np.zeros(num_shapefiles)
-            
-            for j in range(num_shapefiles):
-                total_area = 0.0
-                for i in range(len(depth_data_final)):
-                    depth = depth_data_final[i, j + 1]
-                    if depth > 0.2:
-                        total_area += grid_areas[i]  # 累加面积(m²)
-                
-                # 减去42756184m²，转换为km²
-                flooded_area_km2 = (total_area - 42756184.0) / 1000000.0
-                flooded_area[j] = max(0.0, flooded_area_km2)
-            
-            logger.info(f"淹没面积计算完成，共{num_shapefiles}个时间步")
-            logger.info(f"淹没面积范围: {flooded_area.min():.2f} - {flooded_area.max():.2f} km²")
+        logger.info("开始计算最大淹没面积和淹没面积...")
+
+        # 网格面积直接取自结果文件中的网格几何（按模型缓存），参考shp网格只用于输出图层
+        grid_areas = load_cell_areas(p01_hdf_path, real_mesh)
+        num_shapefiles = len(depth_data)
+        logger.info(f"时间步数: {num_shapefiles}")
+
+        # 一次遍历计算每个时间步各水深等级的淹没面积(m²)，各等级之和即为水深>DEPTH_CLASS_BOUNDS[0]的总淹没面积
+        class_areas = compute_class_areas(depth_data, grid_areas, DEPTH_CLASS_BOUNDS)
+        total_area = class_areas.sum(axis=1)
+        max_index = int(np.argmax(total_area))
+        logger.info(f"最大淹没发生在第{max_index}个时间步")
+
+        # ========== 计算每个时刻的淹没面积 ==========
+        # 减去42756184m²，转换为km²
+        flooded_area = np.maximum(0.0, (total_area - 42756184.0) / 1000000.0)
+
+        logger.info(f"淹没面积计算完成，共{num_shapefiles}个时间步")
+        logger.info(f"最大淹没时刻各水深等级{DEPTH_CLASS_BOUNDS}的面积: "
+                    f"{np.round(class_areas[max_index] / 1e6, 2).tolist()} km²")
+        logger.info(f"淹没面积范围: {flooded_area.min():.2f} - {flooded_area.max():.2f} km²")
+    except Exception as e:
+        logger.error(f"淹没面积计算失败: {e}")
+        return "Failed: 淹没面积计算失败"
+
+    # 保存最大淹没面积图层，在缓存的几何上附加最大淹没时刻的水深（只用于展示，失败不影响主流程）
+    if os.path.exists(shp_path):
+        try:
+            geometry_store = load_geometry_store(shp_path)
+            max_layer_paths = write_layers(
+                geometry_store.to_geodataframe({f'depth_{max_index}': depth_data[max_index],
+                                                **cell_stats_attributes(cell_stats),
+                                                **(hazard_attributes(hazard) if hazard is not None and HAZARD_IN_GIS_LAYERS
+                                                   else {})}),
+                output_path, "max_water_area", GIS_OUTPUT_FORMATS)
+            logger.info(f"最大淹没面积图层已保存: {max_layer_paths}")
+        except Exception as e:
+            logger.error(f"保存最大淹没面积图层失败: {e}")
+    else:
+        logger.warning(f"参考shp网格不存在: {shp_path}，跳过最大淹没面积图层")
+
+    # ========== 按分区（乡镇）统计逐时间步的淹没面积、平均水深和最大水深 ==========
+    zone_stats = None
+    if os.path.exists(ZONE_SHP_PATH):
+        try:
+            zone_index = load_zone_index(ZONE_SHP_PATH, shp_path, ZONE_NAME_FIELD)
+            zone_stats = compute_zone_stats(zone_index, depth_data)
+            logger.info(f"分区淹没统计完成，分区数: {len(zone_index)}")
+        except Exception as e:
+            # 分区统计失败不影响主流程
+            logger.error(f"分区淹没统计失败: {e}")
+            zone_stats = None
+    else:
+        logger.warning(f"分区shp不存在: {ZONE_SHP_PATH}，跳过分区淹没统计")
 
-    except NoReferenceShapefileError as e:
-        return "Failed: 参考shp网格文件不存在"
-    except NoAreaInShapefileError as e:
-        return "Failed: 参考shp网格文件中没有'Area'列"
-        
     # 创建HDF5输出文件（使用scheme_name命名）并压缩HDF5文件为ZIP
     try:
-        hdf5_file_path = create_output_hdf5(output_path, hdf_handler, depth_data, new_wse_data, flooded_area, logger, scheme_name)
+        hdf5_file_path = create_output_hdf5(output_path, hdf_handler, depth_data, new_wse_data, flooded_area, logger, scheme_name,
+                                            cell_stats=cell_stats, hazard=hazard, zone_stats=zone_stats,
+                                            class_areas=class_areas, class_bounds=DEPTH_CLASS_BOUNDS)
         if not hdf5_file_path:
             return "Failed: HDF5输出文件创建失败"
     
@@ -424,20 +369,7 @@ def set_2d_hydrodynamic_data():
     try:
         logger.info("开始写入数据库...")
         
-        # 1. 更新FLOOD_REHEARSAL记录的STATUS为1和MAX_FLOOD_AREA
-        max_flood_area = int(np.max(flooded_area))
-        success = sqlserver_handler.update_flood_rehearsal_status(
-            flood_dispatch_name=scheme_name,
-            status=1,
-            max_flood_area=max_flood_area
-        )
-        if not success:
-            logger.warning("FLOOD_REHEARSAL状态更新失败")
-        
-        # 2. 准备并插入FLOOD_SECTION记录
-        # 加载断面映射
-        section_mapping = load_section_mapping()
-        
+        # 1. 准备FLOOD_SECTION记录
         # 从HDF5读取断面数据
         import h5py
         with h5py.File(hdf5_file_path, 'r') as hf:
@@ -445,42 +377,12 @@ def set_2d_hydrodynamic_data():
             cross_sections_name = hf['data']['CrossSections']['Name'][:]
             cross_sections_flow = hf['data']['CrossSections']['Flow'][:]
             time_date_stamp = hf['data']['TimeDateStamp'][:]
-        
-            # 准备FLOOD_SECTION批量插入数据
-            section_records = []
-            
-            # 获取断面数据的时间步数（使用cross_sections_ws的实际列数）
-            num_cross_section_timesteps = cross_sections_ws.shape[0] if len(cross_sections_ws.shape) > 1 else len(time_date_stamp)
-            
-            for i, cs_name in enumerate(cross_sections_name):
-                # 查找映射
-                if cs_name in section_mapping:
-                    section_id, section_name = section_mapping[cs_name]
-                    
-                    # 为每个时间步创建一条记录（使用断面数据实际的时间步数）
-                    # cross_sections_ws结构：行=时间步，列=断面ID
-                    for j in range(num_cross_section_timesteps):
-                        time_str = time_date_stamp[j].decode('utf-8') if isinstance(time_date_stamp[j], bytes) else str(time_date_stamp[j])
-                        z_value = float(cross_sections_ws[j, i])  # j=时间步（行），i=断面（列）
-                        q_value = float(cross_sections_flow[j, i])  # j=时间步（行），i=断面（列）
-                        depth_value = 0  # DEPTH字段暂填0
-                        
-                        section_records.append((
-                            section_id,
-                            section_name,
-                            scheme_name,
-                            time_str,
-                            z_value,
-                            depth_value,
-                            q_value
-                        ))
-        
-        if section_records:
-            success = sqlserver_handler.insert_flood_section_batch(section_records)
-            if not success:
-                logger.warning("FLOOD_SECTION批量写入失败")
-        
-        # 3. 准备并插入FLOODAREA记录
+
+        # 按断面映射索引对齐后批量构造FLOOD_SECTION记录
+        section_records = build_flood_section_records(
+            scheme_name, cross_sections_name, cross_sections_ws, cross_sections_flow, time_date_stamp)
+
+        # 2. 准备FLOODAREA记录
         floodarea_records = []
         for j in range(len(time_date_stamp)):
             time_str = time_date_stamp[j].decode('utf-8') if isinstance(time_date_stamp[j], bytes) else str(time_date_stamp[j])
@@ -491,11 +393,43 @@ def set_2d_hydrodynamic_data():
                 flooded_area_value,
                 scheme_name
             ))
-        
-        if floodarea_records:
-            success = sqlserver_handler.insert_floodarea_batch(floodarea_records)
-            if not success:
-                logger.warning("FLOODAREA批量写入失败")
+
+        # 3. 准备逐网格淹没统计（每个网格一行，代替逐网格逐时间步的水深记录）
+        cell_summary_records = sqlserver_handler.build_cell_summary_records(scheme_name, cell_stats, time_date_stamp)
+
+        # 4. 准备分区淹没统计（每个分区每个时间步一行）
+        zone_stats_records = (sqlserver_handler.build_zone_stats_records(scheme_name, zone_stats, time_date_stamp)
+                              if zone_stats is not None else None)
+
+        # 5. 统计受影响村庄（村庄点所在网格的最大水深和首次超过VILLAGE_FLOOD_DEPTH的时间）
+        village_info = None
+        if os.path.exists(VILLAGE_SHP_PATH):
+            try:
+                village_index = load_village_index(VILLAGE_SHP_PATH, shp_path, VILLAGE_NAME_FIELD, VILLAGE_MAX_DISTANCE)
+                impacts = village_impacts(village_index, cell_stats, time_date_stamp, VILLAGE_FLOOD_DEPTH)
+                village_info = format_village_info(impacts)
+                logger.info(f"受影响村庄统计完成，受影响村庄数: {len(impacts)}")
+            except Exception as e:
+                logger.error(f"受影响村庄统计失败: {e}")
+        else:
+            logger.warning(f"村庄shp不存在: {VILLAGE_SHP_PATH}，VILLAGE_INFO保持不变")
+
+        # 6. 在一个事务中替换该方案的断面和淹没面积结果，并将FLOOD_REHEARSAL的STATUS更新为1、写入MAX_FLOOD_AREA和VILLAGE_INFO
+        # 之后再写入逐网格统计、分区统计和可选的压缩水深过程（每个方案一行），这些附加结果写入失败只记录警告
+        max_flood_area = int(np.max(flooded_area))
+        success = sqlserver_handler.replace_scheme_results(
+            scheme_name,
+            section_records,
+            floodarea_records,
+            cell_summary_records=cell_summary_records,
+            depth_series=depth_data if STORE_DEPTH_SERIES_BLOB else None,
+            status=1,
+            max_flood_area=max_flood_area,
+            village_info=village_info,
+            zone_stats_records=zone_stats_records
+        )
+        if not success:
+            logger.warning("方案结果写入失败")
         
         logger.info("数据库写入完成")
         
@@ -536,54 +470,80 @@ def set_2d_hydrodynamic_data():
         logger.error(f"调用POST接口时出错: {e}")
         # POST失败不影响主流程
 
-    # ---------------------------
-    # 下面是对流速的处理
-    # logger.info("开始计算每个网格的x方向流速平均值...")
-    # cells_velocity_x = velocity_to_cells(
-    #     cells_facepoint_indexes_data, velocity_u, real_mesh)
-    # logger.info("x方向流速平均值计算完毕")
-    # logger.info("开始计算每个网格的y方向流速平均值...")
-    # cells_velocity_y = velocity_to_cells(
-    #     cells_facepoint_indexes_data, velocity_v, real_mesh)
-    # logger.info("y方向流速平均值计算完毕")
-    # # 写入数据库
-    # logger.info("开始将水深和流量写入数据库中")
-    # # 生成水深和流量数据的时间序列
-    # depth_q_time_list = time_format_converter.generate_result_timestep(ymdhm_start, ymdhm_end)
-    # # 将水深和流量数据写入数据库
-    # sqlserver_handler.depth_to_mysql(table_out_depth, depth_q_time_list, depth_data)
-    # sqlserver_handler.q_to_mysql(table_out_q, depth_q_time_list, outflow_data)
-    # logger.info("写入完成")
-
-    # 将x和y方向的流速作为属性写入shp点文件中
-    # gdal_handler = GDALHandler()
-    # for i, row in enumerate(velocity_u):  # i代表第i个时间步，row代表第i个时间步下所有网格顶点的流速数据
-    #     gdal_handler.write_shp(f'./velocity/point{i}.shp', facepoints_coordinate_data, row, velocity_v[i])
-    #     gdal_handler.insert_raster(f'./velocity/point{i}.shp', f'./velocity/point_u{i}.tif')
-    #     gdal_handler.insert_raster(f'./velocity/point{i}.shp', f'./velocity/point_v{i}.tif')
-    #     # 从插值后的tif文件中读取cells中心点坐标对应栅格的像元值
-    #     gdal_handler.read_tif_data(f'./velocity/point_u{i}.tif', cells_coordinate_data)
-    #     gdal_handler.read_tif_data(f'./velocity/point_v{i}.tif', cells_coordinate_data)
-    #
-    #     if (i + 1) % 10 == 0:
-    #         logger.info(f'第{i + 1}个时间步已处理完成')
-
-    # ...主流程结束，准备异步处理max_water_area.shp
-    threading.Thread(
-        target=postprocess_max_water_area_shp,
-        args=(output_path, logger),
-        daemon=True
-    ).start()
+    # ...主流程结束，提交GIS进程池异步生成最大淹没范围
+    # 网格拓扑在提交前从本次的.p01.hdf保存为快照，GIS进程读取快照，不受下一次计算改写HDF的影响
+    try:
+        max_depth_file = os.path.join(output_path, "max_depth.npy")
+        np.save(max_depth_file, depth_data[max_index])
+        topology_file = save_mesh_topology(os.path.join(output_path, "mesh_topology.npz"), p01_hdf_path,
+                                           int(real_mesh), os.path.splitext(shp_path)[0] + '.prj')
+        gis_worker_pool.submit(scheme_name, 'max_water_area', output_path=output_path, topology_file=topology_file,
+                               depth_file=max_depth_file, pyramid_tolerances=EXTENT_PYRAMID_TOLERANCES)
+    except Exception as e:
+        logger.error(f"提交最大淹没范围GIS任务失败: {e}")
+
+    # 提交GIS进程池异步生成逐时间步淹没范围矢量瓦片
+    if EXPORT_FLOOD_TILES:
+        try:
+            gis_worker_pool.submit(scheme_name, 'flood_tiles', output_path=output_path,
+                                   hdf5_file_path=hdf5_file_path, shp_path=shp_path, scheme_name=scheme_name,
+                                   min_zoom=TILE_MIN_ZOOM, max_zoom=TILE_MAX_ZOOM, step_interval=TILE_STEP_INTERVAL,
+                                   max_workers=TILE_WORKERS)
+        except Exception as e:
+            logger.error(f"提交矢量瓦片GIS任务失败: {e}")
+
+    # 提交GIS进程池异步导出逐时间步水深的Parquet数据集
+    if EXPORT_DEPTH_PARQUET:
+        try:
+            gis_worker_pool.submit(scheme_name, 'depth_parquet', output_path=output_path,
+                                   hdf5_file_path=hdf5_file_path, shp_path=shp_path)
+        except Exception as e:
+            logger.error(f"提交水深Parquet导出GIS任务失败: {e}")
+
+    # 提交GIS进程池异步输出水深COG栅格
+    if EXPORT_DEPTH_COG:
+        try:
+            gis_worker_pool.submit(scheme_name, 'depth_rasters', output_path=output_path,
+                                   hdf5_file_path=hdf5_file_path, shp_path=shp_path,
+                                   resolution=RASTER_RESOLUTION, step_interval=RASTER_STEP_INTERVAL)
+        except Exception as e:
+            logger.error(f"提交水深COG栅格GIS任务失败: {e}")
     return "success"
 
 
+@app.route('/gis_status', methods=['get'])
+def gis_status():
+    """
+    查询GIS后处理任务的状态和耗时
+    :return: 任务列表，可通过scheme_name参数只返回某个方案的任务
+    """
+    scheme_name = request.args.get("scheme_name")
+    return jsonify(gis_worker_pool.status(scheme_name))
+
+
+@app.route('/ras_status', methods=['get'])
+def ras_status():
+    """
+    查询HEC-RAS计算的状态、进度和预计剩余时间
+    :return: 任务列表，可通过scheme_name参数只返回某个方案的计算
+    """
+    scheme_name = request.args.get("scheme_name")
+    return jsonify(ras_runner.status(scheme_name))
+
+
 if __name__ == '__main__':
+    init_app()
     # 调试时用这行代码启动服务器
     app.run(host="0.0.0.0", port=19998, debug=False)
 
     # 以下代码在正式生产环境用
-    # server = WSGIServer(app.config["SERVER_NAME"] ,app)
+    # server = WSGIServer(app.config["SERVER_NAME"] , app)  # init_app()已在上面调用；由外部WSGI服务器加载时使用create_app()
     # server.serve_forever()
 
 # if __name__ == "__main__":
-#     postprocess_max_water_area_shp(r"D:\Desktop\20250415fzl\1", logger)
+#     from gis_worker import max_water_area_task
+#     from flood_extent import save_mesh_topology
+#     topology_file = save_mesh_topology(r"D:\Desktop\20250415fzl\1\mesh_topology.npz",
+#                                        r"D:\Desktop\20250415fzl\FZLall.p01.hdf", real_mesh,
+#                                        r"D:\Desktop\20250415fzl\fanwei\fanwei.prj")
+#     max_water_area_task(r"D:\Desktop\20250415fzl\1", topology_file, r"D:\Desktop\20250415fzl\1\max_depth.npy")
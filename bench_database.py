@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+"""
+数据库吞吐量基准测试脚本
+按一次真实计算的写库过程（FLOOD_REHEARSAL、FLOOD_SECTION、FLOODAREA、FLOOD_CELL_SUMMARY）回放写入，
+统计每种写入方式的耗时、行/秒、往返次数和打开的连接数
+默认使用本地SQLite模拟库（可配置每次往返的延迟来模拟网络），设置BENCH_BACKEND=sqlserver时连接config.py中的SQL Server
+
+用法：
+    python bench_database.py
+    BENCH_LATENCY=0.002 BENCH_CELLS=60000 python bench_database.py
+"""
+import os
+import time
+
+import numpy as np
+
+from post_processor import PostProcessor
+from sql_backend import SQLiteBackend, PyMSSQLBackend
+from sqlserver_handler import SQLServerHandler, FLOOD_SECTION_COLUMNS, FLOODAREA_COLUMNS
+from time_format_converter import TimeFormatConverter
+from logger import logger
+
+
+def seed_scheme(backend, scheme_name, ymdhm_start, ymdhm_end, hours):
+    """在模拟库中准备方案的起止时间和各水库出库流量"""
+    times = TimeFormatConverter().generate_result_timestep(ymdhm_start, ymdhm_end, interval=60)
+    cal_info = ",".join(["300"] * hours)
+    backend.execute_many("DELETE FROM hps_dsp_result_scheme WHERE scheme_name = ?", [(scheme_name,)])
+    backend.execute_many("DELETE FROM hps_dsp_result_rsvr_dat WHERE scheme_name = ?", [(scheme_name,)])
+    backend.execute_many("INSERT INTO hps_dsp_result_scheme VALUES (?, ?, ?, ?)",
+                         [(scheme_name, ymdhm_start + ":00", ymdhm_end + ":00", cal_info)])
+    backend.execute_many("INSERT INTO hps_dsp_result_rsvr_dat VALUES (?, ?, ?, ?, ?, ?)",
+                         [(scheme_name, reservoir_id, t + ":00", 100.0, 10.0, 50.0)
+                          for reservoir_id in (1039, 1041, 1043) for t in times])
+
+
+def build_records(scheme_name, num_sections, num_timesteps, num_cells):
+    """构造与真实计算同量级的写库记录"""
+    rng = np.random.default_rng(0)
+    time_strs = TimeFormatConverter().generate_result_timestep("2025-04-09 00:00", "2025-04-12 00:00")[:num_timesteps]
+    time_date_stamp = np.array([f"{t}:00".encode('utf-8') for t in time_strs], dtype='S19')
+
+    section_records = [(section_id, f"断面{section_id}", scheme_name, f"{t}:00", float(z), 0, float(q))
+                       for section_id in range(1, num_sections + 1)
+                       for t, z, q in zip(time_strs, rng.uniform(60, 80, num_timesteps),
+                                          rng.uniform(0, 3000, num_timesteps))]
+    floodarea_records = [(f"{t}:00", float(a), scheme_name) for t, a in zip(time_strs, rng.uniform(0, 50, num_timesteps))]
+
+    depth_data = np.clip(rng.normal(0.0, 0.6, size=(num_timesteps, num_cells)), 0, None)
+    cell_summary = PostProcessor().summarize_cells(depth_data)
+    cell_summary_records = SQLServerHandler.build_cell_summary_records(scheme_name, cell_summary, time_date_stamp)
+    return section_records, floodarea_records, cell_summary_records
+
+
+def legacy_write(handler, scheme_name, section_records, floodarea_records, cell_summary_records):
+    """改造前的写库方式：追加插入FLOOD_REHEARSAL，逐行executemany写入各结果表，每张表单独连接"""
+    handler.insert_flood_rehearsal(scheme_name, "/root/fzl_flood", scheme_name, 0, status=0)
+    handler.update_flood_rehearsal_status(scheme_name, 1, 10)
+    for table, columns, records in (("FLOOD_SECTION", FLOOD_SECTION_COLUMNS, section_records),
+                                    ("FLOODAREA", FLOODAREA_COLUMNS, floodarea_records),
+                                    ("FLOOD_CELL_SUMMARY", ["FLOOD_NAME", "CELL_ID", "MAX_DEPTH", "MAX_TIME",
+                                                            "FIRST_WET_TIME", "FLOOD_HOURS"], cell_summary_records)):
+        conn = handler._get_connect()
+        cursor = conn.cursor()
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        cursor.executemany(query, records)
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+def replace_write(handler, scheme_name, section_records, floodarea_records, cell_summary_records):
+    """当前的写库方式：FLOOD_REHEARSAL按方案名更新或插入，核心结果表在一个事务中整体替换，附加结果表随后单独替换"""
+    handler.upsert_flood_rehearsal(scheme_name, "/root/fzl_flood", scheme_name, 0, status=0)
+    handler.replace_scheme_results(scheme_name, section_records, floodarea_records,
+                                   cell_summary_records=cell_summary_records, status=1, max_flood_area=10)
+
+
+def run_case(name, func, handler, backend, repeat, *args):
+    backend.stats.reset()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(handler, *args)
+    elapsed = time.perf_counter() - start
+    stats = backend.stats
+    logger.info(f"[{name}] 重复{repeat}次, 耗时: {elapsed:.2f}s, 写入行数: {stats.rows_written}, "
+                f"行/s: {stats.rows_written / max(elapsed, 1e-9):.0f}, 往返次数: {stats.round_trips}, "
+                f"打开连接数: {stats.connections}")
+    return elapsed, stats.rows_written, stats.round_trips, stats.connections
+
+
+def bench_database():
+    # ========== 配置部分 - 可通过环境变量修改 ==========
+    backend_name = os.environ.get("BENCH_BACKEND", "sqlite")
+    latency = float(os.environ.get("BENCH_LATENCY", 0.0))
+    num_sections = int(os.environ.get("BENCH_SECTIONS", 21))
+    num_timesteps = int(os.environ.get("BENCH_TIMESTEPS", 433))
+    num_cells = int(os.environ.get("BENCH_CELLS", 30000))
+    repeat = int(os.environ.get("BENCH_REPEAT", 2))
+    scheme_name = "基准测试方案"
+
+    if backend_name == "sqlserver":
+        from config import SQLSERVER_HOST, SQLSERVER_PORT, SQLSERVER_USER, SQLSERVER_PASSWORD, SQLSERVER_DATABASE
+        backend = PyMSSQLBackend(SQLSERVER_HOST, SQLSERVER_PORT, SQLSERVER_USER, SQLSERVER_PASSWORD,
+                                 SQLSERVER_DATABASE, latency=latency)
+    else:
+        backend = SQLiteBackend(os.environ.get("BENCH_SQLITE_PATH"), latency=latency)
+        seed_scheme(backend, scheme_name, "2025-04-09 00:00", "2025-04-11 23:00", 72)
+    handler = SQLServerHandler(None, None, None, None, None, backend=backend)
+
+    logger.info(f"后端: {backend_name}, 每次往返延迟: {latency * 1000:.1f}ms")
+    if backend_name != "sqlserver":
+        backend.stats.reset()
+        ymdhm_start, ymdhm_end = handler.get_start_end_time(scheme_name)
+        xq_list = handler.q_from_table(scheme_name, ymdhm_start, ymdhm_end)
+        logger.info(f"读取边界条件: {ymdhm_start} - {ymdhm_end}, 形状: {xq_list.shape}, "
+                    f"往返次数: {backend.stats.round_trips}, 打开连接数: {backend.stats.connections}")
+
+    records = build_records(scheme_name, num_sections, num_timesteps, num_cells)
+    logger.info(f"FLOOD_SECTION {len(records[0])}条, FLOODAREA {len(records[1])}条, "
+                f"FLOOD_CELL_SUMMARY {len(records[2])}条")
+
+    results = {
+        'legacy': run_case("逐行追加写入", legacy_write, handler, backend, repeat, scheme_name, *records),
+    }
+    if backend_name != "sqlserver":
+        counts = [backend.query(f"SELECT COUNT(*) FROM {t} WHERE FLOOD_NAME = ?", (scheme_name,))[0][0]
+                  for t in ("FLOOD_REHEARSAL", "FLOOD_SECTION", "FLOODAREA", "FLOOD_CELL_SUMMARY")]
+        logger.info(f"逐行追加写入{repeat}次后各表行数(FLOOD_REHEARSAL/FLOOD_SECTION/FLOODAREA/FLOOD_CELL_SUMMARY): {counts}")
+        backend.execute_script("DELETE FROM FLOOD_REHEARSAL; DELETE FROM FLOOD_SECTION; DELETE FROM FLOODAREA; "
+                               "DELETE FROM FLOOD_CELL_SUMMARY;")
+
+    results['replace'] = run_case("事务整体替换", replace_write, handler, backend, repeat, scheme_name, *records)
+    if backend_name != "sqlserver":
+        counts = [backend.query(f"SELECT COUNT(*) FROM {t} WHERE FLOOD_NAME = ?", (scheme_name,))[0][0]
+                  for t in ("FLOOD_REHEARSAL", "FLOOD_SECTION", "FLOODAREA", "FLOOD_CELL_SUMMARY")]
+        logger.info(f"事务整体替换{repeat}次后各表行数(FLOOD_REHEARSAL/FLOOD_SECTION/FLOODAREA/FLOOD_CELL_SUMMARY): {counts}")
+
+    logger.info("=" * 60)
+    logger.info(f"{'方式':<10}{'耗时(s)':>10}{'行/s':>12}{'往返次数':>10}{'连接数':>8}")
+    for name, (elapsed, rows, round_trips, connections) in results.items():
+        logger.info(f"{name:<10}{elapsed:>10.2f}{rows / max(elapsed, 1e-9):>12.0f}{round_trips:>10}{connections:>8}")
+
+
+if __name__ == '__main__':
+    logger.info("=" * 60)
+    logger.info("开始数据库吞吐量基准测试")
+    logger.info("=" * 60)
+
+    bench_database()
+
+    logger.info("=" * 60)
+    logger.info("测试完成")
+    logger.info("=" * 60)
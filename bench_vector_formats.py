@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+"""
+GIS图层输出格式基准测试脚本
+分别用FlatGeobuf、GeoPackage和Shapefile输出最大淹没面积图层和逐时间步水深图层，统计写入耗时和文件大小
+默认使用合成的规则网格，设置BENCH_SHP为参考shp网格（如fanwei.shp）路径时使用真实网格
+
+用法：
+    python bench_vector_formats.py
+    BENCH_SHP=/root/Foziling_Model_1129_3/fanwei/fanwei.shp BENCH_TIMESTEPS=6 python bench_vector_formats.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from geometry_store import CellGeometryStore, load_geometry_store
+from vector_writer import FORMATS, layer_size, write_layer, write_timestep_layers
+from logger import logger
+
+
+def synthetic_store(num_cells):
+    """构造边长20m的规则网格，坐标系为UTM 50N"""
+    import pandas as pd
+    import shapely
+
+    cols = int(np.ceil(np.sqrt(num_cells)))
+    fid = np.arange(num_cells)
+    x0 = 500000 + (fid % cols) * 20.0
+    y0 = 3500000 + (fid // cols) * 20.0
+    geometry = shapely.box(x0, y0, x0 + 20, y0 + 20)
+    from pyproj import Transformer
+    transformer = Transformer.from_crs("EPSG:32650", "EPSG:4326", always_xy=True)
+    geometry_wgs84 = shapely.transform(geometry, lambda coords: np.column_stack(
+        transformer.transform(coords[:, 0], coords[:, 1])))
+    attributes = pd.DataFrame({'Area': np.full(num_cells, 400.0)})
+    return CellGeometryStore("EPSG:32650", geometry, geometry_wgs84, attributes)
+
+
+def bench_vector_formats():
+    # ========== 配置部分 - 可通过环境变量修改 ==========
+    shp_path = os.environ.get("BENCH_SHP")
+    num_cells = int(os.environ.get("BENCH_CELLS", 60000))
+    num_timesteps = int(os.environ.get("BENCH_TIMESTEPS", 3))
+
+    store = load_geometry_store(shp_path) if shp_path else synthetic_store(num_cells)
+    num_cells = len(store)
+    rng = np.random.default_rng(0)
+    depth_data = np.clip(rng.normal(0.0, 0.6, size=(num_timesteps, num_cells)), 0, None)
+    logger.info(f"网格数: {num_cells}, 时间步数: {num_timesteps}")
+
+    output_dir = tempfile.mkdtemp(prefix="bench_vector_")
+    results = {}
+    try:
+        for fmt in FORMATS:
+            gdf = store.to_geodataframe({'depth_max': depth_data.max(axis=0)})
+            start = time.perf_counter()
+            path = write_layer(gdf, output_dir, "max_water_area", fmt)
+            max_elapsed = time.perf_counter() - start
+            max_size = layer_size(path)
+
+            fmt_dir = os.path.join(output_dir, fmt)
+            os.makedirs(fmt_dir)
+            start = time.perf_counter()
+            paths = write_timestep_layers(store, depth_data, fmt_dir, fmt)
+            step_elapsed = time.perf_counter() - start
+            step_size = sum(layer_size(p) for p in paths)
+
+            results[fmt] = (max_elapsed, max_size, step_elapsed, step_size)
+            logger.info(f"[{fmt}] 最大淹没图层: {max_elapsed:.2f}s, {max_size / 1024 / 1024:.1f}MB; "
+                        f"逐时间步图层: {step_elapsed:.2f}s, {step_size / 1024 / 1024:.1f}MB")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    logger.info("=" * 60)
+    logger.info(f"{'格式':<8}{'最大图层(s)':>14}{'大小(MB)':>10}{'逐时间步(s)':>14}{'大小(MB)':>10}")
+    for fmt, (max_elapsed, max_size, step_elapsed, step_size) in results.items():
+        logger.info(f"{fmt:<8}{max_elapsed:>14.2f}{max_size / 1024 / 1024:>10.1f}"
+                    f"{step_elapsed:>14.2f}{step_size / 1024 / 1024:>10.1f}")
+
+
+if __name__ == '__main__':
+    logger.info("=" * 60)
+    logger.info("开始GIS图层输出格式基准测试")
+    logger.info("=" * 60)
+
+    bench_vector_formats()
+
+    logger.info("=" * 60)
+    logger.info("测试完成")
+    logger.info("=" * 60)
@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+"""
+网格面积
+直接从HEC-RAS结果文件的Geometry组获得每个网格的面积：有Cells Surface Area数据集时直接读取，
+否则由Cells FacePoint Indexes和FacePoints Coordinate用鞋带公式向量化计算；
+结果按模型缓存（进程内和.npz），签名只由文件元数据得到，命中缓存时不读取网格数据：
+网格数、顶点数，以及计划引用的几何文件（.g01/.g01.hdf）的修改时间和大小；找不到几何文件时退回到结果文件本身的修改时间和大小
+"""
+import os
+import threading
+
+import h5py
+import numpy as np
+
+from logger import logger
+
+
+_lock = threading.Lock()
+# 进程内缓存：{(HDF绝对路径, 真实网格数): (签名, 网格面积)}
+_areas = {}
+
+
+def compute_cell_areas(cells_facepoint_indexes, facepoints_coordinate):
+    """
+    鞋带公式计算网格面积
+    :param cells_facepoint_indexes: Cells FacePoint Indexes，(网格数, 最大顶点数)，不足的位置为-1
+    :param facepoints_coordinate: FacePoints Coordinate，(顶点数, 2)
+    :return: 网格面积(m²)
+    """
+    indexes = np.asarray(cells_facepoint_indexes, dtype=np.int64)
+    # 不足的位置用第一个顶点补齐，补齐部分的边长度为0，不影响面积
+    indexes = np.where(indexes >= 0, indexes, indexes[:, :1])
+    coords = np.asarray(facepoints_coordinate, dtype=np.float64)
+    x = coords[indexes, 0]
+    y = coords[indexes, 1]
+    # 以第一个顶点为原点，减小大坐标相乘的舍入误差
+    x -= x[:, :1]
+    y -= y[:, :1]
+    x_next = np.roll(x, -1, axis=1)
+    y_next = np.roll(y, -1, axis=1)
+    return 0.5 * np.abs((x * y_next - x_next * y).sum(axis=1))
+
+
+def geometry_signature(f, p01_hdf_path, real_mesh):
+    """
+    网格几何的签名，只读取数据集形状和文件元数据
+    结果文件每次计算前都会被改写，修改时间不能反映几何是否变化，因此优先使用计划引用的几何文件
+    :param f: 打开的.p01.hdf
+    :return: 整数元组
+    """
+    area = f['Geometry']['2D Flow Areas']['Perimeter 1']
+    signature = [int(real_mesh), *area['Cells FacePoint Indexes'].shape, *area['FacePoints Coordinate'].shape]
+    geometry_files = []
+    geometry_filename = f['Plan Data']['Plan Information'].attrs.get('Geometry Filename') \
+        if 'Plan Data' in f and 'Plan Information' in f['Plan Data'] else None
+    if geometry_filename is not None:
+        if isinstance(geometry_filename, bytes):
+            geometry_filename = geometry_filename.decode('utf-8', errors='replace')
+        # 计划中记录的可能是Windows下的绝对路径，只取文件名，在结果文件所在目录中查找
+        name = os.path.basename(str(geometry_filename).replace('\\', '/'))
+        directory = os.path.dirname(os.path.abspath(p01_hdf_path))
+        geometry_files = [path for path in (os.path.join(directory, name), os.path.join(directory, name + '.hdf'))
+                          if name and os.path.exists(path)]
+    for path in geometry_files or [p01_hdf_path]:
+        stat = os.stat(path)
+        signature.extend([stat.st_mtime_ns, stat.st_size])
+    return tuple(signature)
+
+
+def load_cell_areas(p01_hdf_path, real_mesh, cache_file=None):
+    """
+    读取每个网格的面积，进程内只在网格几何变化时重新计算
+    :param p01_hdf_path: .p01.hdf文件路径
+    :param real_mesh: 真实网格数（PostProcessor.get_real_mesh的返回值）
+    :param cache_file: 二进制缓存文件路径，默认与HDF同目录的.cell_area.npz
+    :return: 长度为real_mesh的网格面积(m²)
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(p01_hdf_path)[0] + ".cell_area.npz"
+    key = (os.path.abspath(p01_hdf_path), int(real_mesh))
+    with h5py.File(p01_hdf_path, 'r') as f:
+        area = f['Geometry']['2D Flow Areas']['Perimeter 1']
+        if 'Cells Surface Area' in area:
+            return area['Cells Surface Area'][:real_mesh].astype(np.float64)
+
+        signature = geometry_signature(f, p01_hdf_path, real_mesh)
+        with _lock:
+            cached = _areas.get(key)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+            cell_areas = None
+            if os.path.exists(cache_file):
+                try:
+                    with np.load(cache_file) as cache:
+                        if tuple(cache['signature'].tolist()) == signature:
+                            cell_areas = cache['areas']
+                except Exception as e:
+                    logger.warning(f"网格面积缓存读取失败，将重新计算: {e}")
+            if cell_areas is None:
+                cell_areas = compute_cell_areas(area['Cells FacePoint Indexes'][:real_mesh],
+                                                area['FacePoints Coordinate'][:])
+                try:
+                    np.savez(cache_file, signature=np.array(signature, dtype=np.int64), areas=cell_areas)
+                    logger.info(f"网格面积已编译为缓存: {cache_file}")
+                except OSError as e:
+                    logger.warning(f"网格面积缓存写入失败: {e}")
+            _areas[key] = (signature, cell_areas)
+            logger.info(f"成功加载{len(cell_areas)}个网格的面积，总面积: {cell_areas.sum() / 1e6:.2f}km²")
+            return cell_areas
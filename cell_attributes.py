@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+"""
+网格静态属性表
+从HEC-RAS的Geometry组读取高程等静态属性，与参考shp网格逐行对齐后写入每个模型一份的列式属性文件（Parquet），
+不再改写shapefile；对齐优先使用shp中的网格编号字段，没有编号字段时用网格中心点的空间索引匹配，
+未匹配或重复匹配的网格记录在日志中，不会静默截断
+依赖pyarrow
+"""
+import os
+import time
+
+import h5py
+import numpy as np
+import shapely
+
+from geometry_store import load_geometry_store
+from logger import logger
+
+
+# 属性名与Geometry/2D Flow Areas/Perimeter 1下数据集名称的对应关系，HDF中没有的数据集跳过
+STATIC_DATASETS = {
+    'elevation': 'Cells Minimum Elevation',
+    'surface_area': 'Cells Surface Area',
+    'mannings_n': "Cells Center Manning's n",
+}
+
+# 对齐方式
+MATCH_ID = 1
+MATCH_SPATIAL = 2
+MATCH_NONE = 0
+
+
+def read_static_attributes(hdf_path):
+    """
+    读取真实网格的中心点坐标和静态属性
+    :return: (centers, attributes)，centers为(网格数, 2)，attributes为{属性名: 数组}
+    """
+    from post_processor import PostProcessor
+
+    with h5py.File(hdf_path, 'r') as f:
+        area = f['Geometry']['2D Flow Areas']['Perimeter 1']
+        elevation = area['Cells Minimum Elevation'][:]
+        real_mesh = PostProcessor().get_real_mesh(elevation)
+        centers = area['Cells Center Coordinate'][:real_mesh]
+        attributes = {name: area[dataset][:real_mesh] for name, dataset in STATIC_DATASETS.items() if dataset in area}
+    return centers, attributes
+
+
+def default_max_distance(geometry_store):
+    """就近匹配的默认最大距离：shp多边形面积中位数的平方根，约为一个网格的边长"""
+    return float(np.sqrt(np.median(shapely.area(geometry_store.geometry))))
+
+
+def align_cells(geometry_store, centers, id_field=None, max_distance=None):
+    """
+    求参考shp网格每一行对应的HEC-RAS网格编号
+    :param geometry_store: geometry_store.CellGeometryStore
+    :param centers: HEC-RAS网格中心点坐标，(网格数, 2)
+    :param id_field: shp中的网格编号字段，为None或不存在时按空间位置匹配
+    :param max_distance: 不包含任何网格中心点的多边形就近匹配的最大距离（模型坐标系单位），
+        为None时取网格边长（shp多边形面积中位数的平方根），超出该距离的多边形不匹配
+    :return: (cell_ids, match)，均为长度等于shp行数的数组，未匹配的cell_ids为-1，match为MATCH_*
+    """
+    num_rows, num_cells = len(geometry_store), len(centers)
+    cell_ids = np.full(num_rows, -1, dtype=np.int64)
+    match = np.full(num_rows, MATCH_NONE, dtype=np.int8)
+
+    if id_field is not None and id_field in geometry_store.attributes.columns:
+        ids = geometry_store.attributes[id_field].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = np.isfinite(ids) & (ids >= 0) & (ids < num_cells)
+        cell_ids[valid] = ids[valid].astype(np.int64)
+        match[valid] = MATCH_ID
+        if not valid.all():
+            logger.warning(f"shp中有{int((~valid).sum())}行的{id_field}超出HDF网格编号范围[0, {num_cells})")
+        return cell_ids, match
+
+    if id_field is not None:
+        logger.warning(f"shp中未找到网格编号字段'{id_field}'，改为按网格中心点的空间位置匹配")
+    points = shapely.points(centers)
+    center_tree = shapely.STRtree(points)
+    rows, cells = center_tree.query(geometry_store.geometry, predicate='contains')
+    # 一个多边形包含多个中心点时取第一个
+    rows, first = np.unique(rows, return_index=True)
+    cell_ids[rows] = cells[first]
+    match[rows] = MATCH_SPATIAL
+
+    missing = np.flatnonzero(match == MATCH_NONE)
+    if len(missing):
+        if max_distance is None:
+            max_distance = default_max_distance(geometry_store)
+        nearest = center_tree.query_nearest(geometry_store.geometry[missing], max_distance=max_distance,
+                                            all_matches=False)
+        cell_ids[missing[nearest[0]]] = nearest[1]
+        match[missing[nearest[0]]] = MATCH_SPATIAL
+    return cell_ids, match
+
+
+def build_cell_attributes(hdf_path, shp_path, output_path=None, id_field=None, max_distance=None):
+    """
+    生成网格静态属性表并写入列式属性文件
+    :param hdf_path: HEC-RAS的.hdf文件（几何或结果文件）
+    :param shp_path: 参考shp网格路径
+    :param output_path: 属性文件路径，默认与shp同目录的.attributes.parquet
+    :param id_field: 见align_cells
+    :param max_distance: 见align_cells
+    :return: 属性表（pandas.DataFrame），fid为shp行号，cell_id为对应的HEC-RAS网格编号（未匹配为-1）
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    if output_path is None:
+        output_path = os.path.splitext(shp_path)[0] + ".attributes.parquet"
+    centers, attributes = read_static_attributes(hdf_path)
+    geometry_store = load_geometry_store(shp_path)
+    cell_ids, match = align_cells(geometry_store, centers, id_field, max_distance)
+
+    matched = cell_ids >= 0
+    table = pd.DataFrame({'fid': np.arange(len(geometry_store), dtype=np.int64), 'cell_id': cell_ids, 'match': match})
+    lookup = np.where(matched, cell_ids, 0)
+    table['center_x'] = np.where(matched, centers[lookup, 0], np.nan)
+    table['center_y'] = np.where(matched, centers[lookup, 1], np.nan)
+    for name, values in attributes.items():
+        table[name] = np.where(matched, values[lookup], np.nan)
+
+    duplicated = len(cell_ids[matched]) - len(np.unique(cell_ids[matched]))
+    unused = len(centers) - len(np.unique(cell_ids[matched]))
+    if (~matched).any() or duplicated or unused:
+        logger.warning(f"网格对齐不完整：shp行数{len(geometry_store)}，HDF网格数{len(centers)}，"
+                       f"未匹配的shp行{int((~matched).sum())}，重复匹配{duplicated}，未使用的HDF网格{unused}")
+    if len(cell_ids) == len(centers) and np.array_equal(cell_ids, np.arange(len(centers))):
+        logger.info("shp行号与HDF网格编号一致")
+    else:
+        logger.warning("shp行号与HDF网格编号不一致，使用水深等逐网格结果前需要按cell_id重新排列")
+
+    table.to_parquet(output_path, index=False, compression='zstd')
+    logger.info(f"网格属性表已写入 {output_path}，字段: {table.columns.tolist()}，"
+                f"耗时: {time.perf_counter() - start:.2f}s")
+    return table
+
+
+def read_cell_attributes(path, columns=None):
+    """读取网格属性表"""
+    import pandas as pd
+    return pd.read_parquet(path, columns=columns)
@@ -5,4 +5,51 @@ SQLSERVER_PASSWORD = "wds#WDS9200"
 SQLSERVER_DATABASE = "wds"
 RAS_PATH = "/root/Foziling_Model_1129_3"
 OUTPUT_PATH = "/root/fzl_flood"
-PARSE_HOST = "http://10.34.202.180:9004/planParser"
\ No newline at end of file
+PARSE_HOST = "http://10.34.202.180:9004/planParser"
+# 是否将压缩后的完整水深过程写入FLOOD_DEPTH_SERIES表
+STORE_DEPTH_SERIES_BLOB = False
+# GIS后处理任务文件目录、最大并发进程数，以及已结束的任务文件保留的天数
+GIS_TASK_DIR = "/root/results/gis_tasks"
+GIS_MAX_WORKERS = 2
+GIS_TASK_RETENTION_DAYS = 7
+# 最大淹没面积等GIS图层的输出格式：fgb（FlatGeobuf）、gpkg（GeoPackage）、shp（Shapefile）
+# 下游仍按max_water_area.shp读取结果，shp保留在默认列表中，确认下游都改读fgb后再去掉
+GIS_OUTPUT_FORMATS = ["fgb", "shp"]
+# 是否输出逐时间步淹没范围矢量瓦片（MBTiles），需要另外安装mapbox-vector-tile（pip install mapbox-vector-tile）
+EXPORT_FLOOD_TILES = False
+# 逐时间步淹没范围矢量瓦片：最小/最大级别、每隔多少个时间步输出一次（10分钟一步，6即每小时）、编码进程数
+TILE_MIN_ZOOM = 8
+TILE_MAX_ZOOM = 14
+TILE_STEP_INTERVAL = 6
+TILE_WORKERS = 2
+# 逐网格淹没统计的水深阈值(m)，统计每个网格超过各阈值的累计历时，第一个阈值的历时写入FLOOD_CELL_SUMMARY
+FLOOD_STATS_THRESHOLDS = (0.2, 0.5, 1.0, 2.0)
+# 是否由顶点流速计算洪水危险度（需要在HEC-RAS计划中输出Face Point Velocity），以及是否把最大危险度加入GIS图层
+# 顶点流速数据集的名称尚未用实际结果文件核实（见hazard.NODE_VELOCITY_X），核实前保持关闭
+ENABLE_HAZARD = False
+HAZARD_IN_GIS_LAYERS = True
+# 是否将逐时间步水深导出为列式Parquet数据集（代替逐时间步shapefile）
+EXPORT_DEPTH_PARQUET = True
+# 是否输出水深COG栅格，以及栅格分辨率(m)、每隔多少个时间步输出一次
+EXPORT_DEPTH_COG = True
+RASTER_RESOLUTION = 10
+RASTER_STEP_INTERVAL = 6
+# 村庄点（或面）shp、村庄名称字段、网格范围外的村庄就近匹配网格的最大距离(m)、村庄受影响的水深阈值(m)
+VILLAGE_SHP_PATH = RAS_PATH + "/village/village.shp"
+VILLAGE_NAME_FIELD = "NAME"
+VILLAGE_MAX_DISTANCE = 50.0
+# 村庄受影响的水深阈值同时决定VILLAGE_INFO中的最早淹没时间，必须是FLOOD_STATS_THRESHOLDS中的一个值
+VILLAGE_FLOOD_DEPTH = 0.2
+# 分区（乡镇）面shp、分区名称字段，用于统计各分区逐时间步的淹没面积、平均水深和最大水深
+ZONE_SHP_PATH = RAS_PATH + "/zones/zones.shp"
+ZONE_NAME_FIELD = "NAME"
+# 分级淹没面积的水深等级下限(m)：0.2-0.5、0.5-1、1-2、>2m，第一个值同时是计算淹没面积的水深阈值
+DEPTH_CLASS_BOUNDS = (0.2, 0.5, 1.0, 2.0)
+# 最大淹没范围多级简化金字塔的简化容差(m)，Web端按瓦片级别选用对应的一级
+EXTENT_PYRAMID_TOLERANCES = (2, 10, 50, 200)
+# HEC-RAS每次计算的完整输出日志目录（每个方案一个文件），公共日志只记录计算进度
+RAS_JOB_LOG_DIR = "logs/ras_jobs"
+# HEC-RAS超过该时间(s)没有任何新的输出时判定为发散并提前结束计算，为None时不检查
+# RasUnsteady的输出接到管道上是块缓冲的，可能成批到达，预处理和写结果阶段也可能长时间没有输出；
+# 按真实计算日志确定正常计算的最长无输出间隔之前保持关闭，以免把正常计算当作发散结束
+RAS_STALL_TIMEOUT = None
@@ -0,0 +1,43 @@
+# -*- coding: UTF-8 -*-
+"""
+分级淹没面积
+按时间步分块把水深划分为若干等级（如0.2-0.5、0.5-1、1-2、>2m），用网格面积加权计数，一次遍历得到每个时间步各等级的淹没面积；
+各等级面积之和即为水深超过第一个等级下限的总淹没面积
+"""
+import numpy as np
+
+
+def compute_class_areas(depth_data, cell_areas, class_bounds=(0.2, 0.5, 1.0, 2.0), block_size=36):
+    """
+    计算每个时间步各水深等级的淹没面积
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID；可以是ndarray或h5py数据集（按块读取）
+    :param cell_areas: 每个网格的面积(m²)
+    :param class_bounds: 各等级的水深下限(m)，第k级为(class_bounds[k-1], class_bounds[k]]，最后一级无上限
+    :param block_size: 每块的时间步数
+    :return: (时间步数, 等级数)的淹没面积(m²)
+    """
+    cell_areas = np.asarray(cell_areas, dtype=np.float64)
+    class_bounds = np.asarray(class_bounds, dtype=np.float64)
+    num_steps, num_cells = depth_data.shape[0], len(cell_areas)
+    num_bins = len(class_bounds) + 1
+    areas = np.zeros((num_steps, num_bins), dtype=np.float64)
+    for start in range(0, num_steps, block_size):
+        block = np.asarray(depth_data[start:start + block_size, :num_cells], dtype=np.float32)
+        rows = block.shape[0]
+        # 0为不超过第一个下限（未淹没），1..n依次对应各等级；把(时间步, 等级)展平为一维后一次加权计数
+        classes = np.digitize(block, class_bounds, right=True)
+        classes += np.arange(rows)[:, None] * num_bins
+        areas[start:start + rows] = np.bincount(classes.ravel(), weights=np.tile(cell_areas, rows),
+                                                minlength=rows * num_bins).reshape(rows, num_bins)
+    return areas[:, 1:]
+
+
+def write_class_areas(group, class_areas, class_bounds):
+    """
+    将分级淹没面积写入HDF5数据集（data/2DFlowAreas/DepthClassArea，单位km²）
+    :param group: h5py组
+    :param class_areas: compute_class_areas的返回值(m²)
+    """
+    dataset = group.create_dataset('DepthClassArea', data=class_areas / 1e6)
+    dataset.attrs['class_bounds'] = np.asarray(class_bounds, dtype=np.float64)
+    return dataset
@@ -3,13 +3,13 @@
 # @Author  : wm
 # @Software   : PyCharm
 """
-从p01.hdf文件中读取水深数据，并将结果写入shp网格的属性表中
+从p01.hdf文件中读取水深数据，导出为列式Parquet数据集：网格几何只写一次，逐时间步水深按时间块分区、只保存过水网格
+需要某个时间步的图层时用parquet_export.read_timestep_layer重建，不再逐时间步输出shapefile
 """
 from hdf_handler import HDFHandler
 from post_processor import PostProcessor
-import numpy as np
-import geopandas as gpd
-import os
+from geometry_store import load_geometry_store
+from parquet_export import export_depth_parquet, read_timestep_layer
 
 
 # 从.p01.hdf结果文件中读取需要的数据
@@ -22,32 +22,21 @@ post_processor = PostProcessor()
 # 将Cells中多余的高程为nan的空网格删去
 real_mesh = post_processor.get_real_mesh(cells_minimum_elevation_data)
 # 调用generating_depth方法，用水位减去高程，即得水深值
-depth_data = post_processor.generating_depth(cells_minimum_elevation_data, wse_data, real_mesh)
+depth_data, _ = post_processor.generating_depth(cells_minimum_elevation_data, wse_data, real_mesh)
 
-# 读取原始 shapefile
+# 读取原始 shapefile 的网格几何缓存
 shapefile_path = r'D:\Desktop\Foziling_Model_1013\321.shp'
-gdf = gpd.read_file(shapefile_path)
+geometry_store = load_geometry_store(shapefile_path)
 
 # 检查 shapefile 的记录数是否与 depth_data 的列数相匹配
-if len(gdf) != depth_data.shape[1]:
+if len(geometry_store) != depth_data.shape[1]:
     raise ValueError("Shapefile feature count does not match the depth data column count.")
 
 # 输出目录
-output_dir = 'output_shapefiles'
-os.makedirs(output_dir, exist_ok=True)
+output_dir = 'output_parquet'
+export_depth_parquet(output_dir, depth_data, geometry_store=geometry_store)
 
-# 遍历每个时间步
-for i in range(depth_data.shape[0]):
-    # 为当前时间步创建一个新的 GeoDataFrame
-    gdf_copy = gdf.copy()
+# 示例：重建第0个时间步的图层，需要shapefile时可再写出
+# read_timestep_layer(output_dir, 0).to_file('depth_timestep_0.shp', driver='ESRI Shapefile')
 
-    # 添加新的列，命名为 'Depth_Timestep_i'，并将当前时间步的水深数据填入
-    gdf_copy[f'Depth_Timestep_{i}'] = depth_data[i]
-
-    # 构建输出文件路径
-    output_shapefile_path = os.path.join(output_dir, f'depth_timestep_{i}.shp')
-
-    # 保存新的 shapefile
-    gdf_copy.to_file(output_shapefile_path, driver='ESRI Shapefile')
-
-print("Shapefiles generated successfully.")
+print("Parquet dataset generated successfully.")
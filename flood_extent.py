@@ -0,0 +1,304 @@
+# -*- coding: UTF-8 -*-
+"""
+基于网格拓扑生成淹没范围
+利用Cells FacePoint Indexes和FacePoints Coordinate，找出湿网格与干网格（或模型边界）之间的边，
+直接首尾相连拼成环，不需要对所有湿网格做unary_union
+"""
+import json
+import math
+import os
+import time
+
+import h5py
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, MultiPolygon, mapping
+
+from logger import logger
+
+
+def read_mesh_topology(p01_hdf_path, real_mesh):
+    """
+    从HDF的Geometry组中读取网格拓扑
+    :param p01_hdf_path: .p01.hdf文件路径
+    :param real_mesh: 真实网格数（PostProcessor.get_real_mesh的返回值）
+    :return: (cells_facepoint_indexes, facepoints_coordinate)，前者为(网格数, 最大顶点数)的数组，不足的位置为-1
+    """
+    with h5py.File(p01_hdf_path, 'r') as f:
+        area = f['Geometry']['2D Flow Areas']['Perimeter 1']
+        cells_facepoint_indexes = area['Cells FacePoint Indexes'][:real_mesh]
+        facepoints_coordinate = area['FacePoints Coordinate'][:]
+    return cells_facepoint_indexes, facepoints_coordinate
+
+
+def read_model_crs(p01_hdf_path, prj_path=None):
+    """
+    读取模型的坐标系（WKT），优先使用HDF根属性中的Projection，其次使用shp的.prj文件
+    :return: WKT字符串，均不存在时返回None
+    """
+    with h5py.File(p01_hdf_path, 'r') as f:
+        projection = f.attrs.get('Projection')
+    if projection is not None and len(projection) > 0:
+        return projection.decode('utf-8') if isinstance(projection, bytes) else str(projection)
+    if prj_path is not None and os.path.exists(prj_path):
+        with open(prj_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return None
+
+
+def save_mesh_topology(path, p01_hdf_path, real_mesh, prj_path=None):
+    """
+    将网格拓扑和坐标系保存为快照(.npz)
+    异步的GIS任务读取快照而不是HDF，下一次计算改写HDF时不会读到不完整的文件
+    :param path: 快照文件路径
+    :return: 快照文件路径
+    """
+    cells_facepoint_indexes, facepoints_coordinate = read_mesh_topology(p01_hdf_path, real_mesh)
+    src_crs = read_model_crs(p01_hdf_path, prj_path)
+    # 先写临时文件再改名，np.savez会给没有.npz后缀的文件名补上后缀
+    tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, cells_facepoint_indexes=cells_facepoint_indexes, facepoints_coordinate=facepoints_coordinate,
+             crs=np.array(src_crs or ''))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_mesh_topology(path):
+    """
+    读取save_mesh_topology保存的快照
+    :return: (cells_facepoint_indexes, facepoints_coordinate, 坐标系WKT)，没有坐标系时WKT为None
+    """
+    with np.load(path) as data:
+        src_crs = str(data['crs'])
+        return data['cells_facepoint_indexes'], data['facepoints_coordinate'], src_crs or None
+
+
+def _oriented_cells(cells_facepoint_indexes, facepoints_coordinate):
+    """
+    将每个网格的顶点统一为逆时针顺序
+    :return: (oriented, counts)，oriented与输入形状相同，counts为每个网格的顶点数
+    """
+    valid = cells_facepoint_indexes >= 0
+    counts = valid.sum(axis=1)
+    cols = np.arange(cells_facepoint_indexes.shape[1])
+    # 下一个顶点的列号，最后一个有效顶点的下一个顶点为第一个顶点
+    next_cols = np.where(cols + 1 < counts[:, None], cols + 1, 0)
+
+    safe = np.where(valid, cells_facepoint_indexes, 0)
+    x = facepoints_coordinate[safe, 0]
+    y = facepoints_coordinate[safe, 1]
+    x_next = np.take_along_axis(x, next_cols, axis=1)
+    y_next = np.take_along_axis(y, next_cols, axis=1)
+    signed_area = np.where(valid, x * y_next - x_next * y, 0).sum(axis=1)
+
+    # 顺时针的网格将有效顶点反序
+    reverse_cols = np.where(cols < counts[:, None], counts[:, None] - 1 - cols, cols)
+    oriented = np.where((signed_area < 0)[:, None],
+                        np.take_along_axis(cells_facepoint_indexes, reverse_cols, axis=1),
+                        cells_facepoint_indexes)
+    return oriented, counts
+
+
+def boundary_edges(cells_facepoint_indexes, facepoints_coordinate, wet_mask):
+    """
+    找出湿网格区域的边界边
+    所有网格统一为逆时针后，两个相邻湿网格的公共边以相反方向各出现一次，只出现一个方向的边即为边界边
+    :param cells_facepoint_indexes: (网格数, 最大顶点数)，不足的位置为-1
+    :param facepoints_coordinate: (顶点数, 2)
+    :param wet_mask: 长度为网格数的布尔数组
+    :return: (边数, 2)的有向边数组，方向使湿区域位于边的左侧
+    """
+    oriented, counts = _oriented_cells(cells_facepoint_indexes[wet_mask], facepoints_coordinate)
+    cols = np.arange(oriented.shape[1])
+    valid = cols < counts[:, None]
+    next_cols = np.where(cols + 1 < counts[:, None], cols + 1, 0)
+    start = oriented[valid]
+    end = np.take_along_axis(oriented, next_cols, axis=1)[valid]
+
+    num_points = np.int64(len(facepoints_coordinate))
+    keys = start.astype(np.int64) * num_points + end
+    reverse_keys = end.astype(np.int64) * num_points + start
+    is_boundary = ~np.isin(reverse_keys, keys)
+    return np.column_stack((start[is_boundary], end[is_boundary]))
+
+
+def chain_rings(edges):
+    """
+    将有向边首尾相连拼成闭合环
+    :param edges: (边数, 2)的有向边数组
+    :return: 环的列表，每个环为顶点序号数组（首尾不重复）
+    """
+    order = np.argsort(edges[:, 0], kind='stable')
+    sorted_starts = edges[order, 0]
+    used = np.zeros(len(edges), dtype=bool)
+    # 每个起点对应的出边在order中的位置区间，多个出边时（两个湿区域只在一个顶点相接）依次使用
+    cursor = {}
+
+    rings = []
+    for first in order:
+        if used[first]:
+            continue
+        ring = []
+        edge = first
+        while edge is not None and not used[edge]:
+            used[edge] = True
+            ring.append(edges[edge, 0])
+            point = edges[edge, 1]
+            lo = cursor.get(point)
+            if lo is None:
+                lo = np.searchsorted(sorted_starts, point, side='left')
+            hi = np.searchsorted(sorted_starts, point, side='right')
+            edge = None
+            while lo < hi:
+                candidate = order[lo]
+                lo += 1
+                if not used[candidate]:
+                    edge = candidate
+                    break
+            cursor[point] = lo
+        if len(ring) >= 3:
+            rings.append(np.array(ring))
+    return rings
+
+
+def rings_to_geometry(rings, facepoints_coordinate):
+    """
+    将环组装为多边形：逆时针环为外环，顺时针环为洞，洞归入包含它的最小外环
+    :return: Polygon或MultiPolygon，没有环时返回None
+    """
+    shells = []
+    holes = []
+    for ring in rings:
+        coords = facepoints_coordinate[ring]
+        x, y = coords[:, 0], coords[:, 1]
+        signed_area = 0.5 * np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+        (shells if signed_area > 0 else holes).append((abs(signed_area), coords))
+    if not shells:
+        return None
+
+    shell_polygons = [Polygon(coords) for _, coords in shells]
+    shell_areas = np.array([area for area, _ in shells])
+    shell_holes = [[] for _ in shells]
+    if holes:
+        tree = shapely.STRtree(shell_polygons)
+        # 洞的顶点可能落在外环的边界上，用洞多边形内部的点判断包含关系
+        hole_polygons = [Polygon(coords) for _, coords in holes]
+        hole_points = shapely.point_on_surface(hole_polygons)
+        hole_index, shell_index = tree.query(hole_points, predicate='within')
+        best = {}
+        for h, s in zip(hole_index, shell_index):
+            if h not in best or shell_areas[s] < shell_areas[best[h]]:
+                best[h] = s
+        for h, s in best.items():
+            shell_holes[s].append(holes[h][1])
+
+    polygons = [Polygon(shell.exterior.coords, hole_list) for shell, hole_list in zip(shell_polygons, shell_holes)]
+    geometry = polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+    # 只在一个顶点相接的区域可能产生自接触的环，修复为合法几何
+    if not geometry.is_valid:
+        geometry = shapely.make_valid(geometry)
+    return geometry
+
+
+def build_flood_extent(cells_facepoint_indexes, facepoints_coordinate, depth, threshold=0.2):
+    """
+    根据某一时刻各网格的水深生成淹没范围
+    :param cells_facepoint_indexes: (网格数, 最大顶点数)，不足的位置为-1
+    :param facepoints_coordinate: (顶点数, 2)
+    :param depth: 长度为网格数的水深数组
+    :param threshold: 水深大于该值的网格视为淹没
+    :return: 模型坐标系下的Polygon或MultiPolygon，没有淹没网格时返回None
+    """
+    wet_mask = np.asarray(depth) > threshold
+    if not wet_mask.any():
+        return None
+    edges = boundary_edges(cells_facepoint_indexes, facepoints_coordinate, wet_mask)
+    rings = chain_rings(edges)
+    return rings_to_geometry(rings, facepoints_coordinate)
+
+
+def build_flood_extents(cells_facepoint_indexes, facepoints_coordinate, depth_data, threshold=0.2):
+    """
+    逐时间步生成淹没范围
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID
+    :return: 生成器，依次产生(时间步序号, 淹没范围)
+    """
+    for step, depth in enumerate(depth_data):
+        yield step, build_flood_extent(cells_facepoint_indexes, facepoints_coordinate, depth, threshold)
+
+
+def to_wgs84(geometry, src_crs):
+    """
+    将几何从模型坐标系转换为EPSG:4326（经度在前）
+    :param src_crs: 模型坐标系，可以是WKT、EPSG代码或pyproj.CRS
+    """
+    from pyproj import Transformer
+    transformer = Transformer.from_crs(src_crs, "EPSG:4326", always_xy=True)
+    return shapely.transform(geometry, lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])))
+
+
+def write_geojson(geometry, path, properties=None, compact=False):
+    """
+    将单个EPSG:4326几何写为GeoJSON FeatureCollection
+    :param compact: 为True时不输出多余的空格
+    """
+    feature_collection = {
+        "type": "FeatureCollection",
+        "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}},
+        "features": [{"type": "Feature", "properties": properties or {}, "geometry": mapping(geometry)}],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(feature_collection, f, ensure_ascii=False, separators=(',', ':') if compact else None)
+
+
+def _pyramid_zoom(tolerance, latitude):
+    """简化容差不超过一个像元（256像素瓦片）的最大瓦片级别"""
+    pixel_size = 156543.03392804097 * math.cos(math.radians(latitude))
+    return max(0, int(math.floor(math.log2(pixel_size / tolerance))))
+
+
+def write_extent_pyramid(geometry, src_crs, output_dir, name, tolerances=(2, 10, 50, 200)):
+    """
+    由融合后的淹没范围生成多级简化金字塔：每一级在模型坐标系下保持拓扑简化，转换为EPSG:4326后按容差量化坐标，
+    输出为紧凑的GeoJSON（<name>_<容差>m.geojson），并输出<name>_pyramid.json说明每一级对应的瓦片级别，供Web端按级别选择
+    :param geometry: 模型坐标系下的淹没范围
+    :param src_crs: 模型坐标系
+    :param tolerances: 各级简化容差（模型坐标系单位，一般为m）
+    :return: 各级信息列表
+    """
+    latitude = to_wgs84(geometry.centroid, src_crs).y
+    tolerances = sorted(tolerances)
+    levels = []
+    for i, tolerance in enumerate(tolerances):
+        start = time.perf_counter()
+        simplified = shapely.simplify(geometry, tolerance, preserve_topology=True)
+        simplified = to_wgs84(simplified, src_crs)
+        # 坐标量化到容差的十分之一，小数位数随容差减少
+        decimals = min(7, max(3, int(math.ceil(-math.log10(tolerance / 10 / 111320.0)))))
+        simplified = shapely.set_precision(simplified, 10.0 ** -decimals)
+        simplified = shapely.transform(simplified, lambda coords: np.round(coords, decimals))
+
+        file_name = f"{name}_{tolerance:g}m.geojson"
+        path = os.path.join(output_dir, file_name)
+        write_geojson(simplified, path, properties={'tolerance': tolerance}, compact=True)
+        # 最细的一级用于所有更大的级别，其余各级用到容差超过一个像元之前
+        max_zoom = 22 if i == 0 else _pyramid_zoom(tolerance, latitude)
+        levels.append({
+            'file': file_name,
+            'tolerance': tolerance,
+            'max_zoom': max_zoom,
+            'vertices': int(shapely.get_num_coordinates(simplified)),
+            'size': os.path.getsize(path),
+        })
+        logger.info(f"淹没范围金字塔{tolerance:g}m级已输出到 {path}，顶点数: {levels[-1]['vertices']}，"
+                    f"大小: {levels[-1]['size'] / 1024:.1f}KB，耗时: {time.perf_counter() - start:.2f}s")
+
+    # 由粗到细排列，每一级从更粗一级的最大级别之后开始
+    levels.reverse()
+    min_zoom = 0
+    for level in levels:
+        level['min_zoom'] = min_zoom
+        min_zoom = level['max_zoom'] + 1
+    with open(os.path.join(output_dir, f"{name}_pyramid.json"), 'w', encoding='utf-8') as f:
+        json.dump({'name': name, 'levels': levels}, f, ensure_ascii=False, indent=2)
+    return levels
@@ -0,0 +1,169 @@
+# -*- coding: UTF-8 -*-
+"""
+逐网格淹没统计
+按时间步分块流式读取水深（或水位减去高程），一次遍历同时得到每个网格的最大水深及其时间步、首次/末次过水时间步、
+超过各水深阈值的累计历时，输出每个网格一行的统计表，供HDF5输出、GIS图层和数据库汇总共用
+"""
+from datetime import datetime
+
+import numpy as np
+
+# 时间戳的两种格式：HEC-RAS结果文件中的'09APR2025 00:10:00'、输出HDF5中转换后的'2025-04-09 00:10:00'
+_TIME_FORMATS = ('%d%b%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_time(value):
+    text = value.decode('utf-8').strip() if isinstance(value, bytes) else str(value).strip()
+    for time_format in _TIME_FORMATS:
+        try:
+            return datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+    raise ValueError(f"无法解析的时间戳: {text}")
+
+
+def output_interval_hours(time_date_stamp, default=1 / 6):
+    """
+    由时间戳得到相邻时间步的间隔（小时），输出间隔由b01的Output Interval决定，不一定是10分钟
+    :param time_date_stamp: 时间戳数组（HEC-RAS原始格式或YYYY-MM-DD HH:MM:SS）
+    :param default: 少于两个时间步或无法解析时使用的间隔
+    :return: 间隔（小时），取相邻时间差的中位数
+    """
+    if time_date_stamp is None or len(time_date_stamp) < 2:
+        return default
+    try:
+        times = [_parse_time(t) for t in time_date_stamp]
+    except ValueError:
+        return default
+    hours = np.diff([t.timestamp() for t in times]) / 3600
+    hours = hours[hours > 0]
+    return float(np.median(hours)) if len(hours) else default
+
+
+class CellStatistics:
+    """
+    逐块累加的网格统计量
+    依次调用update传入连续的时间步块，最后调用result得到统计表
+    """
+
+    def __init__(self, num_cells, thresholds=(0.2,), wet_depth=0.01, interval_hours=1 / 6):
+        """
+        :param num_cells: 网格数
+        :param thresholds: 统计累计历时的水深阈值(m)
+        :param wet_depth: 判断网格过水的水深阈值(m)
+        :param interval_hours: 相邻时间步的间隔（小时），默认10分钟
+        """
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.wet_depth = wet_depth
+        self.interval_hours = interval_hours
+        self.num_steps = 0
+        self.max_depth = np.full(num_cells, -np.inf, dtype=np.float32)
+        self.max_step = np.zeros(num_cells, dtype=np.int32)
+        self.first_wet_step = np.full(num_cells, -1, dtype=np.int32)
+        self.last_wet_step = np.full(num_cells, -1, dtype=np.int32)
+        self.steps_above = np.zeros((len(self.thresholds), num_cells), dtype=np.int32)
+        self.first_step_above = np.full((len(self.thresholds), num_cells), -1, dtype=np.int32)
+
+    def update(self, block):
+        """
+        累加一个时间步块
+        :param block: 水深数据块，行代表时间步，列代表网格FID
+        """
+        block = np.asarray(block)
+        if block.shape[0] == 0:
+            return
+        offset = self.num_steps
+        rows = block.shape[0]
+
+        # 最大水深：只有严格大于之前的最大值时才更新，保证与全量argmax一样取最早的时间步
+        block_max_step = np.argmax(block, axis=0)
+        block_max = np.take_along_axis(block, block_max_step[None, :], axis=0)[0]
+        greater = block_max > self.max_depth
+        self.max_depth[greater] = block_max[greater]
+        self.max_step[greater] = block_max_step[greater] + offset
+
+        # 首次/末次过水时间步
+        wet = block > self.wet_depth
+        any_wet = wet.any(axis=0)
+        first = any_wet & (self.first_wet_step < 0)
+        self.first_wet_step[first] = np.argmax(wet[:, first], axis=0) + offset
+        self.last_wet_step[any_wet] = offset + rows - 1 - np.argmax(wet[::-1, any_wet], axis=0)
+
+        # 超过各水深阈值的时间步数和首次超过的时间步
+        for i, threshold in enumerate(self.thresholds):
+            above = block > threshold
+            self.steps_above[i] += np.count_nonzero(above, axis=0).astype(np.int32)
+            first = above.any(axis=0) & (self.first_step_above[i] < 0)
+            self.first_step_above[i, first] = np.argmax(above[:, first], axis=0) + offset
+
+        self.num_steps += rows
+
+    def result(self):
+        """
+        :return: 字典，max_depth、max_step、first_wet_step、last_wet_step（从未过水为-1）为长度等于网格数的一维数组，
+        flood_hours为第一个阈值的累计历时（小时），hours_above为(阈值数, 网格数)的累计历时（小时），
+        first_above_step为(阈值数, 网格数)的首次超过各阈值的时间步（从未超过为-1），thresholds为阈值
+        """
+        hours_above = self.steps_above * self.interval_hours
+        return {
+            'max_depth': self.max_depth,
+            'max_step': self.max_step,
+            'first_wet_step': self.first_wet_step,
+            'last_wet_step': self.last_wet_step,
+            'flood_hours': hours_above[0] if len(self.thresholds) else np.zeros_like(self.max_depth),
+            'hours_above': hours_above,
+            'first_above_step': self.first_step_above,
+            'thresholds': self.thresholds,
+        }
+
+
+def compute_cell_stats(data, base=None, block_size=36, thresholds=(0.2,), wet_depth=0.01, interval_hours=1 / 6):
+    """
+    一次遍历计算逐网格淹没统计
+    :param data: 水深或水位数据，行代表时间步，列代表网格FID；可以是ndarray或h5py数据集（按块读取，不整体载入内存）
+    :param base: 不为None时data为水位，减去base（网格高程）得到水深
+    :param block_size: 每块的时间步数
+    :param thresholds: 统计累计历时的水深阈值(m)
+    :param wet_depth: 判断网格过水的水深阈值(m)
+    :param interval_hours: 相邻时间步的间隔（小时）
+    :return: 统计字典，见CellStatistics.result
+    """
+    num_steps, num_cells = data.shape[0], (len(base) if base is not None else data.shape[1])
+    stats = CellStatistics(num_cells, thresholds, wet_depth, interval_hours)
+    for start in range(0, num_steps, block_size):
+        block = np.asarray(data[start:start + block_size, :num_cells], dtype=np.float32)
+        if base is not None:
+            block -= base
+        stats.update(block)
+    return stats.result()
+
+
+def write_cell_stats(group, cell_stats):
+    """
+    将统计表写入HDF5组（data/2DFlowAreas/CellStats）
+    :param group: h5py组
+    """
+    stats_group = group.create_group('CellStats')
+    stats_group.create_dataset('MaxDepth', data=cell_stats['max_depth'])
+    stats_group.create_dataset('MaxStep', data=cell_stats['max_step'])
+    stats_group.create_dataset('FirstWetStep', data=cell_stats['first_wet_step'])
+    stats_group.create_dataset('LastWetStep', data=cell_stats['last_wet_step'])
+    hours_above = stats_group.create_dataset('HoursAbove', data=cell_stats['hours_above'])
+    hours_above.attrs['thresholds'] = cell_stats['thresholds']
+    first_above = stats_group.create_dataset('FirstStepAbove', data=cell_stats['first_above_step'])
+    first_above.attrs['thresholds'] = cell_stats['thresholds']
+    return stats_group
+
+
+def cell_stats_attributes(cell_stats):
+    """
+    GIS图层使用的统计字段（字段名不超过10个字符，兼容Shapefile）
+    :return: {字段名: 数组}
+    """
+    return {
+        'max_depth': cell_stats['max_depth'],
+        'max_step': cell_stats['max_step'],
+        'first_wet': cell_stats['first_wet_step'],
+        'last_wet': cell_stats['last_wet_step'],
+        'flood_h': cell_stats['flood_hours'],
+    }
@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+"""
+模型网格几何缓存
+将参考shp网格（fanwei.shp）的网格多边形按模型坐标系和EPSG:4326各保存一份坐标数组，编译为二进制缓存(.npz)，
+shp文件变化时自动重新编译；GIS输出只需把属性数组附加到缓存的几何上，不再重复读取shp和投影转换
+"""
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from logger import logger
+
+
+_lock = threading.Lock()
+# 进程内缓存：{shp绝对路径: (shp文件签名, CellGeometryStore)}
+_stores = {}
+
+
+def shp_signature(shp_path):
+    """shp及其.dbf/.prj的mtime和大小，任一文件变化都需要重新编译"""
+    signature = []
+    for ext in ('.shp', '.dbf', '.prj'):
+        path = os.path.splitext(shp_path)[0] + ext
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.extend([stat.st_mtime_ns, stat.st_size])
+        else:
+            signature.extend([0, 0])
+    return tuple(signature)
+
+
+class CellGeometryStore:
+    """
+    一个模型的网格几何：模型坐标系和EPSG:4326下的网格多边形、原始属性表，以及按需构建的空间索引
+    几何按shp中的行顺序保存，即第i个几何对应网格FID i
+    """
+
+    def __init__(self, crs, geometry, geometry_wgs84, attributes):
+        """
+        :param crs: 模型坐标系（WKT），shp没有.prj时为None
+        :param geometry: 模型坐标系下的shapely几何数组
+        :param geometry_wgs84: EPSG:4326下的shapely几何数组，crs为None时为None
+        :param attributes: 原始属性表（pandas.DataFrame，不含geometry列）
+        """
+        self.crs = crs
+        self.geometry = geometry
+        self.geometry_wgs84 = geometry_wgs84
+        self.attributes = attributes
+        self._tree = None
+        self._tree_wgs84 = None
+
+    def __len__(self):
+        return len(self.geometry)
+
+    @property
+    def tree(self):
+        """模型坐标系下的STRtree空间索引"""
+        if self._tree is None:
+            self._tree = shapely.STRtree(self.geometry)
+        return self._tree
+
+    @property
+    def tree_wgs84(self):
+        """EPSG:4326下的STRtree空间索引"""
+        if self._tree_wgs84 is None:
+            self._tree_wgs84 = shapely.STRtree(self._geometry_for(True))
+        return self._tree_wgs84
+
+    def _geometry_for(self, wgs84):
+        if not wgs84:
+            return self.geometry
+        if self.geometry_wgs84 is None:
+            raise ValueError("参考shp网格没有坐标系，无法提供EPSG:4326几何")
+        return self.geometry_wgs84
+
+    def query(self, geometry, predicate=None, wgs84=False):
+        """
+        查询与geometry相交（或满足predicate）的网格
+        :return: 网格FID数组
+        """
+        tree = self.tree_wgs84 if wgs84 else self.tree
+        return tree.query(geometry, predicate=predicate)
+
+    def to_geodataframe(self, attributes=None, wgs84=False, include_original=True, index=None):
+        """
+        将属性数组附加到缓存的几何上得到GeoDataFrame
+        :param attributes: {列名: 长度为网格数的数组}
+        :param wgs84: 为True时使用EPSG:4326几何
+        :param include_original: 是否保留shp中原有的属性列
+        :param index: 只输出这些网格FID，为None时输出全部网格
+        """
+        import geopandas as gpd
+        import pandas as pd
+
+        geometry = self._geometry_for(wgs84)
+        data = self.attributes.copy() if include_original else pd.DataFrame(index=self.attributes.index)
+        for name, values in (attributes or {}).items():
+            data[name] = values
+        if index is not None:
+            data = data.iloc[index].reset_index(drop=True)
+            geometry = geometry[index]
+        return gpd.GeoDataFrame(data, geometry=geometry, crs="EPSG:4326" if wgs84 else self.crs)
+
+
+def _compile_store(shp_path, cache_file, signature):
+    """
+    读取shp并投影到EPSG:4326，同时写入.npz缓存
+    """
+    import geopandas as gpd
+    import pandas as pd
+
+    gdf = gpd.read_file(shp_path)
+    crs = gdf.crs.to_wkt() if gdf.crs is not None else None
+    geometry = np.asarray(gdf.geometry.values)
+    geometry_wgs84 = np.asarray(gdf.geometry.to_crs(epsg=4326).values) if crs is not None else None
+    attributes = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+
+    try:
+        arrays = {'signature': np.array(signature, dtype=np.int64),
+                  'crs': np.array(crs or ''),
+                  'columns': np.array(attributes.columns.tolist(), dtype='U')}
+        geom_type, coords, offsets = shapely.to_ragged_array(geometry)
+        arrays.update(geom_type=np.array(int(geom_type)), coords=coords,
+                      offsets_count=np.array(len(offsets)))
+        for i, offset in enumerate(offsets):
+            arrays[f'offsets_{i}'] = offset
+        if geometry_wgs84 is not None:
+            arrays['coords_wgs84'] = shapely.to_ragged_array(geometry_wgs84)[1]
+        for i, column in enumerate(attributes.columns):
+            values = attributes[column].to_numpy()
+            arrays[f'column_{i}'] = values.astype('U') if values.dtype == object else values
+        np.savez(cache_file, **arrays)
+        logger.info(f"网格几何已编译为缓存: {cache_file}")
+    except Exception as e:
+        # 缓存写入失败不影响使用，只是下次启动需要重新读取shp
+        logger.warning(f"网格几何缓存写入失败: {e}")
+    return CellGeometryStore(crs, geometry, geometry_wgs84, attributes)
+
+
+def _read_cache(cache_file, signature):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        import pandas as pd
+
+        with np.load(cache_file) as cache:
+            if tuple(cache['signature'].tolist()) != tuple(signature):
+                return None
+            crs = str(cache['crs']) or None
+            geom_type = shapely.GeometryType(int(cache['geom_type']))
+            offsets = tuple(cache[f'offsets_{i}'] for i in range(int(cache['offsets_count'])))
+            geometry = shapely.from_ragged_array(geom_type, cache['coords'], offsets)
+            geometry_wgs84 = None
+            if 'coords_wgs84' in cache.files:
+                geometry_wgs84 = shapely.from_ragged_array(geom_type, cache['coords_wgs84'], offsets)
+            columns = cache['columns'].tolist()
+            attributes = pd.DataFrame({column: cache[f'column_{i}'] for i, column in enumerate(columns)},
+                                      columns=columns)
+        return CellGeometryStore(crs, geometry, geometry_wgs84, attributes)
+    except Exception as e:
+        logger.warning(f"网格几何缓存读取失败，将重新编译: {e}")
+        return None
+
+
+def load_geometry_store(shp_path, cache_file=None):
+    """
+    加载参考shp网格的几何缓存，进程内只在shp文件变化时重新加载
+    优先读取.npz缓存，缓存不存在或已过期时才读取shp并投影
+    :param shp_path: 参考shp网格路径
+    :param cache_file: 二进制缓存文件路径，默认与shp同目录、同名的.geometry.npz
+    :return: CellGeometryStore
+    """
+    if not os.path.exists(shp_path):
+        raise FileNotFoundError(f"参考shp网格不存在: {shp_path}")
+    if cache_file is None:
+        cache_file = os.path.splitext(shp_path)[0] + ".geometry.npz"
+
+    signature = shp_signature(shp_path)
+    key = os.path.abspath(shp_path)
+    with _lock:
+        cached = _stores.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        store = _read_cache(cache_file, signature)
+        if store is None:
+            store = _compile_store(shp_path, cache_file, signature)
+        _stores[key] = (signature, store)
+        logger.info(f"成功加载{len(store)}个网格几何")
+        return store
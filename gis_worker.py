@@ -0,0 +1,346 @@
+# -*- coding: UTF-8 -*-
+"""
+GIS后处理进程池
+淹没范围等shapely/geopandas计算放到独立进程中执行，不占用接口进程的GIL，并发数有上限；
+每个任务以JSON文件的形式保存在任务目录中，服务重启后未完成的任务会重新提交，已结束的任务文件保留一段时间后清理；
+任务的状态（pending/running/success/failed）和耗时可以按方案名查询
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logger import logger
+
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCESS = "success"
+FAILED = "failed"
+
+
+def max_water_area_task(output_path, topology_file, depth_file, pyramid_tolerances=(2, 10, 50, 200)):
+    """
+    由网格拓扑生成最大淹没时刻的淹没范围，输出max_water_area_union.geojson和max_water_area_union_simplify.geojson，
+    以及按瓦片级别选用的多级简化金字塔（max_water_area_pyramid.json）
+    :param topology_file: 提交任务时由flood_extent.save_mesh_topology保存的网格拓扑和坐标系快照，
+        任务异步执行，不直接读取可能正被下一次计算改写的.p01.hdf
+    :param depth_file: 最大淹没时刻各网格水深的.npy文件
+    :param pyramid_tolerances: 金字塔各级的简化容差(m)，为空时不生成金字塔
+    """
+    from flood_extent import load_mesh_topology, build_flood_extent, to_wgs84, write_geojson, write_extent_pyramid
+
+    geojson_path = os.path.join(output_path, "max_water_area_union.geojson")
+    geojson_path2 = os.path.join(output_path, "max_water_area_union_simplify.geojson")
+    start = time.perf_counter()
+
+    # 1. 读取网格拓扑、坐标系和最大淹没时刻的水深
+    cells_facepoint_indexes, facepoints_coordinate, src_crs = load_mesh_topology(topology_file)
+    if src_crs is None:
+        raise ValueError("HDF文件和参考shp网格中均未找到坐标系，未生成geojson")
+    max_depth = np.load(depth_file)
+
+    # 2. 找出水深>0.2的网格与其余网格之间的边，拼成淹没范围
+    union_geom = build_flood_extent(cells_facepoint_indexes, facepoints_coordinate, max_depth, threshold=0.2)
+    if union_geom is None:
+        logger.warning("无水深大于0.2的网格，未生成geojson")
+        return
+    logger.info(f"淹没范围构建完成，网格数: {int((max_depth > 0.2).sum())}，耗时: {time.perf_counter() - start:.2f}s")
+
+    # 3. 在模型坐标系下生成多级简化金字塔
+    if pyramid_tolerances:
+        write_extent_pyramid(union_geom, src_crs, output_path, "max_water_area", pyramid_tolerances)
+
+    # 4. 转为EPSG:4326并输出为geojson
+    union_geom = to_wgs84(union_geom, src_crs)
+    write_geojson(union_geom, geojson_path)
+    logger.info(f"融合后geojson已输出到 {geojson_path}")
+
+    # ---------关键：边界简化----------
+    # 你可以根据需要调整 tolerance 参数
+    tolerance = 0.001  # 约100米
+    union_geom_simplified = union_geom.simplify(tolerance, preserve_topology=True)
+    logger.info(
+        f"简化后点数：{len(union_geom_simplified.exterior.coords) if union_geom_simplified.geom_type == 'Polygon' else 'MultiPolygon'}")
+    write_geojson(union_geom_simplified, geojson_path2)
+    logger.info(f"融合并简化后geojson已输出到 {geojson_path2}")
+
+
+def flood_tiles_task(output_path, hdf5_file_path, shp_path, scheme_name, min_zoom=8, max_zoom=14,
+                     step_interval=1, max_workers=2):
+    """
+    由输出HDF5中的水深和时间生成逐时间步淹没范围矢量瓦片，输出<方案名>.mbtiles
+    :param hdf5_file_path: create_output_hdf5生成的HDF5文件
+    :param shp_path: 参考shp网格路径，用于加载网格几何缓存
+    """
+    import h5py
+    from geometry_store import load_geometry_store
+    from vector_tiles import write_flood_tiles
+
+    with h5py.File(hdf5_file_path, 'r') as hf:
+        depth_data = hf['data']['2DFlowAreas']['depth'][:]
+        times = [t.decode('utf-8') if isinstance(t, bytes) else str(t) for t in hf['data']['TimeDateStamp'][:]]
+    geometry_store = load_geometry_store(shp_path)
+    write_flood_tiles(os.path.join(output_path, f"{scheme_name}.mbtiles"), geometry_store.geometry_wgs84,
+                      depth_data, times, scheme_name, min_zoom=min_zoom, max_zoom=max_zoom,
+                      step_interval=step_interval, max_workers=max_workers)
+
+
+def depth_parquet_task(output_path, hdf5_file_path, shp_path, steps_per_block=36):
+    """
+    将输出HDF5中的水深过程导出为列式Parquet数据集（<output_path>/depth_parquet）
+    :param hdf5_file_path: create_output_hdf5生成的HDF5文件
+    :param shp_path: 参考shp网格路径，用于加载网格几何缓存
+    """
+    import h5py
+    from geometry_store import load_geometry_store
+    from parquet_export import export_depth_parquet
+
+    geometry_store = load_geometry_store(shp_path)
+    with h5py.File(hdf5_file_path, 'r') as hf:
+        times = hf['data']['TimeDateStamp'][:] if 'TimeDateStamp' in hf['data'] else None
+        # 水深数据集按分区逐块读取，不整体载入内存
+        export_depth_parquet(os.path.join(output_path, "depth_parquet"), hf['data']['2DFlowAreas']['depth'], times,
+                             geometry_store, steps_per_block=steps_per_block)
+
+
+def depth_rasters_task(output_path, hdf5_file_path, shp_path, resolution=10, step_interval=6):
+    """
+    将输出HDF5中的水深输出为COG栅格（<output_path>/depth_cog）：每隔step_interval个时间步一个depth_<时间步>.tif，
+    以及最大水深max_depth.tif
+    :param hdf5_file_path: create_output_hdf5生成的HDF5文件
+    :param shp_path: 参考shp网格路径，用于加载网格编号栅格缓存
+    :param resolution: 像元大小(m)
+    """
+    import h5py
+    from raster_export import load_cell_raster, write_cog, write_depth_rasters
+
+    start = time.perf_counter()
+    cell_raster = load_cell_raster(shp_path, resolution)
+    raster_dir = os.path.join(output_path, "depth_cog")
+    with h5py.File(hdf5_file_path, 'r') as hf:
+        area = hf['data']['2DFlowAreas']
+        depth = area['depth']
+        steps = range(0, depth.shape[0], step_interval)
+        paths = write_depth_rasters(cell_raster, depth, raster_dir, steps=steps)
+        if 'CellStats' in area:
+            max_depth = area['CellStats']['MaxDepth'][:]
+            paths.append(write_cog(os.path.join(raster_dir, "max_depth.tif"),
+                                   cell_raster.render(max_depth, dry_value=0.01), cell_raster))
+    logger.info(f"水深COG已输出到 {raster_dir}，文件数: {len(paths)}，耗时: {time.perf_counter() - start:.2f}s")
+
+
+# 任务类型与执行函数的对应关系，执行函数必须是模块级函数，以便在子进程中导入
+TASKS = {
+    'max_water_area': max_water_area_task,
+    'flood_tiles': flood_tiles_task,
+    'depth_parquet': depth_parquet_task,
+    'depth_rasters': depth_rasters_task,
+}
+
+
+def _write_task(task_file, task):
+    """先写临时文件再替换，避免进程中断时留下不完整的任务文件"""
+    tmp_file = f"{task_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(task, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, task_file)
+
+
+def _read_task(task_file):
+    with open(task_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _run_task(task_file):
+    """在子进程中执行一个任务，并把状态和耗时写回任务文件"""
+    task = _read_task(task_file)
+    task['status'] = RUNNING
+    task['started_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+    task['pid'] = os.getpid()
+    _write_task(task_file, task)
+
+    start = time.perf_counter()
+    try:
+        TASKS[task['kind']](**task['kwargs'])
+        task['status'] = SUCCESS
+        task['error'] = None
+    except Exception as e:
+        logger.error(f"GIS任务{task['task_id']}({task['kind']})失败: {e}")
+        task['status'] = FAILED
+        task['error'] = f"{e}\n{traceback.format_exc()}"
+    task['duration'] = round(time.perf_counter() - start, 3)
+    task['finished_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+    _write_task(task_file, task)
+    return task['status']
+
+
+class GISWorkerPool:
+    """
+    GIS后处理进程池
+    任务文件保存在task_dir中，文件名为<task_id>.json
+    """
+
+    def __init__(self, task_dir, max_workers=2, retention_days=None):
+        """
+        :param task_dir: 任务文件目录
+        :param max_workers: 最大并发进程数
+        :param retention_days: 已结束（success/failed）的任务文件保留的天数，为None时不清理
+        """
+        self.task_dir = task_dir
+        self.max_workers = max_workers
+        self.retention_days = retention_days
+        os.makedirs(task_dir, exist_ok=True)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 接口进程是多线程的，使用spawn避免fork时复制其他线程持有的锁
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _task_file(self, task_id):
+        return os.path.join(self.task_dir, f"{task_id}.json")
+
+    def _schedule(self, task_file, task):
+        future = self._get_executor().submit(_run_task, task_file)
+        future.add_done_callback(lambda f: self._on_done(task_file, task, f))
+
+    def _on_done(self, task_file, task, future):
+        try:
+            status = future.result()
+            finished = _read_task(task_file)
+            logger.info(f"GIS任务{task['task_id']}({task['kind']})结束，方案: {task['scheme_name']}，"
+                        f"状态: {status}，耗时: {finished.get('duration')}s")
+        except Exception as e:
+            # 子进程异常退出（如被系统杀死）时任务文件停留在running，这里记为失败
+            logger.error(f"GIS任务{task['task_id']}({task['kind']})进程异常退出: {e}")
+            try:
+                finished = _read_task(task_file)
+                finished['status'] = FAILED
+                finished['error'] = str(e)
+                finished['finished_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+                _write_task(task_file, finished)
+            except Exception as write_error:
+                logger.error(f"GIS任务状态写入失败: {write_error}")
+            # 进程池已损坏，下次提交时重新创建
+            with self._lock:
+                self._executor = None
+
+    def submit(self, scheme_name, kind, **kwargs):
+        """
+        提交一个任务
+        :param scheme_name: 方案名
+        :param kind: 任务类型，TASKS中的键
+        :param kwargs: 执行函数的参数，必须可以序列化为JSON
+        :return: task_id
+        """
+        if kind not in TASKS:
+            raise ValueError(f"未知的GIS任务类型: {kind}")
+        task_id = uuid.uuid4().hex
+        task = {
+            'task_id': task_id,
+            'scheme_name': scheme_name,
+            'kind': kind,
+            'kwargs': kwargs,
+            'status': PENDING,
+            'submitted_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'started_at': None,
+            'finished_at': None,
+            'duration': None,
+            'error': None,
+        }
+        task_file = self._task_file(task_id)
+        _write_task(task_file, task)
+        self._schedule(task_file, task)
+        logger.info(f"GIS任务{task_id}({kind})已提交，方案: {scheme_name}")
+        self.cleanup()
+        return task_id
+
+    def recover(self):
+        """
+        重新提交上次服务退出时未完成（pending或running）的任务
+        :return: 重新提交的任务数
+        """
+        count = 0
+        for name in sorted(os.listdir(self.task_dir)):
+            if not name.endswith('.json'):
+                continue
+            task_file = os.path.join(self.task_dir, name)
+            try:
+                task = _read_task(task_file)
+            except Exception as e:
+                logger.warning(f"GIS任务文件读取失败: {task_file}, {e}")
+                continue
+            if task.get('status') in (PENDING, RUNNING) and task.get('kind') in TASKS:
+                task['status'] = PENDING
+                _write_task(task_file, task)
+                self._schedule(task_file, task)
+                count += 1
+        if count:
+            logger.info(f"已重新提交{count}个未完成的GIS任务")
+        self.cleanup()
+        return count
+
+    def cleanup(self):
+        """
+        删除结束超过retention_days天的任务文件，以及进程中断时留下的临时文件
+        :return: 删除的文件数
+        """
+        if self.retention_days is None:
+            return 0
+        expire = time.time() - self.retention_days * 86400
+        count = 0
+        for name in os.listdir(self.task_dir):
+            task_file = os.path.join(self.task_dir, name)
+            try:
+                if name.endswith('.tmp'):
+                    remove = os.path.getmtime(task_file) < expire
+                elif name.endswith('.json'):
+                    # 只按结束后的修改时间判断，pending和running的任务不清理
+                    remove = _read_task(task_file).get('status') in (SUCCESS, FAILED) \
+                        and os.path.getmtime(task_file) < expire
+                else:
+                    continue
+                if remove:
+                    os.remove(task_file)
+                    count += 1
+            except (OSError, ValueError) as e:
+                logger.warning(f"GIS任务文件清理失败: {task_file}, {e}")
+        if count:
+            logger.info(f"已清理{count}个过期的GIS任务文件")
+        return count
+
+    def status(self, scheme_name=None):
+        """
+        查询任务状态
+        :param scheme_name: 方案名，为None时返回所有任务
+        :return: 任务字典列表，按提交时间排序
+        """
+        tasks = []
+        for name in os.listdir(self.task_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                task = _read_task(os.path.join(self.task_dir, name))
+            except Exception:
+                continue
+            if scheme_name is None or task.get('scheme_name') == scheme_name:
+                tasks.append(task)
+        return sorted(tasks, key=lambda task: task.get('submitted_at') or '')
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+"""
+洪水危险度
+读取HEC-RAS结果中的顶点（facepoint）流速X/Y分量，向量化平均到网格，按时间步分块计算流速大小、水深×流速和危险度等级，
+输出每个网格的最大危险度等级、最大水深×流速和最大流速
+危险度等级采用澳大利亚洪水危险度分类（AIDR 2017 / ARR 2019）H1-H6，0表示未过水
+"""
+import h5py
+import numpy as np
+
+from velocity_to_cells import velocity_to_cells
+from logger import logger
+
+
+# HEC-RAS结果中顶点流速数据集的名称（需要在计划中勾选输出Face Point Velocity）
+# 该名称沿用hdf_handler中被注释掉的读取代码，那里已标注路径有误，尚未用勾选了流速输出的结果文件核实；
+# 找不到时会在警告中列出结果组中实际有哪些数据集，据此修改这两个名称
+NODE_VELOCITY_X = 'Node Velocity - Velocity X'
+NODE_VELOCITY_Y = 'Node Velocity - Velocity Y'
+
+# H1-H6的上限：(水深×流速 m²/s, 水深 m, 流速 m/s)，超过H5任一上限即为H6
+HAZARD_LIMITS = np.array([
+    [0.3, 0.3, 2.0],  # H1
+    [0.6, 0.5, 2.0],  # H2
+    [0.6, 1.2, 2.0],  # H3
+    [1.0, 2.0, 2.0],  # H4
+    [4.0, 4.0, 4.0],  # H5
+], dtype=np.float32)
+
+
+def open_node_velocity(f):
+    """
+    获取顶点流速X/Y数据集（不读入内存）
+    :param f: 打开的HEC-RAS结果h5py.File
+    :return: (velocity_x, velocity_y)，结果中没有顶点流速时记录警告并返回None
+    """
+    area = f['Results']['Unsteady']['Output']['Output Blocks']['Base Output']['Unsteady Time Series'][
+        '2D Flow Areas']['Perimeter 1']
+    if NODE_VELOCITY_X not in area or NODE_VELOCITY_Y not in area:
+        logger.warning(f"结果文件中没有顶点流速数据集'{NODE_VELOCITY_X}'/'{NODE_VELOCITY_Y}'，"
+                       f"{area.name}中的数据集: {sorted(area.keys())}")
+        return None
+    return area[NODE_VELOCITY_X], area[NODE_VELOCITY_Y]
+
+
+def classify_hazard(depth, velocity, wet_depth=0.01):
+    """
+    计算危险度等级
+    :param depth: 水深数组
+    :param velocity: 与depth形状相同的流速大小数组
+    :return: 与depth形状相同的uint8数组，0为未过水，1-6对应H1-H6
+    """
+    depth_velocity = depth * velocity
+    hazard = np.full(depth.shape, len(HAZARD_LIMITS) + 1, dtype=np.uint8)
+    # 从高等级往低等级依次覆盖，最终得到满足全部上限的最低等级
+    for level in range(len(HAZARD_LIMITS), 0, -1):
+        dv_limit, depth_limit, velocity_limit = HAZARD_LIMITS[level - 1]
+        within = (depth_velocity <= dv_limit) & (depth <= depth_limit) & (velocity <= velocity_limit)
+        hazard[within] = level
+    hazard[depth <= wet_depth] = 0
+    return hazard
+
+
+def compute_hazard(cells_facepoint_indexes, velocity_x, velocity_y, depth_data, block_size=36, wet_depth=0.01):
+    """
+    按时间步分块计算每个网格的最大危险度
+    :param cells_facepoint_indexes: Cells FacePoint Indexes，(网格数, 最大顶点数)，不足的位置为-1
+    :param velocity_x: 顶点流速X分量，行代表时间步，列代表facepoint；可以是h5py数据集（按块读取）
+    :param velocity_y: 顶点流速Y分量
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID
+    :param block_size: 每块的时间步数
+    :return: 字典，max_hazard（uint8）、max_depth_velocity、max_velocity，均为长度等于网格数的一维数组
+    """
+    num_steps, num_cells = depth_data.shape
+    indexes = np.asarray(cells_facepoint_indexes[:num_cells])
+    max_hazard = np.zeros(num_cells, dtype=np.uint8)
+    max_depth_velocity = np.zeros(num_cells, dtype=np.float32)
+    max_velocity = np.zeros(num_cells, dtype=np.float32)
+    for start in range(0, num_steps, block_size):
+        stop = min(start + block_size, num_steps)
+        cells_x = velocity_to_cells(indexes, velocity_x[start:stop], num_cells, block_size=stop - start)
+        cells_y = velocity_to_cells(indexes, velocity_y[start:stop], num_cells, block_size=stop - start)
+        velocity = np.hypot(cells_x, cells_y)
+        depth = np.clip(np.asarray(depth_data[start:stop], dtype=np.float32), 0, None)
+        # 未过水的网格流速无意义，不参与统计
+        velocity[depth <= wet_depth] = 0
+
+        np.maximum(max_hazard, classify_hazard(depth, velocity, wet_depth).max(axis=0), out=max_hazard)
+        np.maximum(max_depth_velocity, (depth * velocity).max(axis=0), out=max_depth_velocity)
+        np.maximum(max_velocity, velocity.max(axis=0), out=max_velocity)
+    return {
+        'max_hazard': max_hazard,
+        'max_depth_velocity': max_depth_velocity,
+        'max_velocity': max_velocity,
+    }
+
+
+def compute_hazard_from_hdf(p01_hdf_path, depth_data, block_size=36, wet_depth=0.01):
+    """
+    从HEC-RAS结果文件读取网格拓扑和顶点流速，计算每个网格的最大危险度
+    :return: 见compute_hazard，结果中没有顶点流速时返回None
+    """
+    with h5py.File(p01_hdf_path, 'r') as f:
+        velocity = open_node_velocity(f)
+        if velocity is None:
+            return None
+        cells_facepoint_indexes = f['Geometry']['2D Flow Areas']['Perimeter 1']['Cells FacePoint Indexes'][
+            :depth_data.shape[1]]
+        return compute_hazard(cells_facepoint_indexes, velocity[0], velocity[1], depth_data, block_size, wet_depth)
+
+
+def write_hazard(group, hazard):
+    """
+    将最大危险度写入HDF5组（data/2DFlowAreas/Hazard）
+    :param group: h5py组
+    """
+    hazard_group = group.create_group('Hazard')
+    max_hazard = hazard_group.create_dataset('MaxHazardClass', data=hazard['max_hazard'])
+    max_hazard.attrs['classes'] = np.array([b'dry', b'H1', b'H2', b'H3', b'H4', b'H5', b'H6'])
+    hazard_group.create_dataset('MaxDepthVelocity', data=hazard['max_depth_velocity'])
+    hazard_group.create_dataset('MaxVelocity', data=hazard['max_velocity'])
+    return hazard_group
+
+
+def hazard_attributes(hazard):
+    """
+    GIS图层使用的危险度字段（字段名不超过10个字符，兼容Shapefile）
+    :return: {字段名: 数组}
+    """
+    return {
+        'max_hazard': hazard['max_hazard'],
+        'max_dv': hazard['max_depth_velocity'],
+        'max_vel': hazard['max_velocity'],
+    }
@@ -1,6 +1,7 @@
 # -*- coding: UTF-8 -*-
 import os
-import time
+import subprocess
+import sys
 import shutil
 import h5py
 import numpy as np
@@ -17,10 +18,12 @@ class HDFHandler:
         """
         Linux版本的ras要求提供一份windows版本运行的.p01.hdf结果文件，但是需要将文件中的Results组删除，本方法实现上述功能
         输入一个.p01.hdf文件，输出一个删除Results后的.p01.tmp.hdf文件供Linux ras计算引擎调用
+        等待删除脚本执行结束后再移动文件，不依赖固定的等待时间，多个工作目录同时准备模型时也不会移动写了一半的文件
         :return: 无返回值
+        :raises subprocess.CalledProcessError: 删除脚本执行失败
         """
-        os.popen(f"python remove_HDF5_Results.py {self.filepath}")
-        time.sleep(3)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'remove_HDF5_Results.py')
+        subprocess.run([sys.executable, script, self.filepath], check=True)
 
         # 把新生成的.p01.tmp.hdf移动到./wrk_source文件夹下
         if not os.path.exists(os.path.dirname(self.filepath) + os.path.sep + 'wrk_source'):
@@ -505,6 +508,11 @@ class HDFHandler:
             f['Results']['Unsteady']['Output']['Output Blocks']['Base Output']['Unsteady Time Series']['2D Flow Areas'][
                 'Perimeter 1']['Water Surface'][:]
             return wse_data
+        elif dataset_name == 'Time Date Stamp':
+            time_date_stamp = \
+            f['Results']['Unsteady']['Output']['Output Blocks']['Base Output']['Unsteady Time Series'][
+                'Time Date Stamp'][:]
+            return time_date_stamp
         # 查找路径错误，需要重新换目录
         # elif dataset_name == 'Velocity X':
         #     node_velocity_x_data = \
@@ -1,5 +1,9 @@
 # -*- coding: UTF-8 -*-
+import csv
 import datetime
+import os
+import tempfile
+import time
 
 import numpy as np
 import pymysql
@@ -7,6 +11,35 @@ import pymysql
 from logger import logger
 
 
+class StreamInsertError(Exception):
+    """
+    流式写入中途失败
+    已提交的数据块不会回滚，rows_committed为失败前已经提交的行数，调用方可据此清理或重写
+    """
+
+    def __init__(self, table, rows_committed, cause):
+        self.table = table
+        self.rows_committed = rows_committed
+        self.message = f"流式写入{table}失败，已提交{rows_committed}行: {cause}"
+        super().__init__(self.message)
+
+
+def depth_blocks(time_list, depth_data: np.ndarray, steps_per_block: int = 10):
+    """
+    将水深矩阵按时间步分块编码为(id, ymdhm, depth)三列，供MySQLHandler.stream_insert流式写入
+    :param time_list: 时间序列，与depth_data的行一一对应
+    :param depth_data: 水深数据，行=时间步，列=网格
+    :param steps_per_block: 每块包含的时间步数
+    :return: 生成器，每块为与列一一对应的一维数组元组，水深保留3位小数
+    """
+    cell_ids = np.arange(depth_data.shape[1])
+    for start in range(0, len(depth_data), steps_per_block):
+        rows = depth_data[start:start + steps_per_block]
+        yield (np.tile(cell_ids, len(rows)),
+               np.repeat(np.asarray(time_list[start:start + len(rows)]), len(cell_ids)),
+               np.round(rows, 3).ravel())
+
+
 class MySQLHandler:
 
     def __init__(self, host, port, user, password, database, charset='utf8'):
@@ -17,13 +50,14 @@ class MySQLHandler:
         self.database: str = database
         self.charset: str = charset
 
-    def _get_connect(self):
+    def _get_connect(self, local_infile: bool = False):
         return pymysql.connect(
             host=self.host,
             port=self.port,
             user=self.user,
             password=self.password,
-            database=self.database
+            database=self.database,
+            local_infile=local_infile
         )
 
     def _batch_insert(self, sql: str, params: list, step: int = 10000) -> None:
@@ -159,26 +193,156 @@ class MySQLHandler:
         conn.close()
         return flow_values
 
-    def depth_to_mysql(self, table, time_list, depth_data: np.ndarray):
-        sql = f"Insert Into {table} (`id`,`ymdhm`,`depth`) values (%s, %s, %s)"
-        params: list = []
-        for time_step, row in enumerate(depth_data):
-            for i, data in enumerate(row):
-                # if data < 0.01:
-                #     continue
-                params.append([i, time_list[time_step], round(data, 3)])
-
-        self._batch_insert(sql, params)
+    def depth_to_mysql(self, table, time_list, depth_data: np.ndarray, steps_per_block: int = 10):
+        """
+        将逐网格逐时间步的水深写入数据库，按时间步分块流式写入，不在内存中展开全部记录
+        :param table: 表名
+        :param time_list: 时间序列，与depth_data的行一一对应
+        :param depth_data: 水深数据，行=时间步，列=网格
+        :param steps_per_block: 每块包含的时间步数
+        :return: 写入的行数
+        :raises StreamInsertError: 写入中途失败
+        """
+        return self.stream_insert(table, ['id', 'ymdhm', 'depth'], depth_blocks(time_list, depth_data, steps_per_block))
 
     def q_to_mysql(self, table, time_list, q_data: np.ndarray):
-        sql = f"Insert Into {table} (`ymdhm`,`Q`) values (%s, %s)"
-        params: list = []
-        for time_step, data in enumerate(q_data):
-            # if data < 0.01:
-            #     continue
-            params.append([time_list[time_step], round(data, 3)])
-
-        self._batch_insert(sql, params)
+        """
+        将流量过程写入数据库
+        :param table: 表名
+        :param time_list: 时间序列，与q_data一一对应
+        :param q_data: 流量过程
+        :return: 写入的行数
+        :raises StreamInsertError: 写入失败
+        """
+        block = (np.asarray(time_list[:len(q_data)]), np.round(np.asarray(q_data, dtype=float), 3))
+        return self.stream_insert(table, ['ymdhm', 'Q'], [block])
+
+    def stream_insert(self, table: str, columns: list, blocks, use_local_infile: bool = True,
+                      spool_bytes: int = 64 * 1024 * 1024) -> int:
+        """
+        流式批量写入
+        服务器允许LOAD DATA LOCAL INFILE时，先将数据块写入CSV临时文件，累计到spool_bytes后整体导入；
+        否则退回到多行INSERT，单条语句的长度按服务器的max_allowed_packet自适应调整
+        每次导入或插入后立即提交，失败时只回滚当前这一批，之前提交的数据保留在表中
+        :param table: 表名
+        :param columns: 列名列表
+        :param blocks: 数据块的可迭代对象（可以是生成器），每个数据块可以是：
+            二维数值ndarray（行=记录，列=字段）；与columns一一对应的一维数组元组（按列存储）；记录元组的列表
+        :param use_local_infile: 是否尝试使用LOAD DATA LOCAL INFILE
+        :param spool_bytes: CSV临时文件累计多少字节后导入一次
+        :return: 写入的行数
+        :raises StreamInsertError: 写入中途失败，异常中带有失败前已提交的行数
+        """
+        db = None
+        cursor = None
+        total_rows = 0
+        try:
+            db = self._get_connect(local_infile=use_local_infile)
+            cursor = db.cursor()
+            if use_local_infile and self._local_infile_enabled(cursor):
+                batches = self._stream_load_data(db, cursor, table, columns, blocks, spool_bytes)
+            else:
+                batches = self._stream_multi_row_insert(db, cursor, table, columns, blocks)
+            # 逐批累计已提交的行数，失败时可以报告已经写入了多少
+            for rows in batches:
+                total_rows += rows
+            logger.info(f"Stream insert db successfully. Rows: {total_rows}.")
+        except Exception as e:
+            if db is not None:
+                db.rollback()
+            logger.error(f"Stream insert db error. Rows committed: {total_rows}. Error: {e}.")
+            raise StreamInsertError(table, total_rows, e) from e
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if db is not None:
+                db.close()
+        return total_rows
+
+    def _local_infile_enabled(self, cursor) -> bool:
+        try:
+            cursor.execute("SHOW VARIABLES LIKE 'local_infile'")
+            row = cursor.fetchone()
+            return row is not None and str(row[1]).upper() in ('ON', '1')
+        except pymysql.MySQLError:
+            return False
+
+    def _stream_load_data(self, db, cursor, table, columns, blocks, spool_bytes):
+        """逐批导入，每提交一批生成该批的行数"""
+        column_sql = ", ".join(f"`{c}`" for c in columns)
+        sql_template = (f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table}` CHARACTER SET utf8mb4 "
+                        f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+                        f"({column_sql})")
+        # pymysql按文件名发送本地文件，因此CSV缓冲区落在临时文件中，导入后截断复用
+        fd, spool_path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as spool:
+                writer = csv.writer(spool, lineterminator='\n')
+                for block in blocks:
+                    self._write_csv_block(spool, writer, block)
+                    if spool.tell() >= spool_bytes:
+                        yield self._flush_spool(db, cursor, spool, spool_path, sql_template)
+                if spool.tell() > 0:
+                    yield self._flush_spool(db, cursor, spool, spool_path, sql_template)
+        finally:
+            os.remove(spool_path)
+
+    @staticmethod
+    def _flush_spool(db, cursor, spool, spool_path, sql_template) -> int:
+        spool.flush()
+        rows = cursor.execute(sql_template, (spool_path,))
+        db.commit()
+        spool.seek(0)
+        spool.truncate()
+        logger.info(f"Load data into db successfully. Rows: {rows}.")
+        return rows
+
+    @staticmethod
+    def _write_csv_block(spool, writer, block) -> None:
+        if isinstance(block, np.ndarray):
+            np.savetxt(spool, np.atleast_2d(block), fmt='%.10g', delimiter=',')
+        elif isinstance(block, tuple):
+            writer.writerows(zip(*[np.asarray(column).tolist() for column in block]))
+        else:
+            writer.writerows(block)
+
+    def _stream_multi_row_insert(self, db, cursor, table, columns, blocks):
+        """逐块插入，每提交一块生成该块的行数"""
+        column_sql = ", ".join(f"`{c}`" for c in columns)
+        placeholders = ", ".join(["%s"] * len(columns))
+        sql = f"INSERT INTO `{table}` ({column_sql}) VALUES ({placeholders})"
+
+        # pymysql的executemany会把INSERT ... VALUES改写为多行INSERT，单条语句的长度上限取服务器max_allowed_packet的一半
+        cursor.execute("SELECT @@max_allowed_packet")
+        max_allowed_packet = int(cursor.fetchone()[0])
+        cursor.max_stmt_length = max(64 * 1024, max_allowed_packet // 2)
+
+        for block in blocks:
+            if isinstance(block, np.ndarray):
+                rows = np.atleast_2d(block).tolist()
+            elif isinstance(block, tuple):
+                rows = list(zip(*[np.asarray(column).tolist() for column in block]))
+            else:
+                rows = list(block)
+            yield self._insert_rows_adaptive(db, cursor, sql, rows)
+
+    @staticmethod
+    def _insert_rows_adaptive(db, cursor, sql, rows) -> int:
+        while True:
+            try:
+                start = time.perf_counter()
+                inserted = cursor.executemany(sql, rows)
+                db.commit()
+                logger.info(f"Insert db successfully. Rows: {inserted}. "
+                            f"Rows/s: {inserted / max(time.perf_counter() - start, 1e-9):.0f}.")
+                return inserted
+            except pymysql.err.OperationalError as e:
+                # 1153: Got a packet bigger than 'max_allowed_packet'，缩短单条语句后重试
+                if e.args[0] != 1153 or cursor.max_stmt_length <= 64 * 1024:
+                    raise
+                db.rollback()
+                cursor.max_stmt_length //= 2
+                logger.warning(f"Statement too large, retry with max_stmt_length={cursor.max_stmt_length}.")
 
 
 # 下面是用于临时测试的代码
@@ -3,6 +3,11 @@ import h5py
 import numpy as np
 from datetime import datetime
 
+from flood_stats import write_cell_stats
+from hazard import write_hazard
+from zonal_stats import write_zone_stats
+from depth_classes import write_class_areas
+
 
 def convert_time_date_stamp(time_date_stamp_array):
     """
@@ -35,7 +40,8 @@ def convert_time_date_stamp(time_date_stamp_array):
     return np.array(converted_times, dtype='S19')  # S19可以容纳'YYYY-MM-DD HH:MM:SS'格式
 
 
-def create_output_hdf5(output_path, hdf_handler, depth_data, wse_data, flooded_area, logger, scheme_name=None):
+def create_output_hdf5(output_path, hdf_handler, depth_data, wse_data, flooded_area, logger, scheme_name=None,
+                       cell_stats=None, hazard=None, zone_stats=None, class_areas=None, class_bounds=None):
     """
     创建符合要求的HDF5输出文件
     
@@ -46,6 +52,11 @@ def create_output_hdf5(output_path, hdf_handler, depth_data, wse_data, flooded_a
     :param flooded_area: 淹没面积数据
     :param logger: 日志记录器
     :param scheme_name: 方案名称，用于生成文件名。如果为None，使用默认名称hydroModel.hdf5
+    :param cell_stats: 逐网格淹没统计（flood_stats.compute_cell_stats的返回值），不为None时写入2DFlowAreas/CellStats
+    :param hazard: 逐网格最大危险度（hazard.compute_hazard的返回值），不为None时写入2DFlowAreas/Hazard
+    :param zone_stats: 分区淹没统计（zonal_stats.compute_zone_stats的返回值），不为None时写入2DFlowAreas/Zones
+    :param class_areas: 分级淹没面积（depth_classes.compute_class_areas的返回值），不为None时写入2DFlowAreas/DepthClassArea
+    :param class_bounds: 各水深等级的下限(m)
     :return: 成功返回HDF5文件路径，失败返回None
     """
     try:
@@ -101,6 +112,18 @@ def create_output_hdf5(output_path, hdf_handler, depth_data, wse_data, flooded_a
             if flooded_area is not None:
                 flow_areas_group.create_dataset('FloodedArea', data=flooded_area)
                 logger.info("2DFlowAreas/FloodedArea数据已写入")
+            if class_areas is not None:
+                write_class_areas(flow_areas_group, class_areas, class_bounds)
+                logger.info("2DFlowAreas/DepthClassArea数据已写入")
+            if cell_stats is not None:
+                write_cell_stats(flow_areas_group, cell_stats)
+                logger.info("2DFlowAreas/CellStats数据已写入")
+            if hazard is not None:
+                write_hazard(flow_areas_group, hazard)
+                logger.info("2DFlowAreas/Hazard数据已写入")
+            if zone_stats is not None:
+                write_zone_stats(flow_areas_group, zone_stats)
+                logger.info("2DFlowAreas/Zones数据已写入")
             
             # 创建CrossSections组
             cross_sections_group = data_group.create_group('CrossSections')
@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+"""
+逐时间步水深的列式（Parquet）导出
+网格几何只写一次（cells.parquet，GeoParquet），水深过程按长表（step, cell_id, depth）写入按时间块分区的压缩Parquet数据集，
+只保存过水网格；读取时按需重建任意时间步的图层
+目录结构：
+    <export_dir>/cells.parquet            网格FID和几何
+    <export_dir>/timesteps.parquet        时间步序号、所在分区和时间
+    <export_dir>/depth/block=<k>/part.parquet   第k个时间块的过水网格水深
+依赖pyarrow
+"""
+import os
+import shutil
+
+import numpy as np
+
+from logger import logger
+
+
+CELLS_FILE = "cells.parquet"
+TIMESTEPS_FILE = "timesteps.parquet"
+DEPTH_DIR = "depth"
+
+
+def export_depth_parquet(export_dir, depth_data, times=None, geometry_store=None, wet_depth=0.01,
+                         steps_per_block=36, compression='zstd'):
+    """
+    导出水深过程
+    :param export_dir: 导出目录，已存在时会被覆盖
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID；可以是ndarray或h5py数据集（按块读取）
+    :param times: 每个时间步的时间字符串，为None时不写timesteps.parquet的时间列
+    :param geometry_store: geometry_store.CellGeometryStore，为None时不写cells.parquet
+    :param wet_depth: 只保存水深大于该值的网格
+    :param steps_per_block: 每个分区的时间步数
+    :return: 写入的水深记录数
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+    os.makedirs(os.path.join(export_dir, DEPTH_DIR))
+
+    num_steps, num_cells = depth_data.shape
+    if geometry_store is not None:
+        cells = geometry_store.to_geodataframe({'cell_id': np.arange(len(geometry_store), dtype=np.int32)},
+                                               include_original=False)
+        cells.to_parquet(os.path.join(export_dir, CELLS_FILE), compression=compression)
+
+    steps = np.arange(num_steps, dtype=np.int32)
+    timesteps = {'step': pa.array(steps), 'block': pa.array(steps // steps_per_block)}
+    if times is not None:
+        timesteps['time'] = pa.array([t.decode('utf-8') if isinstance(t, bytes) else str(t) for t in times])
+    pq.write_table(pa.table(timesteps), os.path.join(export_dir, TIMESTEPS_FILE), compression=compression)
+
+    rows = 0
+    for block, start in enumerate(range(0, num_steps, steps_per_block)):
+        values = np.asarray(depth_data[start:start + steps_per_block], dtype=np.float32)
+        step_offsets, cell_ids = np.nonzero(values > wet_depth)
+        table = pa.table({
+            'step': (step_offsets + start).astype(np.int32),
+            'cell_id': cell_ids.astype(np.int32),
+            'depth': values[step_offsets, cell_ids],
+        })
+        block_dir = os.path.join(export_dir, DEPTH_DIR, f"block={block}")
+        os.makedirs(block_dir)
+        pq.write_table(table, os.path.join(block_dir, "part.parquet"), compression=compression)
+        rows += table.num_rows
+
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(export_dir) for name in names)
+    logger.info(f"水深Parquet已导出到 {export_dir}，时间步数: {num_steps}，网格数: {num_cells}，"
+                f"过水记录数: {rows}，大小: {size / 1024 / 1024:.1f}MB")
+    return rows
+
+
+def read_depth_step(export_dir, step, num_cells=None):
+    """
+    读取某个时间步的水深，只读取该时间步所在的分区
+    :param num_cells: 不为None时返回长度为num_cells的稠密数组（未过水的网格为0），否则返回(cell_id, depth)
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    block = pq.read_table(os.path.join(export_dir, TIMESTEPS_FILE), columns=['block'])['block'][step].as_py()
+    block_file = os.path.join(export_dir, DEPTH_DIR, f"block={block}", "part.parquet")
+    table = ds.dataset(block_file, format="parquet").to_table(columns=['cell_id', 'depth'],
+                                                                 filter=ds.field('step') == step)
+    cell_ids = table['cell_id'].to_numpy()
+    depth = table['depth'].to_numpy()
+    if num_cells is None:
+        return cell_ids, depth
+    dense = np.zeros(num_cells, dtype=np.float32)
+    dense[cell_ids] = depth
+    return dense
+
+
+def read_timestep_layer(export_dir, step, include_dry=False):
+    """
+    重建某个时间步的水深图层
+    :param include_dry: 为True时输出所有网格（未过水的网格水深为0），否则只输出过水网格
+    :return: GeoDataFrame，字段为cell_id、depth、time（有时间列时）
+    """
+    import geopandas as gpd
+    import pyarrow.parquet as pq
+
+    cells = gpd.read_parquet(os.path.join(export_dir, CELLS_FILE))
+    if include_dry:
+        layer = cells.copy()
+        layer['depth'] = read_depth_step(export_dir, step, num_cells=len(cells))
+    else:
+        cell_ids, depth = read_depth_step(export_dir, step)
+        layer = cells.iloc[cell_ids].reset_index(drop=True)
+        layer['depth'] = depth
+    timesteps = pq.read_table(os.path.join(export_dir, TIMESTEPS_FILE))
+    if 'time' in timesteps.column_names:
+        layer['time'] = timesteps['time'][step].as_py()
+    return layer
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 from logger import logger
+from flood_stats import compute_cell_stats
 # import shapefile
 
 
@@ -30,6 +31,19 @@ class PostProcessor:
                 break
         return cells_number
 
+    def summarize_cells(self, depth_data: np.ndarray, interval_hours=1 / 6, wet_depth=0.01, flood_depth=0.2):
+        """
+        按网格汇总水深过程，每个网格只保留一行统计值
+        :param depth_data: 水深数据，行代表时间步，列代表网格FID
+        :param interval_hours: 相邻时间步的间隔（小时），默认10分钟；可由flood_stats.output_interval_hours从时间戳得到
+        :param wet_depth: 判断网格过水的水深阈值(m)
+        :param flood_depth: 统计淹没历时的水深阈值(m)
+        :return: 字典，包含max_depth、max_step、first_wet_step、last_wet_step（从未过水为-1）、flood_hours，
+        均为长度等于网格数的一维数组，详见flood_stats.compute_cell_stats
+        """
+        return compute_cell_stats(depth_data, thresholds=(flood_depth,), wet_depth=wet_depth,
+                                  interval_hours=interval_hours)
+
     def get_water_level(self, wse_data, real_mesh):
         """
         返回记录水位的二维数组，行代表时间步，列代表网格FID
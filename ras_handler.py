@@ -1,8 +1,8 @@
 # -*- coding: UTF-8 -*-
 import os
-from subprocess import Popen, PIPE, STDOUT
 
 from logger import logger
+from ras_runner import RASRunner
 
 
 class RASHandler:
@@ -213,26 +213,31 @@ class RASHandler:
             # 把MI以下的所有内容写入文件中
             f.writelines(ic_down)
 
-    def run_model(self, filepath):
+    def start_model(self, filepath, runner=None, job_id=None, sim_start=None, sim_end=None):
         """
-        运行模型
+        后台运行模型，立即返回
+        :param filepath: 可执行文件路径
+        :param runner: ras_runner.RASRunner，为None时新建一个，完整输出写到可执行文件所在目录的ras_jobs下
+        :param job_id: 任务编号，用于查询进度和命名输出日志
+        :param sim_start: 模拟开始时刻（datetime），与sim_end一起用于计算进度
+        :param sim_end: 模拟结束时刻（datetime）
+        :return: (runner, ras_runner.RASJob)
+        """
+        if runner is None:
+            runner = RASRunner(os.path.join(os.path.dirname(filepath), 'ras_jobs'), logger=logger)
+        return runner, runner.start(filepath, job_id=job_id, sim_start=sim_start, sim_end=sim_end)
+
+    def run_model(self, filepath, runner=None, job_id=None, sim_start=None, sim_end=None):
+        """
+        运行模型并等待结束，输出由后台线程写入任务日志，公共日志只记录进度
         :param filepath: 可执行文件路径
         :type filepath: str
         :return: 进程返回值, 0 成功, 非 0 失败
         :rtype: int
+        :raises ras_runner.ModelDivergedError: 计算被runner的看门狗判定为发散并提前结束，调用方可调整参数后重新计算
         """
-        path, name = os.path.split(filepath)
-
-        # 创建子进程
-        proc: Popen = Popen(args=["bash", name],
-                            stdout=PIPE, stderr=STDOUT, cwd=path)
-
-        # 获取进程输出
-        for line in proc.stdout:
-            logger.info(line.decode().rstrip())
-
-        # 等待子进程结束
-        return proc.wait()
+        runner, job = self.start_model(filepath, runner, job_id, sim_start, sim_end)
+        return runner.wait(job)
 
 
 # 下面是用于临时测试的代码
@@ -1,6 +1,7 @@
 # -*- coding: UTF-8 -*-
 import os
-from subprocess import Popen, PIPE, STDOUT
+
+from ras_runner import RASRunner
 
 import logging
 logger = logging.getLogger(__name__)
@@ -213,26 +214,63 @@ class RASHandler:
             # 把MI以下的所有内容写入文件中
             f.writelines(ic_down)
 
-    def run_model(self, filepath):
+    def modify_restart(self, filepath, output_path, restart_file=None, write_restart=False):
+        """
+        修改b01文件的初始条件：是否从restart文件热启动、是否在模拟结束时写出restart文件
+        Restart Filename、Write Restart File两个键按Windows版HEC-RAS的b01格式写入，尚未在Linux计算引擎上核实
+        :param filepath: b01文件的路径
+        :param output_path: 输出文件的路径
+        :param restart_file: restart文件名（相对b01所在目录），为None时按b01中的初始条件冷启动
+        :param write_restart: 是否在模拟结束时写出restart文件（预热期计算时使用）
+        :return: 无返回值
         """
-        运行模型
+        ic_line_index = self.__str_search(
+            filepath, 'Initial Conditions (use restart file?)')[0]
+
+        with open(filepath, mode='r', encoding='utf-8') as f:
+            file_lines = f.readlines()
+
+        # IC行的缩进和等号位置沿用原文件，参考格式为：  Initial Conditions (use restart file?) = 0
+        ic_line = file_lines[ic_line_index]
+        indent = ic_line[:len(ic_line) - len(ic_line.lstrip())]
+        ic_key = ic_line.split('=')[0]
+        # 去掉原有的restart文件名和写出restart文件的行，下面按参数重新写
+        ic_down = [line for line in file_lines[ic_line_index + 1:]
+                   if not line.strip().startswith(('Restart Filename', 'Write Restart File'))]
+
+        with open(output_path, mode='w', encoding='utf-8') as f:
+            f.writelines(file_lines[:ic_line_index])
+            f.writelines(f"{ic_key}= {-1 if restart_file else 0}\n")
+            if restart_file:
+                f.writelines(f"{indent}Restart Filename      = {restart_file}\n")
+            f.writelines(f"{indent}Write Restart File    = {-1 if write_restart else 0}\n")
+            f.writelines(ic_down)
+
+    def start_model(self, filepath, runner=None, job_id=None, sim_start=None, sim_end=None):
+        """
+        后台运行模型，立即返回
+        :param filepath: 可执行文件路径
+        :param runner: ras_runner.RASRunner，为None时新建一个，完整输出写到可执行文件所在目录的ras_jobs下
+        :param job_id: 任务编号，用于查询进度和命名输出日志
+        :param sim_start: 模拟开始时刻（datetime），与sim_end一起用于计算进度
+        :param sim_end: 模拟结束时刻（datetime）
+        :return: (runner, ras_runner.RASJob)
+        """
+        if runner is None:
+            runner = RASRunner(os.path.join(os.path.dirname(filepath), 'ras_jobs'), logger=logger)
+        return runner, runner.start(filepath, job_id=job_id, sim_start=sim_start, sim_end=sim_end)
+
+    def run_model(self, filepath, runner=None, job_id=None, sim_start=None, sim_end=None):
+        """
+        运行模型并等待结束，输出由后台线程写入任务日志，公共日志只记录进度
         :param filepath: 可执行文件路径
         :type filepath: str
         :return: 进程返回值, 0 成功, 非 0 失败
         :rtype: int
+        :raises ras_runner.ModelDivergedError: 计算被runner的看门狗判定为发散并提前结束，调用方可调整参数后重新计算
         """
-        path, name = os.path.split(filepath)
-
-        # 创建子进程
-        proc: Popen = Popen(args=["bash", name],
-                            stdout=PIPE, stderr=STDOUT, cwd=path)
-
-        # 获取进程输出
-        for line in proc.stdout:
-            logger.info(line.decode().rstrip())
-
-        # 等待子进程结束
-        return proc.wait()
+        runner, job = self.start_model(filepath, runner, job_id, sim_start, sim_end)
+        return runner.wait(job)
 
 
 # 下面是用于临时测试的代码
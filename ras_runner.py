@@ -0,0 +1,290 @@
+# -*- coding: UTF-8 -*-
+"""
+HEC-RAS计算进程管理
+在后台启动run_unsteady.sh，由后台线程逐行读取输出：完整输出写入每个计算任务单独的日志文件，
+从输出中解析当前模拟时刻（或百分比）得到计算进度，按已用时间估算剩余时间；
+公共日志只记录开始、结束和每10%的进度，任务状态可以随时查询
+计算过程中由看门狗监视发散迹象（输出中HEC-RAS的不稳定报错或NaN水位、长时间没有任何新的输出），发现后立即结束进程并把任务标记为发散，
+调用方可以捕获ModelDivergedError后调整参数重新计算，而不必等到计算结束后再由结果的时间步数判断
+"""
+import os
+import re
+import signal
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from subprocess import Popen, PIPE, STDOUT
+
+from logger import logger as default_logger
+
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCESS = "success"
+FAILED = "failed"
+DIVERGED = "diverged"
+CANCELLED = "cancelled"
+
+# HEC-RAS输出中的模拟时刻，例如"26MAR2023 09:10:00"、"26Mar2023 0910"、"26MAR2023,2400"
+SIM_TIME_PATTERN = re.compile(r"\b(\d{2})([A-Za-z]{3})(\d{4})[ ,]+(\d{2}):?(\d{2})(?::(\d{2}))?\b")
+# HEC-RAS输出中的百分比进度，例如" 45%"、"45.5 %"
+PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+
+# HEC-RAS输出中的发散报错，例如"The solution went unstable"、"Computations terminated due to instability"，
+# 以及输出的数值为NaN或无穷大（"WSEL = NaN"、"= -1.#IND"）；只匹配报错语句和赋值形式，不匹配普通文字中的NaN等单词
+DIVERGENCE_PATTERN = re.compile(
+    r"(?i:\b(?:solution|model|computations?|simulation)\s+(?:went|has\s+gone|has\s+become|became|is|was)\s+unstable\b"
+    r"|\bterminated\s+due\s+to\s+(?:model\s+)?instabilit)"
+    r"|[=:]\s*(?:NaN|[+-]?Infinity|-?1\.#IND)\b")
+
+_MONTHS = {name: i + 1 for i, name in enumerate(
+    ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'])}
+
+
+def parse_sim_time(line):
+    """
+    解析一行输出中的模拟时刻
+    :return: datetime，没有模拟时刻时返回None；24:00按第二天00:00处理
+    """
+    match = SIM_TIME_PATTERN.search(line)
+    if match is None:
+        return None
+    day, month, year, hour, minute, second = match.groups()
+    month = _MONTHS.get(month.upper())
+    if month is None:
+        return None
+    try:
+        base = datetime(int(year), month, int(day))
+    except ValueError:
+        return None
+    return base + timedelta(hours=int(hour), minutes=int(minute), seconds=int(second or 0))
+
+
+class ModelDivergedError(Exception):
+    """HEC-RAS计算发散，已被看门狗提前结束"""
+
+    def __init__(self, job_id, reason):
+        super().__init__(f"HEC-RAS计算发散，任务: {job_id}，原因: {reason}")
+        self.job_id = job_id
+        self.reason = reason
+
+
+class RASJob:
+    """一次HEC-RAS计算"""
+
+    def __init__(self, job_id, sh_path, log_path, sim_start=None, sim_end=None):
+        self.job_id = job_id
+        self.sh_path = sh_path
+        self.log_path = log_path
+        self.sim_start = sim_start
+        self.sim_end = sim_end
+        self.status = PENDING
+        self.return_code = None
+        self.progress = 0.0
+        self.sim_time = None
+        self.started = None
+        self.finished = None
+        # 最近一次有新输出的时刻，用于判断计算是否停滞
+        self.last_output = None
+        # 发散原因，看门狗结束进程后设置
+        self.diverged = None
+        # 是否已被调用方取消
+        self.cancelled = False
+        self.proc = None
+        self.reader = None
+
+    def update_progress(self, line):
+        """由一行输出更新进度，进度只增不减"""
+        progress = None
+        sim_time = parse_sim_time(line)
+        if sim_time is not None and self.sim_start is not None and self.sim_end is not None \
+                and self.sim_end > self.sim_start:
+            self.sim_time = sim_time
+            progress = (sim_time - self.sim_start) / (self.sim_end - self.sim_start)
+        else:
+            match = PERCENT_PATTERN.search(line)
+            if match is not None:
+                progress = float(match.group(1)) / 100
+        if progress is not None and progress > self.progress:
+            self.progress = min(1.0, progress)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def eta(self):
+        """按平均速度估算的剩余时间（秒），还没有进度时为None"""
+        if self.status != RUNNING or self.progress <= 0:
+            return None
+        return self.elapsed * (1 - self.progress) / self.progress
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'return_code': self.return_code,
+            'progress': round(self.progress * 100, 1),
+            'sim_time': self.sim_time.strftime("%Y-%m-%d %H:%M:%S") if self.sim_time else None,
+            'elapsed': round(self.elapsed, 1),
+            'eta': round(self.eta, 1) if self.eta is not None else None,
+            'started_at': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)) if self.started else None,
+            'log_path': self.log_path,
+            'diverged': self.diverged,
+        }
+
+
+class RASRunner:
+    """
+    非阻塞的HEC-RAS计算进程管理
+    start启动计算后立即返回，wait等待计算结束，status查询进度
+    """
+
+    def __init__(self, log_dir, logger=None, stall_timeout=None, divergence_pattern=DIVERGENCE_PATTERN):
+        """
+        :param log_dir: 每个计算任务的完整输出日志目录
+        :param logger: 记录开始、结束和进度的日志记录器，默认为公共日志
+        :param stall_timeout: 超过该时间(s)没有任何新的输出时判定为发散，为None时不检查；
+            按输出是否中断而不是按解析到的进度判断，输出格式无法解析进度时也不会误判
+        :param divergence_pattern: 输出中匹配即判定为发散的正则，为None时不检查
+        """
+        self.log_dir = log_dir
+        self.logger = logger or default_logger
+        self.stall_timeout = stall_timeout
+        self.divergence_pattern = divergence_pattern
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def start(self, sh_path, job_id=None, sim_start=None, sim_end=None):
+        """
+        后台启动计算
+        :param sh_path: run_unsteady.sh路径
+        :param job_id: 任务编号，默认随机生成；同一编号的新任务会覆盖旧任务的状态和日志
+        :param sim_start: 模拟开始时刻（datetime），与sim_end一起用于由模拟时刻计算进度
+        :param sim_end: 模拟结束时刻（datetime）
+        :return: RASJob
+        """
+        job_id = job_id or uuid.uuid4().hex[:12]
+        log_path = os.path.join(self.log_dir, f"{job_id}.log")
+        job = RASJob(job_id, sh_path, log_path, sim_start, sim_end)
+        path, name = os.path.split(sh_path)
+        with self._lock:
+            # 单独的进程组，结束计算时连同run_unsteady.sh启动的RasUnsteady一起结束
+            job.proc = Popen(args=["bash", name], stdout=PIPE, stderr=STDOUT, cwd=path, start_new_session=True)
+            job.started = job.last_output = time.time()
+            job.status = RUNNING
+            self._jobs[job_id] = job
+        job.reader = threading.Thread(target=self._read_output, args=(job,), name=f"ras-{job_id}", daemon=True)
+        job.reader.start()
+        if self.stall_timeout is not None:
+            threading.Thread(target=self._watch_stall, args=(job,), name=f"ras-watch-{job_id}", daemon=True).start()
+        self.logger.info(f"HEC-RAS计算已启动，任务: {job_id}，进程: {job.proc.pid}，输出日志: {log_path}")
+        return job
+
+    def _read_output(self, job):
+        """后台线程：逐行读取输出写入任务日志并更新进度，进程结束后记录返回值"""
+        reported = 0
+        try:
+            with open(job.log_path, 'w', encoding='utf-8', buffering=1) as log_file:
+                for raw_line in job.proc.stdout:
+                    job.last_output = time.time()
+                    line = raw_line.decode(errors='replace').rstrip()
+                    log_file.write(line + "\n")
+                    job.update_progress(line)
+                    if self.divergence_pattern is not None and job.diverged is None \
+                            and self.divergence_pattern.search(line):
+                        self.kill(job, f"输出中出现发散提示: {line.strip()[:200]}")
+                    if int(job.progress * 10) > reported:
+                        reported = int(job.progress * 10)
+                        eta = job.eta
+                        self.logger.info(f"HEC-RAS计算进度: {job.progress * 100:.0f}%，任务: {job.job_id}"
+                                         + (f"，预计剩余: {eta / 60:.1f}分钟" if eta is not None else ""))
+        except Exception as e:
+            self.logger.error(f"读取HEC-RAS输出失败，任务: {job.job_id}: {e}")
+        finally:
+            job.return_code = job.proc.wait()
+            job.finished = time.time()
+            if job.cancelled:
+                job.status = CANCELLED
+                self.logger.info(f"HEC-RAS计算已取消，任务: {job.job_id}，耗时: {job.elapsed:.1f}s")
+            elif job.diverged is not None:
+                job.status = DIVERGED
+                self.logger.error(f"HEC-RAS计算发散，已提前结束，任务: {job.job_id}，原因: {job.diverged}，"
+                                  f"模拟进度: {job.progress * 100:.0f}%，耗时: {job.elapsed:.1f}s")
+            elif job.return_code == 0:
+                job.status = SUCCESS
+                job.progress = 1.0
+                self.logger.info(f"HEC-RAS计算完成，任务: {job.job_id}，耗时: {job.elapsed:.1f}s")
+            else:
+                job.status = FAILED
+                self.logger.error(f"HEC-RAS计算失败，任务: {job.job_id}，返回值: {job.return_code}，"
+                                  f"详见 {job.log_path}")
+
+    def _watch_stall(self, job):
+        """看门狗线程：超过stall_timeout没有任何新的输出时结束进程"""
+        interval = min(10.0, self.stall_timeout / 4)
+        while job.proc.poll() is None:
+            silent = time.time() - job.last_output
+            if silent > self.stall_timeout:
+                self.kill(job, f"{silent:.0f}s没有新的输出，模拟进度停在{job.progress * 100:.1f}%")
+                return
+            time.sleep(interval)
+
+    def kill(self, job, reason):
+        """
+        结束计算进程并把任务标记为发散
+        :param reason: 发散原因，记录在任务状态和ModelDivergedError中
+        """
+        if job.proc.poll() is not None:
+            return
+        job.diverged = reason
+        self._terminate(job)
+
+    def cancel(self, job_id):
+        """
+        取消计算：结束进程并把任务标记为已取消，wait返回非0的返回值
+        :return: 任务是否仍在运行并已被取消
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.proc.poll() is not None:
+            return False
+        job.cancelled = True
+        self._terminate(job)
+        return True
+
+    @staticmethod
+    def _terminate(job):
+        """结束计算进程所在的整个进程组"""
+        try:
+            os.killpg(job.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, AttributeError):
+            job.proc.kill()
+
+    def wait(self, job, timeout=None):
+        """
+        等待计算结束
+        :return: 进程返回值，0成功，非0失败；超时返回None
+        :raises ModelDivergedError: 计算被看门狗判定为发散并提前结束
+        """
+        job.reader.join(timeout)
+        if job.reader.is_alive():
+            return None
+        if job.status == DIVERGED:
+            raise ModelDivergedError(job.job_id, job.diverged)
+        return job.return_code
+
+    def status(self, job_id=None):
+        """
+        :return: job_id为None时返回全部任务的状态列表，否则返回该任务的状态（不存在时为None）
+        """
+        with self._lock:
+            if job_id is not None:
+                job = self._jobs.get(job_id)
+                return job.to_dict() if job is not None else None
+            return [job.to_dict() for job in self._jobs.values()]
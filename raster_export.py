@@ -0,0 +1,161 @@
+# -*- coding: UTF-8 -*-
+"""
+水深栅格（Cloud-Optimized GeoTIFF）输出
+按配置的分辨率把网格栅格化一次，得到每个像元对应的网格FID（网格编号栅格），编译为二进制缓存(.npz)；
+之后每个时间步的水深栅格只需按网格编号栅格做一次NumPy取值，耗时与网格多边形数量无关，
+输出为分块、压缩并带金字塔的COG
+依赖rasterio
+"""
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from geometry_store import load_geometry_store, shp_signature
+from logger import logger
+
+
+# 输出栅格的无数据值
+NODATA = -9999.0
+
+_lock = threading.Lock()
+# 进程内缓存：{(shp绝对路径, 分辨率): (shp文件签名, CellRaster)}
+_rasters = {}
+
+
+class CellRaster:
+    """
+    网格编号栅格：cell_ids中每个像元为所在网格的FID，不在任何网格内为-1
+    transform为仿射变换参数(a, b, c, d, e, f)，与rasterio.Affine一致
+    """
+
+    def __init__(self, cell_ids, transform, crs):
+        self.cell_ids = cell_ids
+        self.transform = transform
+        self.crs = crs
+        flat = cell_ids.ravel()
+        # 有网格覆盖的像元位置及其网格FID，每个时间步只需要按这两个数组取值和赋值
+        self.pixel_index = np.flatnonzero(flat >= 0)
+        self.pixel_cells = flat[self.pixel_index]
+
+    @property
+    def shape(self):
+        return self.cell_ids.shape
+
+    def render(self, values, dry_value=None):
+        """
+        将逐网格的值映射为栅格
+        :param values: 长度为网格数的数组
+        :param dry_value: 不为None时小于等于该值的像元也记为无数据（例如只显示淹没区域）
+        :return: float32栅格，无网格覆盖的像元为NODATA
+        """
+        raster = np.full(self.cell_ids.size, NODATA, dtype=np.float32)
+        pixel_values = np.asarray(values, dtype=np.float32).take(self.pixel_cells)
+        if dry_value is not None:
+            pixel_values[pixel_values <= dry_value] = NODATA
+        raster[self.pixel_index] = pixel_values
+        return raster.reshape(self.cell_ids.shape)
+
+
+def build_cell_raster(geometry_store, resolution):
+    """
+    将网格栅格化为网格编号栅格
+    :param geometry_store: geometry_store.CellGeometryStore
+    :param resolution: 像元大小，单位与模型坐标系一致（一般为m）
+    """
+    from rasterio import features
+    from rasterio.transform import from_origin
+
+    minx, miny, maxx, maxy = shapely.total_bounds(geometry_store.geometry)
+    width = int(np.ceil((maxx - minx) / resolution))
+    height = int(np.ceil((maxy - miny) / resolution))
+    transform = from_origin(minx, maxy, resolution, resolution)
+    cell_ids = features.rasterize(zip(geometry_store.geometry, range(len(geometry_store))),
+                                  out_shape=(height, width), transform=transform, fill=-1, dtype='int32')
+    return CellRaster(cell_ids, tuple(transform)[:6], geometry_store.crs)
+
+
+def load_cell_raster(shp_path, resolution, cache_file=None):
+    """
+    加载网格编号栅格，进程内只在shp文件变化时重新构建
+    :param shp_path: 参考shp网格路径
+    :param resolution: 像元大小(m)
+    :param cache_file: 二进制缓存文件路径，默认与shp同目录的.raster_<分辨率>m.npz
+    :return: CellRaster
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(shp_path)[0] + f".raster_{resolution:g}m.npz"
+    signature = shp_signature(shp_path)
+    key = (os.path.abspath(shp_path), float(resolution))
+    with _lock:
+        cached = _rasters.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        cell_raster = None
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cache:
+                    if tuple(cache['signature'].tolist()) == tuple(signature):
+                        cell_raster = CellRaster(cache['cell_ids'], tuple(cache['transform'].tolist()),
+                                                 str(cache['crs']) or None)
+            except Exception as e:
+                logger.warning(f"网格编号栅格缓存读取失败，将重新构建: {e}")
+        if cell_raster is None:
+            cell_raster = build_cell_raster(load_geometry_store(shp_path), resolution)
+            try:
+                np.savez_compressed(cache_file, signature=np.array(signature, dtype=np.int64),
+                                    cell_ids=cell_raster.cell_ids, transform=np.array(cell_raster.transform),
+                                    crs=np.array(cell_raster.crs or ''))
+                logger.info(f"网格编号栅格已编译为缓存: {cache_file}")
+            except OSError as e:
+                logger.warning(f"网格编号栅格缓存写入失败: {e}")
+        _rasters[key] = (signature, cell_raster)
+        logger.info(f"成功加载网格编号栅格，分辨率: {resolution}m，大小: {cell_raster.shape}，"
+                    f"有效像元数: {len(cell_raster.pixel_index)}")
+        return cell_raster
+
+
+def write_cog(path, raster, cell_raster, blocksize=512, compress='DEFLATE'):
+    """
+    将栅格写为Cloud-Optimized GeoTIFF（分块、压缩、带金字塔）
+    """
+    import rasterio
+    from rasterio.transform import Affine
+
+    profile = {
+        'driver': 'COG',
+        'width': raster.shape[1],
+        'height': raster.shape[0],
+        'count': 1,
+        'dtype': 'float32',
+        'nodata': NODATA,
+        'crs': cell_raster.crs,
+        'transform': Affine(*cell_raster.transform),
+        'blocksize': blocksize,
+        'compress': compress,
+        'predictor': 3,
+        'overviews': 'AUTO',
+        'overview_resampling': 'NEAREST',
+    }
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(raster, 1)
+    return path
+
+
+def write_depth_rasters(cell_raster, depth_data, output_dir, steps=None, dry_value=0.01, name='depth'):
+    """
+    逐时间步输出水深COG：<output_dir>/<name>_<时间步>.tif
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID；可以是h5py数据集（逐行读取）
+    :param steps: 输出的时间步序号，为None时输出全部时间步
+    :param dry_value: 水深小于等于该值的像元记为无数据
+    :return: 输出文件路径列表
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    steps = range(depth_data.shape[0]) if steps is None else steps
+    paths = []
+    for step in steps:
+        raster = cell_raster.render(depth_data[step], dry_value)
+        paths.append(write_cog(os.path.join(output_dir, f"{name}_{step}.tif"), raster, cell_raster))
+    return paths
@@ -12,13 +12,19 @@
 """
 import os
 import csv
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 import numpy as np
 import pandas as pd
 from to_csv import insert_time_and_save_to_csv
 from hdf_handler import HDFHandler
 from post_processor import PostProcessor
 from ras_handler_safety_discharge import RASHandler
+from ras_runner import RASRunner, ModelDivergedError
 from time_format_converter import TimeFormatConverter
+from warm_start import SPINUP_HOURS, spinup_key, cached_restart, save_restart, attach_restart
+from workspace_pool import WorkspacePool
 from config_ubuntu import *
 import logging
 from log_handler import ImmediateFileHandler
@@ -34,10 +40,21 @@ logger.addHandler(handler)
 b01_path = os.path.join(RAS_PATH, f"FZLall.b01")
 p01_hdf_path = os.path.join(RAS_PATH, f"FZLall.p01.hdf")
 output_path = "/home/v01dwm/safety_discharge_results"
+# HEC-RAS超过该时间(s)没有任何新的输出时判定为发散，提前结束计算，为None时不检查
+# 输出经管道块缓冲、可能长时间没有新输出，按真实计算日志标定之前保持关闭（见config.py中的RAS_STALL_TIMEOUT）
+RAS_STALL_TIMEOUT = None
+ras_runner = RASRunner(os.path.join(output_path, "ras_jobs"), logger=logger, stall_timeout=RAS_STALL_TIMEOUT)
 initial_data_path = "data.xlsx"
 
 ymdhm_start = "2025-03-22 08:00"
 ymdhm_end = "2025-03-25 19:00"
+# 热启动：每个流量工况的12小时预热期只计算一次并缓存restart文件，之后的试算都从预热期末开始；为False时每次都从头模拟
+# b01中restart的设置尚未在Linux计算引擎上核实（见warm_start），核实前保持关闭
+WARM_START = False
+restart_cache_dir = os.path.join(RAS_PATH, "restart")
+# 并行试算的模型工作目录份数，即同时运行的HEC-RAS计算数
+SWEEP_WORKERS = 4
+workspace_pool = WorkspacePool(RAS_PATH, RAS_PATH + "_workspaces", SWEEP_WORKERS)
 
 FID_lianghekou = [2183, 2184, 2185, 2186, 2187, 2188, 2189,
                   2252, 2253, 2254, 2255, 2256, 2257, 2258,
@@ -74,143 +91,215 @@ xq_list_initial_bly = initial_data_df[0].values.ravel()
 xq_list_initial_mzt = initial_data_df[1].values.ravel()
 xq_list_xhd = initial_data_df[2].values.ravel()
 
-for i in range(100, 9000, 300):
-    logger.info(f"开始模拟Q = {i}的工况...")
-    print(f"开始模拟Q = {i}的工况...")
-    # 构造72小时+12小时恒定流ndarray
-    xq_list_fzl = np.ones(84) * i
-    # 佛子岭水库的泄流过程推迟8小时，以确保水库中有足够的水量
-    xq_list_fzl[:12] = 0
-
-    # 修改白莲崖、磨子潭、响洪甸边界条件
-    xq_list_bly = xq_list_initial_bly + i / 2
-    xq_list_mzt = xq_list_initial_mzt + i / 2
-
-    try:
-        logger.info(f"将Q = {i}写入佛子岭水库边界条件中...")
-        print(f"将Q = {i}写入佛子岭水库边界条件中...")
-        # 修改边界条件
-        ras_handler = RASHandler(xq_list_fzl)
-        time_format_converter = TimeFormatConverter()
-        # 修改b01文件
-        start_time_b01_and_hdf = time_format_converter.convert(ymdhm_start, 'b01')
-        end_time_b01_and_hdf = time_format_converter.convert(ymdhm_end, 'b01')
-        ras_handler.modify_b01(b01_path, b01_path, start_time_b01_and_hdf, end_time_b01_and_hdf, '1MIN', '1HOUR')
-
-        # 修改.p01.hdf文件，修改其中的边界条件并把Results删除后改名为.p01.tmp.hdf
-        hdf_handler = HDFHandler(p01_hdf_path, ymdhm_start, ymdhm_end)
-        # 修改佛子岭水库出库边界
-        hdf_handler.modify_boundary_conditions_with_xhd_hpt_rating_curve(xq_list_bly, xq_list_mzt, xq_list_fzl, xq_list_xhd, start_time_b01_and_hdf, end_time_b01_and_hdf)
-
-        # 获取符合hdf_handler.modify_plan_data方法要求的start_date和end_date，为该方法的调用做好准备
-        start_time_plan_data = time_format_converter.convert(ymdhm_start, 'simulation')
-        end_time_plan_data = time_format_converter.convert(ymdhm_end, 'simulation')
-        # 修改p01.hdf文件中的Plan Data->Plan Information中的Simulation End Time、Simulation Start Time和Time Window
-        hdf_handler.modify_plan_data(start_time_plan_data, end_time_plan_data)
-
-        # 得到.p01.tmp.hdf供Linux ras调用
-        hdf_handler.remove_hdf_results()
-    except Exception as e:
-        logger.error(e)
-
-    # 调用run_unsteady.sh进行计算
-    try:
-        logger.info("开始调用HEC-RAS计算...")
-        print("开始调用HEC-RAS计算...")
-        sh_path = os.path.dirname(b01_path) + os.path.sep + 'run_unsteady.sh'
-        return_code = ras_handler.run_model(sh_path)
-        logger.info("HEC-RAS计算完成")
-        print("HEC-RAS计算完成")
-    except Exception as e:
-        logger.error(e)
-
-    try:
-        logger.info("开始提取水深数据......")
-        print("开始提取水深数据......")
-        # 从.p01.hdf结果文件中读取需要的数据
-        cells_minimum_elevation_data = hdf_handler.read_dataset(
-            'Cells Minimum Elevation')
-        wse_data = hdf_handler.read_dataset('Water Surface')
-
-        post_processor = PostProcessor()
-        # 将Cells中多余的高程为nan的空网格删去
-        real_mesh = post_processor.get_real_mesh(cells_minimum_elevation_data)
-        # 调用generating_depth方法，用水位减去高程，即得水深值
-        depth_data = post_processor.generating_depth(
-            cells_minimum_elevation_data, wse_data, real_mesh)
-        logger.info("水深数据提取已完成")
-        print("水深数据提取已完成")
-        logger.info(f"Q = {i}条件下，depth_data中总共含有{depth_data.shape[0]}行数据")
-        print(f"Q = {i}条件下，depth_data中总共含有{depth_data.shape[0]}行数据")
-
-        # 提取5个点附近的网格的水深时序数据
-        locations = {
-            "lianghekou": FID_lianghekou,
-            "huoshanzhongxue": FID_huoshanzhongxue,
-            "qingshanxiang": FID_qingshanxiang,
-            "xiafuqiao": FID_xiafuqiao,
-            "yingjia": FID_yingjia
-        }
-        # 遍历字典，逐个生成CSV文件
-        for name, fid in locations.items():
-            # 提取对应列的数据
-            data = depth_data[:, fid]
-
-            # ---------- 核心计算逻辑 ----------
-            # 计算每行的和
-            row_sums = np.sum(data, axis=1)
-            # 找到最大行和的索引
-            max_row_index = np.argmax(row_sums)
-            # 提取该行的数据
-            max_row_data = data[max_row_index, :]
-            # 计算行和的最大值
-            max_row_sum = row_sums[max_row_index]
-            # 计算该行的平均值
-            max_row_mean = np.mean(max_row_data)
-            # ---------------------------------
-            logger.info(f"在Q = {i}的条件下，{name}区域内的最大水深和为{max_row_sum}，最大平均水深为{max_row_mean}")
-            print(f"在Q = {i}的条件下，{name}区域内的最大水深和为{max_row_sum}，最大平均水深为{max_row_mean}")
-
-            # 生成文件名（如 "lianghekou.csv"）
-            filename = os.path.join(output_path, f"{name}_{i}.csv")
-
-            # 写入CSV
-            with open(filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(fid)  # 列标题为列索引列表
-                writer.writerows(data)  # 直接写入NumPy数组
-            # logger.info(f"{name}区域对应Q = {i}时的水深时序数据已保存到{name}_{i}.csv文件中")
-
-        # # 查找给定网格是否淹没
-        # for index, cell in enumerate(FID):
-        #     # 认为水深>=0.1m时算作淹没
-        #     if not ((depth_data[:, cell] < 0.1).all()):
-        #         if flood_Q[FID_name[index]] is None:
-        #             logger.info(f"保证 {FID_name[index]} 不淹没的安全泄量为Q = {i}")
-        #             flood_Q[FID_name[index]] = i
-
-        # csv_path = output_path + os.path.sep + f"output_{i}.csv"
-        # # 将水深计算结果输出为csv文件
-        # insert_time_and_save_to_csv(depth_data, csv_path)
-        # logger.info(f"水深数据已写入到{csv_path}")
-
-        # # 判断是否已经得到所有的安全泄量
-        # if all(value is not None for value in flood_Q.values()):
-        #     break
-        # for key, value in flood_Q.items():
-        #     if value is not None:
-        #         logger.info(f"{key}的安全泄量为Q = {value}")
-        logger.info("------------------------")
-        print("------------------------")
-    except Exception as e:
-        logger.error(e)
-
-# # 将安全泄量写入到csv文件中
-# csv_file = "safety_discharge.csv"
-# headers = ["Name", "Q_safe"]
-# # 写入文件
-# with open(csv_file, 'w', newline='', encoding='utf-8-sig') as f:  # 注意编码和换行符
-#     writer = csv.writer(f)
-#     writer.writerow(headers)  # 写入表头
-#     for key, value in flood_Q.items():
-#         writer.writerow([key, value])  # 逐行写入键值对
+def spinup_restart(workspace, xq_list_bly, xq_list_mzt):
+    """
+    取预热期末的restart文件，这组初始条件没有缓存时先在已借用的工作目录中计算一次预热期
+    预热期佛子岭零出流，白莲崖、磨子潭取本工况的入流，响洪甸取初始入流
+    :return: (缓存的restart文件路径, 预热期结束时刻yyyy-mm-dd hh:mm)
+    """
+    n = SPINUP_HOURS + 1
+    key = spinup_key(ymdhm_start, xq_list_bly[:n], xq_list_mzt[:n], xq_list_xhd[:n])
+    spinup_end = (datetime.strptime(ymdhm_start, "%Y-%m-%d %H:%M") + timedelta(hours=SPINUP_HOURS)).strftime(
+        "%Y-%m-%d %H:%M")
+    restart = cached_restart(restart_cache_dir, key)
+    if restart is not None:
+        return restart, spinup_end
+
+    logger.info(f"开始计算{SPINUP_HOURS}小时预热期...")
+    workspace_b01_path = os.path.join(workspace, os.path.basename(b01_path))
+    ras_handler = RASHandler(np.zeros(n))
+    time_format_converter = TimeFormatConverter()
+    start_time_b01_and_hdf = time_format_converter.convert(ymdhm_start, 'b01')
+    end_time_b01_and_hdf = time_format_converter.convert(spinup_end, 'b01')
+    ras_handler.modify_b01(workspace_b01_path, workspace_b01_path, start_time_b01_and_hdf, end_time_b01_and_hdf,
+                           '1MIN', '1HOUR')
+    ras_handler.modify_restart(workspace_b01_path, workspace_b01_path, write_restart=True)
+    hdf_handler = HDFHandler(os.path.join(workspace, os.path.basename(p01_hdf_path)), ymdhm_start, spinup_end)
+    hdf_handler.modify_boundary_conditions_with_xhd_hpt_rating_curve(
+        xq_list_bly[:n], xq_list_mzt[:n], np.zeros(n), xq_list_xhd[:n],
+        start_time_b01_and_hdf, end_time_b01_and_hdf)
+    hdf_handler.modify_plan_data(time_format_converter.convert(ymdhm_start, 'simulation'),
+                                 time_format_converter.convert(spinup_end, 'simulation'))
+    hdf_handler.remove_hdf_results()
+    since = time.time()
+    if ras_handler.run_model(os.path.join(workspace, 'run_unsteady.sh'), runner=ras_runner, job_id=f"spinup_{key}",
+                             sim_start=datetime.strptime(ymdhm_start, "%Y-%m-%d %H:%M"),
+                             sim_end=datetime.strptime(spinup_end, "%Y-%m-%d %H:%M")) != 0:
+        raise RuntimeError("预热期计算失败")
+    return save_restart(restart_cache_dir, key, workspace, since), spinup_end
+
+
+def run_level(i):
+    """借用一份工作目录计算佛子岭出流为i的工况，把各区域的水深时序写入CSV"""
+    with workspace_pool.acquire() as workspace:
+        workspace_b01_path = os.path.join(workspace, os.path.basename(b01_path))
+        workspace_p01_hdf_path = os.path.join(workspace, os.path.basename(p01_hdf_path))
+        logger.info(f"开始模拟Q = {i}的工况...")
+        print(f"开始模拟Q = {i}的工况...")
+        # 构造72小时+12小时恒定流ndarray
+        xq_list_fzl = np.ones(84) * i
+        # 佛子岭水库的泄流过程推迟8小时，以确保水库中有足够的水量
+        xq_list_fzl[:12] = 0
+
+        # 修改白莲崖、磨子潭、响洪甸边界条件
+        xq_list_bly = xq_list_initial_bly + i / 2
+        xq_list_mzt = xq_list_initial_mzt + i / 2
+
+        # 热启动时试算从预热期末开始，流量过程去掉预热期的部分
+        skip = 0
+        restart_file = None
+        ymdhm_run_start = ymdhm_start
+        if WARM_START:
+            try:
+                restart_path, ymdhm_run_start = spinup_restart(workspace, xq_list_bly, xq_list_mzt)
+                restart_file = attach_restart(restart_path, workspace)
+                skip = SPINUP_HOURS
+            except Exception as e:
+                logger.error(f"Q = {i}的预热期restart文件准备失败，改为冷启动: {e}")
+
+        try:
+            logger.info(f"将Q = {i}写入佛子岭水库边界条件中...")
+            print(f"将Q = {i}写入佛子岭水库边界条件中...")
+            # 修改边界条件
+            ras_handler = RASHandler(xq_list_fzl[skip:])
+            time_format_converter = TimeFormatConverter()
+            # 修改b01文件
+            start_time_b01_and_hdf = time_format_converter.convert(ymdhm_run_start, 'b01')
+            end_time_b01_and_hdf = time_format_converter.convert(ymdhm_end, 'b01')
+            ras_handler.modify_b01(workspace_b01_path, workspace_b01_path, start_time_b01_and_hdf, end_time_b01_and_hdf, '1MIN', '1HOUR')
+            ras_handler.modify_restart(workspace_b01_path, workspace_b01_path, restart_file)
+
+            # 修改.p01.hdf文件，修改其中的边界条件并把Results删除后改名为.p01.tmp.hdf
+            hdf_handler = HDFHandler(workspace_p01_hdf_path, ymdhm_run_start, ymdhm_end)
+            # 修改佛子岭水库出库边界
+            hdf_handler.modify_boundary_conditions_with_xhd_hpt_rating_curve(xq_list_bly[skip:], xq_list_mzt[skip:], xq_list_fzl[skip:], xq_list_xhd[skip:], start_time_b01_and_hdf, end_time_b01_and_hdf)
+
+            # 获取符合hdf_handler.modify_plan_data方法要求的start_date和end_date，为该方法的调用做好准备
+            start_time_plan_data = time_format_converter.convert(ymdhm_run_start, 'simulation')
+            end_time_plan_data = time_format_converter.convert(ymdhm_end, 'simulation')
+            # 修改p01.hdf文件中的Plan Data->Plan Information中的Simulation End Time、Simulation Start Time和Time Window
+            hdf_handler.modify_plan_data(start_time_plan_data, end_time_plan_data)
+
+            # 得到.p01.tmp.hdf供Linux ras调用
+            hdf_handler.remove_hdf_results()
+        except Exception as e:
+            logger.error(e)
+
+        # 调用run_unsteady.sh进行计算
+        try:
+            logger.info("开始调用HEC-RAS计算...")
+            print("开始调用HEC-RAS计算...")
+            return_code = ras_handler.run_model(os.path.join(workspace, 'run_unsteady.sh'), runner=ras_runner, job_id=f"Q{i}",
+                                                sim_start=datetime.strptime(ymdhm_run_start, "%Y-%m-%d %H:%M"),
+                                                sim_end=datetime.strptime(ymdhm_end, "%Y-%m-%d %H:%M"))
+            logger.info("HEC-RAS计算完成")
+            print("HEC-RAS计算完成")
+        except ModelDivergedError as e:
+            # 发散的计算已被提前结束，没有可用的结果，直接试算下一个流量
+            logger.error(e)
+            print(e)
+            return
+        except Exception as e:
+            logger.error(e)
+
+        try:
+            logger.info("开始提取水深数据......")
+            print("开始提取水深数据......")
+            # 从.p01.hdf结果文件中读取需要的数据
+            cells_minimum_elevation_data = hdf_handler.read_dataset(
+                'Cells Minimum Elevation')
+            wse_data = hdf_handler.read_dataset('Water Surface')
+
+            post_processor = PostProcessor()
+            # 将Cells中多余的高程为nan的空网格删去
+            real_mesh = post_processor.get_real_mesh(cells_minimum_elevation_data)
+            # 调用generating_depth方法，用水位减去高程，即得水深值
+            depth_data, _ = post_processor.generating_depth(
+                cells_minimum_elevation_data, wse_data, real_mesh)
+            logger.info("水深数据提取已完成")
+            print("水深数据提取已完成")
+            logger.info(f"Q = {i}条件下，depth_data中总共含有{depth_data.shape[0]}行数据")
+            print(f"Q = {i}条件下，depth_data中总共含有{depth_data.shape[0]}行数据")
+
+            # 提取5个点附近的网格的水深时序数据
+            locations = {
+                "lianghekou": FID_lianghekou,
+                "huoshanzhongxue": FID_huoshanzhongxue,
+                "qingshanxiang": FID_qingshanxiang,
+                "xiafuqiao": FID_xiafuqiao,
+                "yingjia": FID_yingjia
+            }
+            # 遍历字典，逐个生成CSV文件
+            for name, fid in locations.items():
+                # 提取对应列的数据
+                data = depth_data[:, fid]
+
+                # ---------- 核心计算逻辑 ----------
+                # 计算每行的和
+                row_sums = np.sum(data, axis=1)
+                # 找到最大行和的索引
+                max_row_index = np.argmax(row_sums)
+                # 提取该行的数据
+                max_row_data = data[max_row_index, :]
+                # 计算行和的最大值
+                max_row_sum = row_sums[max_row_index]
+                # 计算该行的平均值
+                max_row_mean = np.mean(max_row_data)
+                # ---------------------------------
+                logger.info(f"在Q = {i}的条件下，{name}区域内的最大水深和为{max_row_sum}，最大平均水深为{max_row_mean}")
+                print(f"在Q = {i}的条件下，{name}区域内的最大水深和为{max_row_sum}，最大平均水深为{max_row_mean}")
+
+                # 生成文件名（如 "lianghekou.csv"）
+                filename = os.path.join(output_path, f"{name}_{i}.csv")
+
+                # 写入CSV
+                with open(filename, 'w', newline='') as csvfile:
+                    writer = csv.writer(csvfile)
+                    writer.writerow(fid)  # 列标题为列索引列表
+                    writer.writerows(data)  # 直接写入NumPy数组
+                # logger.info(f"{name}区域对应Q = {i}时的水深时序数据已保存到{name}_{i}.csv文件中")
+
+            # # 查找给定网格是否淹没
+            # for index, cell in enumerate(FID):
+            #     # 认为水深>=0.1m时算作淹没
+            #     if not ((depth_data[:, cell] < 0.1).all()):
+            #         if flood_Q[FID_name[index]] is None:
+            #             logger.info(f"保证 {FID_name[index]} 不淹没的安全泄量为Q = {i}")
+            #             flood_Q[FID_name[index]] = i
+
+            # csv_path = output_path + os.path.sep + f"output_{i}.csv"
+            # # 将水深计算结果输出为csv文件
+            # insert_time_and_save_to_csv(depth_data, csv_path)
+            # logger.info(f"水深数据已写入到{csv_path}")
+
+            # # 判断是否已经得到所有的安全泄量
+            # if all(value is not None for value in flood_Q.values()):
+            #     break
+            # for key, value in flood_Q.items():
+            #     if value is not None:
+            #         logger.info(f"{key}的安全泄量为Q = {value}")
+            logger.info("------------------------")
+            print("------------------------")
+        except Exception as e:
+            logger.error(e)
+
+    # # 将安全泄量写入到csv文件中
+    # csv_file = "safety_discharge.csv"
+    # headers = ["Name", "Q_safe"]
+    # # 写入文件
+    # with open(csv_file, 'w', newline='', encoding='utf-8-sig') as f:  # 注意编码和换行符
+    #     writer = csv.writer(f)
+    #     writer.writerow(headers)  # 写入表头
+    #     for key, value in flood_Q.items():
+    #         writer.writerow([key, value])  # 逐行写入键值对
+
+
+# 各流量工况在相互独立的工作目录中并行计算，按完成的先后记录；脚本为每个流量都输出CSV，不提前结束
+with ThreadPoolExecutor(max_workers=SWEEP_WORKERS) as executor:
+    futures = {executor.submit(run_level, i): i for i in range(100, 9000, 300)}
+    for future in as_completed(futures):
+        try:
+            future.result()
+            logger.info(f"Q = {futures[future]}的工况已完成")
+        except Exception as e:
+            logger.error(f"Q = {futures[future]}的工况计算失败: {e}")
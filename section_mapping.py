@@ -0,0 +1,175 @@
+# -*- coding: UTF-8 -*-
+"""
+断面ID和名称的映射索引
+将断面id名称对应关系.xlsx预编译为二进制缓存(.npz)，Excel文件变化时自动重新编译；
+按HDF中Reference Lines的位置对齐为NumPy查找表，构造FLOOD_SECTION记录时按索引批量取值
+"""
+import os
+import threading
+
+import numpy as np
+
+from logger import logger
+
+
+# 断面映射文件路径及其二进制缓存路径
+MAPPING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "断面id名称对应关系.xlsx")
+CACHE_FILE = os.path.splitext(MAPPING_FILE)[0] + ".npz"
+# 缓存格式版本，编译规则变化时加1，使旧缓存失效
+CACHE_VERSION = 2
+
+_lock = threading.Lock()
+# 进程内缓存：((映射文件的mtime, 映射文件大小, 缓存格式版本), 排序后的断面名称, SECTION_ID, SECTION_NAME)
+_index = None
+
+
+def _file_signature(mapping_file):
+    stat = os.stat(mapping_file)
+    return stat.st_mtime_ns, stat.st_size, CACHE_VERSION
+
+
+def _compile_mapping(mapping_file, cache_file, signature):
+    """
+    解析Excel并编译为按断面名称排序的数组，同时写入.npz缓存
+    :return: (keys, section_ids, section_names)
+    """
+    import pandas as pd
+
+    df = pd.read_excel(mapping_file, sheet_name='FLOODAREA')
+    # 跳过cross_sections_id为空或为"无"的记录
+    cross_sections_id = df['cross_sections_id']
+    valid = cross_sections_id.notna() & (cross_sections_id.astype(str).str.strip() != "无")
+    df = df[valid]
+
+    # cross_sections_name转为字节串（与HDF5中的格式一致），按名称排序以便二分查找
+    keys = np.array([str(name).encode('utf-8') for name in df['cross_sections_name']], dtype='S')
+    section_ids = df['SECTION_ID'].to_numpy(dtype=np.int64)
+    section_names = df['SECTION_NAME'].astype(str).to_numpy(dtype='U')
+    order = np.argsort(keys, kind='stable')
+    keys, section_ids, section_names = keys[order], section_ids[order], section_names[order]
+
+    # 同一断面名称出现多次时与原来的字典一样以Excel中最后一行为准，并记录重复的名称
+    last = np.append(keys[1:] != keys[:-1], True)
+    if not last.all():
+        duplicated = sorted({key.decode('utf-8') for key in keys[~last]})
+        logger.warning(f"断面映射中有{len(duplicated)}个断面名称重复，以最后一行为准: {duplicated}")
+        keys, section_ids, section_names = keys[last], section_ids[last], section_names[last]
+
+    try:
+        np.savez(cache_file, signature=np.array(signature, dtype=np.int64),
+                 keys=keys, section_ids=section_ids, section_names=section_names)
+        logger.info(f"断面映射已编译为缓存: {cache_file}")
+    except OSError as e:
+        # 缓存写入失败不影响使用，只是下次启动需要重新解析Excel
+        logger.warning(f"断面映射缓存写入失败: {e}")
+    return keys, section_ids, section_names
+
+
+def _read_cache(cache_file, signature):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as cache:
+            if tuple(cache['signature'].tolist()) != tuple(signature):
+                return None
+            return cache['keys'], cache['section_ids'], cache['section_names']
+    except Exception as e:
+        logger.warning(f"断面映射缓存读取失败，将重新编译: {e}")
+        return None
+
+
+def load_section_index(mapping_file=MAPPING_FILE, cache_file=CACHE_FILE):
+    """
+    加载断面映射索引，进程内只在映射文件变化时重新加载
+    优先读取.npz缓存，缓存不存在或已过期时才解析Excel
+    :param mapping_file: 断面映射Excel文件路径
+    :param cache_file: 二进制缓存文件路径
+    :return: (keys, section_ids, section_names)，keys为按字节序排序的断面名称；映射文件不存在时返回空数组
+    """
+    global _index
+
+    if not os.path.exists(mapping_file):
+        logger.warning(f"断面映射文件不存在: {mapping_file}")
+        return np.array([], dtype='S1'), np.array([], dtype=np.int64), np.array([], dtype='U1')
+
+    signature = _file_signature(mapping_file)
+    with _lock:
+        if _index is not None and _index[0] == signature:
+            return _index[1:]
+
+        arrays = _read_cache(cache_file, signature)
+        if arrays is None:
+            arrays = _compile_mapping(mapping_file, cache_file, signature)
+        _index = (signature,) + tuple(arrays)
+        logger.info(f"成功加载{len(arrays[0])}个断面映射")
+        return _index[1:]
+
+
+def load_section_mapping():
+    """
+    加载断面ID和名称的映射关系
+
+    :return: 字典，key为cross_sections_name（字节串），value为(SECTION_ID, SECTION_NAME)元组
+    """
+    try:
+        keys, section_ids, section_names = load_section_index()
+        return {bytes(key): (int(section_id), str(section_name))
+                for key, section_id, section_name in zip(keys, section_ids, section_names)}
+    except Exception as e:
+        logger.error(f"加载断面映射失败: {e}")
+        return {}
+
+
+def align_section_mapping(cross_sections_name):
+    """
+    将断面映射按HDF中Reference Lines的位置对齐
+    :param cross_sections_name: HDF中的断面名称数组（字节串）
+    :return: (positions, section_ids, section_names)，positions为有映射的断面在cross_sections_name中的位置，
+    section_ids和section_names与positions一一对应
+    """
+    keys, section_ids, section_names = load_section_index()
+    names = np.asarray(cross_sections_name, dtype='S')
+    if len(keys) == 0 or len(names) == 0:
+        return np.array([], dtype=np.intp), section_ids[:0], section_names[:0]
+
+    lookup = np.searchsorted(keys, names)
+    lookup = np.minimum(lookup, len(keys) - 1)
+    matched = keys[lookup] == names
+    positions = np.flatnonzero(matched)
+    return positions, section_ids[lookup[matched]], section_names[lookup[matched]]
+
+
+def build_flood_section_records(scheme_name, cross_sections_name, cross_sections_ws, cross_sections_flow,
+                                time_date_stamp):
+    """
+    构造FLOOD_SECTION批量插入数据，记录顺序为先断面后时间步
+    :param scheme_name: 方案名称
+    :param cross_sections_name: 断面名称数组
+    :param cross_sections_ws: 断面水位，行=时间步，列=断面
+    :param cross_sections_flow: 断面流量，行=时间步，列=断面
+    :param time_date_stamp: 时间戳数组
+    :return: 记录列表，每条记录为元组(section_id, section_name, flood_name, time, z, depth, q)
+    """
+    positions, section_ids, section_names = align_section_mapping(cross_sections_name)
+    if len(positions) == 0:
+        return []
+
+    # 获取断面数据的时间步数（使用cross_sections_ws的实际行数）
+    num_timesteps = cross_sections_ws.shape[0] if cross_sections_ws.ndim > 1 else len(time_date_stamp)
+    time_strs = np.array([t.decode('utf-8') if isinstance(t, bytes) else str(t)
+                          for t in time_date_stamp[:num_timesteps]])
+
+    # 按位置一次性取出所有有映射断面的水位和流量，转置后按断面展开
+    z_values = np.asarray(cross_sections_ws)[:num_timesteps, positions].T.ravel().astype(float)
+    q_values = np.asarray(cross_sections_flow)[:num_timesteps, positions].T.ravel().astype(float)
+    num_sections = len(positions)
+
+    return list(zip(
+        np.repeat(section_ids, num_timesteps).tolist(),
+        np.repeat(section_names, num_timesteps).tolist(),
+        [scheme_name] * (num_sections * num_timesteps),
+        np.tile(time_strs, num_sections).tolist(),
+        z_values.tolist(),
+        [0] * (num_sections * num_timesteps),  # DEPTH字段暂填0
+        q_values.tolist()
+    ))
@@ -0,0 +1,217 @@
+# -*- coding: UTF-8 -*-
+"""
+SQLServerHandler的可替换数据库后端
+SQLiteBackend在本地用SQLite模拟生产SQL Server中用到的表，可配置每次往返的延迟，用于在没有生产库的环境下调试和测量数据库性能；
+所有后端都会统计打开的连接数、往返次数和写入行数
+"""
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# 本地模拟库的表结构，与生产SQL Server中用到的表一致；生产库中新增表的建表语句见sqlserver_schema.sql
+SQLITE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS hps_dsp_result_scheme (
+        scheme_name TEXT, begin_time TEXT, end_time TEXT, cal_info TEXT
+    );
+    CREATE TABLE IF NOT EXISTS hps_dsp_result_rsvr_dat (
+        scheme_name TEXT, reservoir_id INTEGER, data_time TEXT,
+        gen_flow REAL, other_outflow REAL, disp_flow REAL
+    );
+    CREATE TABLE IF NOT EXISTS FLOOD_REHEARSAL (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT, FLOOD_DISPATCH_NAME TEXT, FLOOD_PATH TEXT, FLOOD_NAME TEXT,
+        MAX_FLOOD_AREA REAL, VILLAGE_INFO TEXT, STATUS INTEGER,
+        CREATE_TIME TEXT DEFAULT CURRENT_TIMESTAMP, UPDATE_TIME TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS FLOOD_SECTION (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT, SECTION_ID INTEGER, SECTION_NAME TEXT, FLOOD_NAME TEXT,
+        TIME TEXT, Z REAL, DEPTH REAL, Q REAL
+    );
+    CREATE INDEX IF NOT EXISTS IX_FLOOD_SECTION_FLOOD_NAME ON FLOOD_SECTION (FLOOD_NAME);
+    CREATE TABLE IF NOT EXISTS FLOODAREA (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT, TIME TEXT, FLOODED_AREA REAL, FLOOD_NAME TEXT
+    );
+    CREATE INDEX IF NOT EXISTS IX_FLOODAREA_FLOOD_NAME ON FLOODAREA (FLOOD_NAME);
+    CREATE TABLE IF NOT EXISTS FLOOD_CELL_SUMMARY (
+        FLOOD_NAME TEXT, CELL_ID INTEGER, MAX_DEPTH REAL, MAX_TIME TEXT, FIRST_WET_TIME TEXT, FLOOD_HOURS REAL
+    );
+    CREATE INDEX IF NOT EXISTS IX_FLOOD_CELL_SUMMARY_FLOOD_NAME ON FLOOD_CELL_SUMMARY (FLOOD_NAME);
+    CREATE TABLE IF NOT EXISTS FLOOD_ZONE_STATS (
+        FLOOD_NAME TEXT, ZONE_NAME TEXT, TIME TEXT, WET_AREA REAL, MEAN_DEPTH REAL, MAX_DEPTH REAL
+    );
+    CREATE INDEX IF NOT EXISTS IX_FLOOD_ZONE_STATS_FLOOD_NAME ON FLOOD_ZONE_STATS (FLOOD_NAME);
+    CREATE TABLE IF NOT EXISTS FLOOD_DEPTH_SERIES (
+        FLOOD_NAME TEXT, ROW_COUNT INTEGER, COL_COUNT INTEGER, DATA BLOB
+    );
+'''
+
+
+class BackendStats:
+    """数据库访问统计：打开的连接数、往返次数、写入行数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.connections = 0
+        self.round_trips = 0
+        self.rows_written = 0
+
+    def add(self, connections=0, round_trips=0, rows_written=0):
+        with self._lock:
+            self.connections += connections
+            self.round_trips += round_trips
+            self.rows_written += rows_written
+
+
+class _CountingCursor:
+    def __init__(self, cursor, backend):
+        self._cursor = cursor
+        self._backend = backend
+
+    def execute(self, query, params=None):
+        query = self._backend.translate(query)
+        self._backend.round_trip()
+        if params is None:
+            self._cursor.execute(query)
+        else:
+            self._cursor.execute(query, self._backend.adapt_params(params))
+        if self._cursor.rowcount > 0 and query.lstrip().upper().startswith("INSERT"):
+            self._backend.stats.add(rows_written=self._cursor.rowcount)
+        return self._cursor.rowcount
+
+    def executemany(self, query, seq_of_params):
+        # pymssql的executemany逐行发送，这里按行计入往返次数以保持一致
+        seq_of_params = [self._backend.adapt_params(params) for params in seq_of_params]
+        query = self._backend.translate(query)
+        for _ in seq_of_params:
+            self._backend.round_trip()
+        self._cursor.executemany(query, seq_of_params)
+        if query.lstrip().upper().startswith("INSERT"):
+            self._backend.stats.add(rows_written=len(seq_of_params))
+        return self._cursor.rowcount
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _CountingConnection:
+    def __init__(self, conn, backend):
+        self._conn = conn
+        self._backend = backend
+
+    def cursor(self):
+        return _CountingCursor(self._conn.cursor(), self._backend)
+
+    def commit(self):
+        self._backend.round_trip()
+        self._conn.commit()
+
+    def rollback(self):
+        self._backend.round_trip()
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class _Backend:
+    """后端基类：可调用对象，每次调用返回一个DB-API连接，并统计访问次数、模拟网络延迟"""
+
+    def __init__(self, latency=0.0, stats=None):
+        """
+        :param latency: 每次往返（执行语句、提交、回滚、建立连接）附加的延迟，单位为秒
+        :param stats: BackendStats实例，为None时新建
+        """
+        self.latency = latency
+        self.stats = stats if stats is not None else BackendStats()
+
+    def __call__(self):
+        self.stats.add(connections=1)
+        self.round_trip()
+        return _CountingConnection(self._connect(), self)
+
+    def round_trip(self):
+        self.stats.add(round_trips=1)
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def translate(self, query):
+        return query
+
+    def adapt_params(self, params):
+        return params
+
+    def _connect(self):
+        raise NotImplementedError
+
+
+class PyMSSQLBackend(_Backend):
+    """连接真实SQL Server，仅增加访问统计"""
+
+    def __init__(self, server, port, username, password, database, latency=0.0, stats=None):
+        super().__init__(latency, stats)
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.database = database
+
+    def _connect(self):
+        import pymssql
+        return pymssql.connect(server=self.server, port=self.port, user=self.username, password=self.password,
+                               database=self.database)
+
+
+class SQLiteBackend(_Backend):
+    """
+    用SQLite模拟生产SQL Server
+    将pymssql的%s占位符转换为?，去掉wds.架构前缀，CONVERT(VARCHAR(n), x, 120)转换为substr(x, 1, n)
+    """
+
+    _convert_pattern = re.compile(r"CONVERT\(\s*VARCHAR\((\d+)\)\s*,\s*([\w.]+)\s*,\s*120\s*\)", re.IGNORECASE)
+
+    def __init__(self, path=None, latency=0.0, stats=None):
+        """
+        :param path: SQLite数据库文件路径，为None时使用进程内的共享内存库
+        :param latency: 每次往返附加的延迟，单位为秒
+        :param stats: BackendStats实例，为None时新建
+        """
+        super().__init__(latency, stats)
+        if path is None:
+            self.uri = f"file:ras_{uuid.uuid4().hex}?mode=memory&cache=shared"
+        else:
+            self.uri = f"file:{path}"
+        # 共享内存库在最后一个连接关闭时会被释放，这里保留一个连接使其在后端的生命周期内一直存在
+        self._anchor = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        self._anchor.executescript(SQLITE_SCHEMA)
+        self._anchor.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def translate(self, query):
+        query = self._convert_pattern.sub(r"substr(\2, 1, \1)", query)
+        query = re.sub(r"\bwds\.", "", query)
+        return query.replace("%s", "?")
+
+    def adapt_params(self, params):
+        return tuple(value.strftime("%Y-%m-%d %H:%M:%S") if hasattr(value, "strftime") else value
+                     for value in params)
+
+    def execute_script(self, script):
+        """直接在模拟库上执行SQL脚本，用于准备测试数据，不计入统计"""
+        self._anchor.executescript(script)
+        self._anchor.commit()
+
+    def execute_many(self, sql, rows):
+        """直接在模拟库上批量写入，用于准备测试数据，不计入统计"""
+        self._anchor.executemany(sql, rows)
+        self._anchor.commit()
+
+    def query(self, sql, params=()):
+        """直接查询模拟库，不计入统计"""
+        return self._anchor.execute(sql, params).fetchall()
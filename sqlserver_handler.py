@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+import zlib
 import numpy as np
 import pymssql
 from datetime import datetime
@@ -29,22 +30,34 @@ class CalInfoDataError(Exception):
         super().__init__(self.message)
 
 
+# 各结果表的写入列，与对应的记录元组一一对应
+FLOOD_SECTION_COLUMNS = ["SECTION_ID", "SECTION_NAME", "FLOOD_NAME", "TIME", "Z", "DEPTH", "Q"]
+FLOODAREA_COLUMNS = ["TIME", "FLOODED_AREA", "FLOOD_NAME"]
+CELL_SUMMARY_COLUMNS = ["FLOOD_NAME", "CELL_ID", "MAX_DEPTH", "MAX_TIME", "FIRST_WET_TIME", "FLOOD_HOURS"]
+ZONE_STATS_COLUMNS = ["FLOOD_NAME", "ZONE_NAME", "TIME", "WET_AREA", "MEAN_DEPTH", "MAX_DEPTH"]
+
+
 class SQLServerHandler:
-    def __init__(self, server, port, username, password, database):
+    def __init__(self, server, port, username, password, database, backend=None):
         """
         连接数据库
         :param server: SQL Server数据库的地址
         :param username: 用户名
         :param password: 密码
         :param database: 数据库名
+        :param backend: 可替换的数据库后端，为一个无参可调用对象，每次调用返回一个DB-API连接（见sql_backend.py）；
+        为None时直接连接SQL Server
         """
         self.server = server
         self.port = port
         self.username = username
         self.password = password
         self.database = database
+        self.backend = backend
 
     def _get_connect(self):
+        if self.backend is not None:
+            return self.backend()
         return pymssql.connect(server=self.server, port=self.port, user=self.username, password=self.password, database=self.database)
 
     def get_start_end_time(self, scheme_name):
@@ -259,6 +272,138 @@ class SQLServerHandler:
             cursor.close()
             conn.close()
 
+    def upsert_flood_rehearsal(self, flood_dispatch_name, flood_path, flood_name, max_flood_area, village_info=None,
+                               status=1):
+        """
+        按FLOOD_DISPATCH_NAME写入FLOOD_REHEARSAL记录：已存在则更新，不存在才插入，重复调用不会产生重复记录
+        参数同insert_flood_rehearsal
+
+        :return: 写入成功返回True，失败返回False
+        """
+        conn = self._get_connect()
+        cursor = conn.cursor()
+
+        try:
+            if village_info is None:
+                village_info = "0"
+
+            query = '''
+                UPDATE FLOOD_REHEARSAL
+                SET FLOOD_PATH = %s, FLOOD_NAME = %s, MAX_FLOOD_AREA = %s, VILLAGE_INFO = %s, STATUS = %s
+                WHERE FLOOD_DISPATCH_NAME = %s
+            '''
+            cursor.execute(query, (flood_path, flood_name, max_flood_area, village_info, status, flood_dispatch_name))
+            if cursor.rowcount == 0:
+                query = '''
+                    INSERT INTO FLOOD_REHEARSAL
+                    (FLOOD_DISPATCH_NAME, FLOOD_PATH, FLOOD_NAME, MAX_FLOOD_AREA, VILLAGE_INFO, STATUS)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                '''
+                cursor.execute(query, (flood_dispatch_name, flood_path, flood_name, max_flood_area, village_info, status))
+            conn.commit()
+            logger.info(f"成功写入FLOOD_REHEARSAL记录: {flood_dispatch_name}, STATUS={status}")
+            return True
+
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"写入FLOOD_REHEARSAL记录失败: {e}")
+            return False
+
+        finally:
+            cursor.close()
+            conn.close()
+
+    def replace_scheme_results(self, flood_name, section_records, floodarea_records, cell_summary_records=None,
+                               depth_series=None, status=1, max_flood_area=None, village_info=None,
+                               zone_stats_records=None):
+        """
+        替换一个方案的全部结果：先按FLOOD_NAME删除旧记录，再批量插入新记录，方案重算、重试时结果表不会出现重复记录
+        FLOOD_SECTION、FLOODAREA和FLOOD_REHEARSAL的状态在一个事务中替换，失败时整体回滚；
+        逐网格统计、分区统计、完整水深过程等附加结果在核心结果提交之后各自单独提交，
+        附加结果的表缺失（未执行sqlserver_schema.sql）或写入失败只记录警告，不影响方案状态
+
+        :param flood_name: 方案名称（FLOOD_NAME，同时也是FLOOD_DISPATCH_NAME）
+        :param section_records: FLOOD_SECTION记录列表，每条记录为元组(section_id, section_name, flood_name, time, z, depth, q)
+        :param floodarea_records: FLOODAREA记录列表，每条记录为元组(time, flooded_area, flood_name)
+        :param cell_summary_records: FLOOD_CELL_SUMMARY记录列表，为None时不改动该表
+        :param depth_series: 完整的水深数据，为None时不改动FLOOD_DEPTH_SERIES表
+        :param status: FLOOD_REHEARSAL的新状态
+        :param max_flood_area: FLOOD_REHEARSAL的最大淹没面积，为None则不更新
+        :param village_info: FLOOD_REHEARSAL的受影响村庄，为None则不更新
+        :param zone_stats_records: FLOOD_ZONE_STATS记录列表，为None时不改动该表
+        :return: 核心结果替换成功返回True，失败返回False
+        """
+        conn = self._get_connect()
+        cursor = conn.cursor()
+
+        try:
+            try:
+                cursor.execute("DELETE FROM FLOOD_SECTION WHERE FLOOD_NAME = %s", (flood_name,))
+                self._insert_many_values(cursor, "FLOOD_SECTION", FLOOD_SECTION_COLUMNS, section_records)
+
+                cursor.execute("DELETE FROM FLOODAREA WHERE FLOOD_NAME = %s", (flood_name,))
+                self._insert_many_values(cursor, "FLOODAREA", FLOODAREA_COLUMNS, floodarea_records)
+
+                assignments, params = ["STATUS = %s"], [status]
+                if max_flood_area is not None:
+                    assignments.append("MAX_FLOOD_AREA = %s")
+                    params.append(max_flood_area)
+                if village_info is not None:
+                    assignments.append("VILLAGE_INFO = %s")
+                    params.append(village_info)
+                cursor.execute(f"UPDATE FLOOD_REHEARSAL SET {', '.join(assignments)} WHERE FLOOD_DISPATCH_NAME = %s",
+                               (*params, flood_name))
+
+                conn.commit()
+                logger.info(f"成功替换方案{flood_name}的结果: FLOOD_SECTION {len(section_records)}条, "
+                            f"FLOODAREA {len(floodarea_records)}条")
+
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"替换方案{flood_name}的结果失败: {e}")
+                return False
+
+            if cell_summary_records is not None:
+                self._replace_optional(conn, cursor, "FLOOD_CELL_SUMMARY", flood_name, lambda: self._insert_many_values(
+                    cursor, "FLOOD_CELL_SUMMARY", CELL_SUMMARY_COLUMNS, cell_summary_records),
+                    len(cell_summary_records))
+
+            if zone_stats_records is not None:
+                self._replace_optional(conn, cursor, "FLOOD_ZONE_STATS", flood_name, lambda: self._insert_many_values(
+                    cursor, "FLOOD_ZONE_STATS", ZONE_STATS_COLUMNS, zone_stats_records),
+                    len(zone_stats_records))
+
+            if depth_series is not None:
+                self._replace_optional(conn, cursor, "FLOOD_DEPTH_SERIES", flood_name, lambda: cursor.execute(
+                    "INSERT INTO FLOOD_DEPTH_SERIES (FLOOD_NAME, ROW_COUNT, COL_COUNT, DATA) VALUES (%s, %s, %s, %s)",
+                    (flood_name, depth_series.shape[0], depth_series.shape[1], self.pack_depth_series(depth_series))),
+                    1)
+
+            return True
+
+        finally:
+            cursor.close()
+            conn.close()
+
+    @staticmethod
+    def _replace_optional(conn, cursor, table, flood_name, insert, count):
+        """
+        在单独的事务中替换一个方案在附加结果表中的记录，失败时回滚该表并记录警告
+        :param insert: 插入新记录的函数
+        :param count: 新记录条数，用于日志
+        :return: 替换成功返回True，失败返回False
+        """
+        try:
+            cursor.execute(f"DELETE FROM {table} WHERE FLOOD_NAME = %s", (flood_name,))
+            insert()
+            conn.commit()
+            logger.info(f"成功替换方案{flood_name}的{table}记录: {count}条")
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"替换方案{flood_name}的{table}记录失败，核心结果已保存，跳过该表: {e}")
+            return False
+
     def insert_flood_section_batch(self, records):
         """
         批量向FLOOD_SECTION表插入记录
@@ -275,12 +420,7 @@ class SQLServerHandler:
         
         try:
             # 批量插入（ID、CREATE_TIME和UPDATE_TIME使用默认值）
-            query = '''
-                INSERT INTO FLOOD_SECTION 
-                (SECTION_ID, SECTION_NAME, FLOOD_NAME, TIME, Z, DEPTH, Q)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            '''
-            cursor.executemany(query, records)
+            self._insert_many_values(cursor, "FLOOD_SECTION", FLOOD_SECTION_COLUMNS, records)
             conn.commit()
             logger.info(f"成功批量插入{len(records)}条FLOOD_SECTION记录")
             return True
@@ -310,12 +450,7 @@ class SQLServerHandler:
         
         try:
             # 批量插入
-            query = '''
-                INSERT INTO FLOODAREA 
-                (TIME, FLOODED_AREA, FLOOD_NAME)
-                VALUES (%s, %s, %s)
-            '''
-            cursor.executemany(query, records)
+            self._insert_many_values(cursor, "FLOODAREA", FLOODAREA_COLUMNS, records)
             conn.commit()
             logger.info(f"成功批量插入{len(records)}条FLOODAREA记录")
             return True
@@ -329,6 +464,81 @@ class SQLServerHandler:
             cursor.close()
             conn.close()
 
+    def _insert_many_values(self, cursor, table, columns, records, rows_per_statement=1000):
+        """
+        以多行VALUES语句批量插入，每条语句最多rows_per_statement行（SQL Server单条VALUES上限为1000行）
+        :param cursor: 游标
+        :param table: 表名
+        :param columns: 列名列表
+        :param records: 记录列表，每条记录为与columns一一对应的元组
+        :param rows_per_statement: 每条INSERT语句包含的行数
+        :return: 插入的行数
+        """
+        column_sql = ", ".join(columns)
+        row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        for start in range(0, len(records), rows_per_statement):
+            chunk = records[start:start + rows_per_statement]
+            query = f"INSERT INTO {table} ({column_sql}) VALUES " + ", ".join([row_placeholder] * len(chunk))
+            cursor.execute(query, tuple(value for record in chunk for value in record))
+        return len(records)
+
+    @staticmethod
+    def build_cell_summary_records(flood_name, cell_summary, time_date_stamp, wet_depth=0.01):
+        """
+        构造FLOOD_CELL_SUMMARY记录，每个过水网格一条
+        :param flood_name: 方案名称
+        :param cell_summary: PostProcessor.summarize_cells的返回值
+        :param time_date_stamp: 时间戳数组，用于将时间步序号转换为时间
+        :param wet_depth: 最大水深不超过该值的网格视为未过水，不生成记录
+        :return: 记录列表，每条记录为元组(flood_name, cell_id, max_depth, max_time, first_wet_time, flood_hours)
+        """
+        time_strs = [t.decode('utf-8') if isinstance(t, bytes) else str(t) for t in time_date_stamp]
+        cells = np.flatnonzero(cell_summary['max_depth'] > wet_depth)
+        return [
+            (flood_name, int(cell),
+             round(float(cell_summary['max_depth'][cell]), 3),
+             time_strs[cell_summary['max_step'][cell]],
+             time_strs[cell_summary['first_wet_step'][cell]] if cell_summary['first_wet_step'][cell] >= 0 else None,
+             round(float(cell_summary['flood_hours'][cell]), 3))
+            for cell in cells
+        ]
+
+    @staticmethod
+    def build_zone_stats_records(flood_name, zone_stats, time_date_stamp):
+        """
+        构造FLOOD_ZONE_STATS记录，每个分区每个时间步一条
+        :param flood_name: 方案名称
+        :param zone_stats: zonal_stats.compute_zone_stats的返回值
+        :param time_date_stamp: 时间戳数组
+        :return: 记录列表，每条记录为元组(flood_name, zone_name, time, wet_area, mean_depth, max_depth)
+        """
+        time_strs = [t.decode('utf-8') if isinstance(t, bytes) else str(t) for t in time_date_stamp]
+        wet_area = np.round(zone_stats['wet_area'], 6).tolist()
+        mean_depth = np.round(zone_stats['mean_depth'].astype(np.float64), 3).tolist()
+        max_depth = np.round(zone_stats['max_depth'].astype(np.float64), 3).tolist()
+        return [
+            (flood_name, str(name), time_strs[step], wet_area[step][zone], mean_depth[step][zone], max_depth[step][zone])
+            for zone, name in enumerate(zone_stats['names'])
+            for step in range(len(time_strs))
+        ]
+
+    @staticmethod
+    def pack_depth_series(depth_data):
+        """
+        将水深矩阵压缩为二进制：保留到毫米后以float32存储，再用zlib压缩
+        :param depth_data: 水深数据，行代表时间步，列代表网格FID
+        :return: 压缩后的字节串
+        """
+        return zlib.compress(np.round(depth_data, 3).astype('<f4').tobytes(), 6)
+
+    @staticmethod
+    def unpack_depth_series(data, row_count, col_count):
+        """
+        pack_depth_series的逆过程
+        :return: 水深数据，行代表时间步，列代表网格FID
+        """
+        return np.frombuffer(zlib.decompress(data), dtype='<f4').reshape(row_count, col_count)
+
     def get_flood_rehearsal_id(self, flood_dispatch_name):
         """
         根据FLOOD_DISPATCH_NAME查询FLOOD_REHEARSAL表的ID
@@ -0,0 +1,45 @@
+-- 生产SQL Server中结果汇总表的建表语句（FLOOD_REHEARSAL、FLOOD_SECTION、FLOODAREA为已有表，不在此列出）
+-- 部署或升级时在目标库执行一次，表已存在时跳过；本地调试用的SQLite表结构见sql_backend.SQLITE_SCHEMA
+
+-- 逐网格淹没统计，每个方案每个过水网格一行（sqlserver_handler.CELL_SUMMARY_COLUMNS）
+IF OBJECT_ID(N'dbo.FLOOD_CELL_SUMMARY', N'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.FLOOD_CELL_SUMMARY (
+        FLOOD_NAME      NVARCHAR(200)   NOT NULL,
+        CELL_ID         INT             NOT NULL,
+        MAX_DEPTH       FLOAT           NULL,
+        MAX_TIME        NVARCHAR(32)    NULL,
+        FIRST_WET_TIME  NVARCHAR(32)    NULL,
+        FLOOD_HOURS     FLOAT           NULL
+    );
+    CREATE INDEX IX_FLOOD_CELL_SUMMARY_FLOOD_NAME ON dbo.FLOOD_CELL_SUMMARY (FLOOD_NAME);
+END
+GO
+
+-- 压缩后的完整水深过程，每个方案一行（SQLServerHandler.pack_depth_series，config.STORE_DEPTH_SERIES_BLOB开启时写入）
+IF OBJECT_ID(N'dbo.FLOOD_DEPTH_SERIES', N'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.FLOOD_DEPTH_SERIES (
+        FLOOD_NAME      NVARCHAR(200)   NOT NULL,
+        ROW_COUNT       INT             NOT NULL,
+        COL_COUNT       INT             NOT NULL,
+        DATA            VARBINARY(MAX)  NOT NULL
+    );
+    CREATE INDEX IX_FLOOD_DEPTH_SERIES_FLOOD_NAME ON dbo.FLOOD_DEPTH_SERIES (FLOOD_NAME);
+END
+GO
+
+-- 分区淹没统计，每个方案每个分区每个时间步一行（sqlserver_handler.ZONE_STATS_COLUMNS）
+IF OBJECT_ID(N'dbo.FLOOD_ZONE_STATS', N'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.FLOOD_ZONE_STATS (
+        FLOOD_NAME      NVARCHAR(200)   NOT NULL,
+        ZONE_NAME       NVARCHAR(200)   NOT NULL,
+        TIME            NVARCHAR(32)    NULL,
+        WET_AREA        FLOAT           NULL,
+        MEAN_DEPTH      FLOAT           NULL,
+        MAX_DEPTH       FLOAT           NULL
+    );
+    CREATE INDEX IX_FLOOD_ZONE_STATS_FLOOD_NAME ON dbo.FLOOD_ZONE_STATS (FLOOD_NAME);
+END
+GO
@@ -9,55 +9,12 @@ import numpy as np
 import pandas as pd
 import requests
 from sqlserver_handler import SQLServerHandler
+from sql_backend import SQLiteBackend
+from section_mapping import align_section_mapping, build_flood_section_records
 from config import *
 from logger import logger
 
 
-def load_section_mapping():
-    """
-    加载断面ID和名称的映射关系
-    从断面id名称对应关系.xlsx文件中读取映射
-    
-    :return: 字典，key为cross_sections_name（字节串），value为(SECTION_ID, SECTION_NAME)元组
-    """
-    try:
-        import pandas as pd
-        import os
-        
-        # 断面映射文件路径（相对于当前工作目录）
-        mapping_file = os.path.join(os.path.dirname(__file__), "断面id名称对应关系.xlsx")
-        
-        if not os.path.exists(mapping_file):
-            logger.warning(f"断面映射文件不存在: {mapping_file}")
-            return {}
-        
-        # 读取Excel文件
-        df = pd.read_excel(mapping_file, sheet_name='FLOODAREA')
-        
-        # 建立映射字典
-        section_map = {}
-        for _, row in df.iterrows():
-            cross_sections_id = row['cross_sections_id']
-            # 跳过cross_sections_id为"无"的记录
-            if pd.isna(cross_sections_id) or str(cross_sections_id).strip() == "无":
-                continue
-            
-            cross_sections_name = row['cross_sections_name']
-            section_id = int(row['SECTION_ID'])
-            section_name = str(row['SECTION_NAME'])
-            
-            # 将cross_sections_name转为字节串作为key（与HDF5中的格式一致）
-            key = cross_sections_name.encode('utf-8') if isinstance(cross_sections_name, str) else cross_sections_name
-            section_map[key] = (section_id, section_name)
-        
-        logger.info(f"成功加载{len(section_map)}个断面映射")
-        return section_map
-        
-    except Exception as e:
-        logger.error(f"加载断面映射失败: {e}")
-        return {}
-
-
 def test_database_and_post():
     """
     测试数据库写入和POST接口调用
@@ -69,12 +26,18 @@ def test_database_and_post():
     
     # ========== 初始化数据库连接 ==========
     logger.info("初始化数据库连接...")
+    # 设置环境变量RAS_DB_BACKEND=sqlite时写入本地SQLite模拟库（RAS_SQLITE_PATH指定库文件），不连接生产SQL Server
+    backend = None
+    if os.environ.get("RAS_DB_BACKEND") == "sqlite":
+        backend = SQLiteBackend(os.environ.get("RAS_SQLITE_PATH"))
+        logger.info("使用本地SQLite模拟库")
     sqlserver_handler = SQLServerHandler(
         SQLSERVER_HOST, 
         SQLSERVER_PORT, 
         SQLSERVER_USER, 
         SQLSERVER_PASSWORD,
-        SQLSERVER_DATABASE
+        SQLSERVER_DATABASE,
+        backend=backend
     )
     
     # ========== 读取HDF5文件 ==========
@@ -125,42 +88,20 @@ def test_database_and_post():
         # 2. 准备并插入FLOOD_SECTION记录
         logger.info("开始准备FLOOD_SECTION数据...")
         
-        # 加载断面映射
-        section_mapping = load_section_mapping()
-        
         # 获取断面数据的时间步数（cross_sections_ws的行数就是时间步数）
         num_cross_section_timesteps = cross_sections_ws.shape[0] if len(cross_sections_ws.shape) > 1 else len(time_date_stamp)
         logger.info(f"断面数据实际时间步数: {num_cross_section_timesteps}")
-        logger.info(f"断面数量: {cross_sections_ws.shape[1]}")
-        
+
+        # 按断面映射索引对齐，未找到映射的断面跳过
+        positions, _, _ = align_section_mapping(cross_sections_name)
+        for i in sorted(set(range(len(cross_sections_name))) - set(positions.tolist())):
+            cs_name = cross_sections_name[i]
+            cs_name_str = cs_name.decode('utf-8') if isinstance(cs_name, bytes) else str(cs_name)
+            logger.warning(f"断面 [{i}] {cs_name_str} 未找到映射，跳过")
+
         # 准备FLOOD_SECTION批量插入数据
-        section_records = []
-        for i, cs_name in enumerate(cross_sections_name):
-            # 查找映射
-            if cs_name in section_mapping:
-                section_id, section_name = section_mapping[cs_name]
-                logger.info(f"处理断面 [{i}] {section_name} (ID: {section_id})")
-                
-                # 为每个时间步创建一条记录（使用断面数据实际的时间步数）
-                # cross_sections_ws结构：行=时间步，列=断面ID
-                for j in range(num_cross_section_timesteps):
-                    time_str = time_date_stamp[j].decode('utf-8') if isinstance(time_date_stamp[j], bytes) else str(time_date_stamp[j])
-                    z_value = float(cross_sections_ws[j, i])  # j=时间步（行），i=断面（列）
-                    q_value = float(cross_sections_flow[j, i])  # j=时间步（行），i=断面（列）
-                    depth_value = 0  # DEPTH字段暂填0
-                    
-                    section_records.append((
-                        section_id,
-                        section_name,
-                        scheme_name,
-                        time_str,
-                        z_value,
-                        depth_value,
-                        q_value
-                    ))
-            else:
-                cs_name_str = cs_name.decode('utf-8') if isinstance(cs_name, bytes) else str(cs_name)
-                logger.warning(f"断面 [{i}] {cs_name_str} 未找到映射，跳过")
+        section_records = build_flood_section_records(
+            scheme_name, cross_sections_name, cross_sections_ws, cross_sections_flow, time_date_stamp)
         
         logger.info(f"准备插入{len(section_records)}条FLOOD_SECTION记录")
         
@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+"""
+测试MySQLHandler流式写入的独立脚本
+对比原有的全量展开+_batch_insert与stream_insert（LOAD DATA LOCAL INFILE / 多行INSERT回退）的内存峰值和吞吐量
+需要一个本地的MySQL兼容数据库（MySQL/MariaDB均可），例如：
+    docker run -d -p 3306:3306 -e MARIADB_ROOT_PASSWORD=root -e MARIADB_DATABASE=ras_bench mariadb --local-infile=1
+每种方式写完后按表中的实际行数核对，行数不符或写入失败时该方式记为失败，不给出吞吐量；
+连不上数据库时只测客户端部分（展开记录 / 编码为CSV），仍然给出内存峰值和吞吐量
+"""
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pymysql
+
+from mysql_handler import MySQLHandler, depth_blocks
+from time_format_converter import TimeFormatConverter
+from logger import logger
+
+
+def legacy_depth_to_mysql(mysql_handler, table, time_list, depth_data):
+    """原有实现：先在内存中展开所有记录，再按10000行一批executemany"""
+    sql = f"Insert Into {table} (`id`,`ymdhm`,`depth`) values (%s, %s, %s)"
+    params = []
+    for time_step, row in enumerate(depth_data):
+        for i, data in enumerate(row):
+            params.append([i, time_list[time_step], round(data, 3)])
+    mysql_handler._batch_insert(sql, params)
+    return len(params)
+
+
+def legacy_expand(time_list, depth_data):
+    """原有实现的客户端部分：在内存中展开所有记录"""
+    params = []
+    for time_step, row in enumerate(depth_data):
+        for i, data in enumerate(row):
+            params.append([i, time_list[time_step], round(data, 3)])
+    return len(params)
+
+
+def stream_encode(time_list, depth_data, steps_per_block=10):
+    """depth_to_mysql的客户端部分：用同一个分块编码函数和CSV写入函数编码，写入临时文件"""
+    rows = 0
+    with tempfile.TemporaryFile('w', encoding='utf-8', newline='') as spool:
+        writer = csv.writer(spool, lineterminator='\n')
+        for block in depth_blocks(time_list, depth_data, steps_per_block):
+            MySQLHandler._write_csv_block(spool, writer, block)
+            rows += len(block[0])
+    return rows
+
+
+def count_rows(mysql_handler, table):
+    conn = mysql_handler._get_connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM `{table}`")
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def measure(name, func, expected_rows, check_rows=None):
+    """
+    执行func并返回(耗时, 内存峰值MB, 写入行数)，失败时返回None
+    :param check_rows: 返回实际写入行数的函数，为None时按func的返回值计
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        rows = func()
+    except Exception as e:
+        tracemalloc.stop()
+        logger.error(f"[{name}] 写入失败: {e}")
+        return None
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if check_rows is not None:
+        rows = check_rows()
+    if rows != expected_rows:
+        logger.error(f"[{name}] 表中行数{rows}与预期的{expected_rows}不符，记为失败")
+        return None
+    logger.info(f"[{name}] 行数: {rows}, 耗时: {elapsed:.2f}s, 吞吐量: {rows / max(elapsed, 1e-9):.0f}行/s, "
+                f"内存峰值: {peak / 1024 / 1024:.1f}MB")
+    return elapsed, peak / 1024 / 1024, rows
+
+
+def test_mysql_export():
+    # ========== 配置部分 - 请修改这些参数 ==========
+    host = os.environ.get("MYSQL_HOST", "127.0.0.1")
+    port = int(os.environ.get("MYSQL_PORT", 3306))
+    user = os.environ.get("MYSQL_USER", "root")
+    password = os.environ.get("MYSQL_PASSWORD", "root")
+    database = os.environ.get("MYSQL_DATABASE", "ras_bench")
+    table = "depth_bench"
+    num_cells = int(os.environ.get("BENCH_CELLS", 30000))
+    num_timesteps = int(os.environ.get("BENCH_TIMESTEPS", 72))
+
+    mysql_handler = MySQLHandler(host, port, user, password, database)
+
+    # 构造与真实结果同量级的水深矩阵（行=时间步，列=网格）
+    rng = np.random.default_rng(0)
+    depth_data = np.clip(rng.normal(0.1, 0.5, size=(num_timesteps, num_cells)), 0, None)
+    time_list = TimeFormatConverter().generate_result_timestep("2025-04-09 00:00", "2025-04-12 00:00")
+    logger.info(f"测试数据: {num_timesteps}个时间步 x {num_cells}个网格 = {depth_data.size}行")
+
+    try:
+        mysql_handler._get_connect().close()
+        connected = True
+    except pymysql.MySQLError as e:
+        logger.warning(f"无法连接数据库{host}:{port}，只测客户端部分: {e}")
+        connected = False
+
+    results = {}
+    if connected:
+        mysql_handler._exec(f"CREATE TABLE IF NOT EXISTS `{table}` "
+                            f"(`id` INT, `ymdhm` VARCHAR(16), `depth` DOUBLE)")
+
+        def check_rows():
+            return count_rows(mysql_handler, table)
+
+        mysql_handler._exec(f"TRUNCATE TABLE `{table}`")
+        results['legacy'] = measure("legacy _batch_insert",
+                                    lambda: legacy_depth_to_mysql(mysql_handler, table, time_list, depth_data),
+                                    depth_data.size, check_rows)
+
+        mysql_handler._exec(f"TRUNCATE TABLE `{table}`")
+        results['load_data'] = measure("stream LOAD DATA",
+                                       lambda: mysql_handler.depth_to_mysql(table, time_list, depth_data),
+                                       depth_data.size, check_rows)
+
+        mysql_handler._exec(f"TRUNCATE TABLE `{table}`")
+
+        def multi_row_insert():
+            return mysql_handler.stream_insert(table, ['id', 'ymdhm', 'depth'], depth_blocks(time_list, depth_data),
+                                               use_local_infile=False)
+
+        results['multi_row'] = measure("stream 多行INSERT", multi_row_insert, depth_data.size, check_rows)
+    else:
+        results['legacy_client'] = measure("legacy 展开记录", lambda: legacy_expand(time_list, depth_data),
+                                           depth_data.size)
+        results['stream_client'] = measure("stream 编码CSV", lambda: stream_encode(time_list, depth_data),
+                                           depth_data.size)
+
+    logger.info("=" * 60)
+    logger.info(f"{'方式':<16}{'耗时(s)':>10}{'内存峰值(MB)':>16}{'行/s':>12}")
+    for name, result in results.items():
+        if result is None:
+            logger.info(f"{name:<16}{'失败':>10}")
+            continue
+        elapsed, peak, rows = result
+        logger.info(f"{name:<16}{elapsed:>10.2f}{peak:>16.1f}{rows / max(elapsed, 1e-9):>12.0f}")
+
+
+if __name__ == '__main__':
+    logger.info("=" * 60)
+    logger.info("开始测试MySQL流式写入")
+    logger.info("=" * 60)
+
+    test_mysql_export()
+
+    logger.info("=" * 60)
+    logger.info("测试完成")
+    logger.info("=" * 60)
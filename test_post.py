@@ -9,55 +9,11 @@ import numpy as np
 import pandas as pd
 import requests
 from sqlserver_handler import SQLServerHandler
+from section_mapping import load_section_mapping
 from config import *
 from logger import logger
 
 
-def load_section_mapping():
-    """
-    加载断面ID和名称的映射关系
-    从断面id名称对应关系.xlsx文件中读取映射
-    
-    :return: 字典，key为cross_sections_name（字节串），value为(SECTION_ID, SECTION_NAME)元组
-    """
-    try:
-        import pandas as pd
-        import os
-        
-        # 断面映射文件路径（相对于当前工作目录）
-        mapping_file = os.path.join(os.path.dirname(__file__), "断面id名称对应关系.xlsx")
-        
-        if not os.path.exists(mapping_file):
-            logger.warning(f"断面映射文件不存在: {mapping_file}")
-            return {}
-        
-        # 读取Excel文件
-        df = pd.read_excel(mapping_file, sheet_name='FLOODAREA')
-        
-        # 建立映射字典
-        section_map = {}
-        for _, row in df.iterrows():
-            cross_sections_id = row['cross_sections_id']
-            # 跳过cross_sections_id为"无"的记录
-            if pd.isna(cross_sections_id) or str(cross_sections_id).strip() == "无":
-                continue
-            
-            cross_sections_name = row['cross_sections_name']
-            section_id = int(row['SECTION_ID'])
-            section_name = str(row['SECTION_NAME'])
-            
-            # 将cross_sections_name转为字节串作为key（与HDF5中的格式一致）
-            key = cross_sections_name.encode('utf-8') if isinstance(cross_sections_name, str) else cross_sections_name
-            section_map[key] = (section_id, section_name)
-        
-        logger.info(f"成功加载{len(section_map)}个断面映射")
-        return section_map
-        
-    except Exception as e:
-        logger.error(f"加载断面映射失败: {e}")
-        return {}
-
-
 def test_database_and_post():
     """
     测试数据库写入和POST接口调用
@@ -0,0 +1,228 @@
+# -*- coding: UTF-8 -*-
+"""
+逐时间步淹没范围矢量瓦片
+由水深矩阵和网格几何缓存生成z/x/y矢量瓦片（Mapbox Vector Tile），每个方案输出一个MBTiles文件，供Web端播放淹没过程；
+瓦片在进程池中并行编码，没有淹没网格的瓦片不输出
+依赖mapbox_vector_tile包（pip install mapbox-vector-tile）
+"""
+import gzip
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+
+from logger import logger
+
+
+# Web墨卡托投影的半周长（m）
+ORIGIN_SHIFT = 20037508.342789244
+# 瓦片内坐标范围
+TILE_EXTENT = 4096
+# 瓦片四周的缓冲区（占瓦片边长的比例），避免相邻瓦片拼接处出现缝隙
+TILE_BUFFER = 64 / TILE_EXTENT
+# 瓦片图层名
+LAYER_NAME = "flood"
+
+# 子进程中的共享数据，由_init_worker设置
+_worker_geometry = None
+_worker_depth = None
+_worker_steps = None
+_worker_times = None
+_worker_class_bounds = None
+
+
+def to_web_mercator(geometry_wgs84):
+    """将EPSG:4326几何数组转换为EPSG:3857"""
+    def project(coords):
+        lon = coords[:, 0]
+        lat = np.clip(coords[:, 1], -85.0511287798, 85.0511287798)
+        x = lon * ORIGIN_SHIFT / 180.0
+        y = np.log(np.tan((90.0 + lat) * math.pi / 360.0)) * ORIGIN_SHIFT / math.pi
+        return np.column_stack((x, y))
+    return shapely.transform(geometry_wgs84, project)
+
+
+def tile_size(zoom):
+    """zoom级别下一个瓦片的边长（m）"""
+    return 2 * ORIGIN_SHIFT / (1 << zoom)
+
+
+def tile_bounds(zoom, x, y):
+    """XYZ瓦片的墨卡托范围(minx, miny, maxx, maxy)"""
+    size = tile_size(zoom)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def assign_tiles(geometry_mercator, zoom):
+    """
+    计算每个网格覆盖的瓦片，跨越瓦片边界的网格会分配到所有覆盖的瓦片
+    :return: {(x, y): 网格FID数组}
+    """
+    size = tile_size(zoom)
+    bounds = shapely.bounds(geometry_mercator)
+    x0 = np.floor((bounds[:, 0] + ORIGIN_SHIFT) / size).astype(np.int64)
+    x1 = np.floor((bounds[:, 2] + ORIGIN_SHIFT) / size).astype(np.int64)
+    y0 = np.floor((ORIGIN_SHIFT - bounds[:, 3]) / size).astype(np.int64)
+    y1 = np.floor((ORIGIN_SHIFT - bounds[:, 1]) / size).astype(np.int64)
+
+    # 绝大多数网格只落在一个瓦片内，跨越边界的网格展开为多行
+    fids = [np.arange(len(geometry_mercator))]
+    xs, ys = [x0], [y0]
+    for dx in range(int((x1 - x0).max()) + 1):
+        for dy in range(int((y1 - y0).max()) + 1):
+            if dx == 0 and dy == 0:
+                continue
+            extra = np.nonzero((x0 + dx <= x1) & (y0 + dy <= y1))[0]
+            fids.append(extra)
+            xs.append(x0[extra] + dx)
+            ys.append(y0[extra] + dy)
+    fids, xs, ys = np.concatenate(fids), np.concatenate(xs), np.concatenate(ys)
+
+    n = np.int64(1) << zoom
+    keys = xs * n + ys
+    order = np.argsort(keys, kind='stable')
+    keys, fids = keys[order], fids[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    return {(int(key // n), int(key % n)): cells
+            for key, cells in zip(unique_keys, np.split(fids, starts[1:]))}
+
+
+def _init_worker(geometry_wkb, depth, steps, times, class_bounds):
+    global _worker_geometry, _worker_depth, _worker_steps, _worker_times, _worker_class_bounds
+    _worker_geometry = shapely.from_wkb(geometry_wkb)
+    _worker_depth = depth
+    _worker_steps = steps
+    _worker_times = times
+    _worker_class_bounds = class_bounds
+
+
+def encode_tile(zoom, x, y, cells):
+    """
+    编码一个瓦片：每个输出时间步、每个水深等级的淹没网格合并为一个要素
+    :return: (zoom, x, y, gzip压缩后的瓦片数据)，瓦片中没有淹没网格时数据为None
+    """
+    import mapbox_vector_tile
+
+    bounds = tile_bounds(zoom, x, y)
+    buffer = (bounds[2] - bounds[0]) * TILE_BUFFER
+    clip_box = (bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer)
+
+    # 水深等级：0为未淹没，1..n依次对应class_bounds的各个左开右闭区间，与depth_classes一致，水深恰为0.2时不算淹没
+    classes = np.digitize(_worker_depth[:, cells], _worker_class_bounds, right=True)
+    features = []
+    for row, step in enumerate(_worker_steps):
+        step_classes = classes[row]
+        for depth_class in np.unique(step_classes[step_classes > 0]):
+            members = cells[step_classes == depth_class]
+            # 同一水深等级的网格互不重叠且共享边界，coverage_union比unary_union快得多
+            geometry = shapely.coverage_union_all(_worker_geometry[members])
+            geometry = shapely.clip_by_rect(geometry, *clip_box)
+            if geometry.is_empty:
+                continue
+            features.append({
+                'geometry': geometry,
+                'properties': {'step': int(step), 'time': _worker_times[row], 'class': int(depth_class),
+                               'min_depth': float(_worker_class_bounds[depth_class - 1])},
+            })
+    if not features:
+        return zoom, x, y, None
+    data = mapbox_vector_tile.encode([{'name': LAYER_NAME, 'features': features}],
+                                     default_options={'quantize_bounds': bounds, 'extents': TILE_EXTENT})
+    return zoom, x, y, gzip.compress(data)
+
+
+def _create_mbtiles(path, metadata):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+    ''')
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)", list(metadata.items()))
+    conn.commit()
+    return conn
+
+
+def write_flood_tiles(mbtiles_path, geometry_wgs84, depth_data, times, scheme_name, min_zoom=8, max_zoom=14,
+                      step_interval=1, class_bounds=(0.2, 0.5, 1.0, 2.0), max_workers=2):
+    """
+    生成逐时间步淹没范围矢量瓦片并写入MBTiles
+    :param mbtiles_path: 输出的.mbtiles文件路径
+    :param geometry_wgs84: EPSG:4326下的网格几何数组（geometry_store.CellGeometryStore.geometry_wgs84）
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID
+    :param times: 每个时间步的时间字符串
+    :param scheme_name: 方案名，写入MBTiles元数据
+    :param step_interval: 每隔多少个时间步输出一次
+    :param class_bounds: 水深等级的下限(m)，水深大于第一个值的网格视为淹没
+    :param max_workers: 编码瓦片的进程数
+    :return: 写入的瓦片数
+    """
+    start = time.perf_counter()
+    steps = np.arange(0, len(depth_data), step_interval)
+    depth = np.asarray(depth_data, dtype=np.float32)[steps]
+    times = [str(times[step]) for step in steps]
+    class_bounds = np.asarray(class_bounds, dtype=np.float64)
+
+    # 只有在某个输出时间步淹没过的网格才需要参与切片
+    wet_cells = np.nonzero((depth > class_bounds[0]).any(axis=0))[0]
+    geometry_mercator = to_web_mercator(np.asarray(geometry_wgs84))
+    logger.info(f"开始生成矢量瓦片，输出时间步数: {len(steps)}，淹没过的网格数: {len(wet_cells)}，"
+                f"级别: {min_zoom}-{max_zoom}")
+
+    lon_lat = shapely.bounds(np.asarray(geometry_wgs84)[wet_cells]) if len(wet_cells) else np.zeros((1, 4))
+    metadata = {
+        'name': scheme_name,
+        'format': 'pbf',
+        'type': 'overlay',
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ",".join(f"{v:.6f}" for v in (lon_lat[:, 0].min(), lon_lat[:, 1].min(),
+                                                  lon_lat[:, 2].max(), lon_lat[:, 3].max())),
+        'json': json.dumps({'vector_layers': [{'id': LAYER_NAME, 'minzoom': min_zoom, 'maxzoom': max_zoom,
+                                               'fields': {'step': 'Number', 'time': 'String',
+                                                          'class': 'Number', 'min_depth': 'Number'}}],
+                            'steps': steps.tolist(), 'times': times}, ensure_ascii=False),
+    }
+    conn = _create_mbtiles(mbtiles_path, metadata)
+    tile_count = 0
+    empty_count = 0
+    if len(wet_cells):
+        geometry_wkb = shapely.to_wkb(geometry_mercator[wet_cells])
+        local_geometry = geometry_mercator[wet_cells]
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(geometry_wkb, depth[:, wet_cells], steps, times, class_bounds))
+        try:
+            for zoom in range(min_zoom, max_zoom + 1):
+                tiles = assign_tiles(local_geometry, zoom)
+                # 每个进程一次处理多个瓦片，减少进程间通信
+                chunksize = max(1, len(tiles) // (max_workers * 8))
+                results = executor.map(encode_tile, *zip(*[(zoom, x, y, cells) for (x, y), cells in tiles.items()]),
+                                       chunksize=chunksize)
+                rows = []
+                for z, x, y, data in results:
+                    if data is None:
+                        empty_count += 1
+                        continue
+                    # MBTiles使用TMS行号，y轴自下而上
+                    rows.append((z, x, (1 << z) - 1 - y, data))
+                conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+                conn.commit()
+                tile_count += len(rows)
+                logger.info(f"级别{zoom}瓦片生成完成，瓦片数: {len(rows)}")
+        finally:
+            executor.shutdown()
+    conn.close()
+    logger.info(f"矢量瓦片已写入 {mbtiles_path}，瓦片数: {tile_count}，跳过空瓦片: {empty_count}，"
+                f"大小: {os.path.getsize(mbtiles_path) / 1024 / 1024:.1f}MB，耗时: {time.perf_counter() - start:.2f}s")
+    return tile_count
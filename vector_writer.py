@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+"""
+GIS图层输出格式
+支持FlatGeobuf（可流式读取，带打包R树空间索引）、GeoPackage（带R树空间索引）和ESRI Shapefile（旧格式，字段名最长10个字符）
+"""
+import os
+
+import numpy as np
+
+from logger import logger
+
+
+# 格式名: (GDAL驱动, 扩展名, 图层创建选项)
+FORMATS = {
+    'fgb': ('FlatGeobuf', '.fgb', {'SPATIAL_INDEX': 'YES'}),
+    'gpkg': ('GPKG', '.gpkg', {'SPATIAL_INDEX': 'YES'}),
+    'shp': ('ESRI Shapefile', '.shp', {}),
+}
+
+# Shapefile的附属文件扩展名，覆盖写入和统计文件大小时使用
+SHAPEFILE_SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def layer_path(output_dir, name, fmt):
+    """图层文件路径：output_dir/name.<扩展名>"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的GIS输出格式: {fmt}，可选: {list(FORMATS)}")
+    return os.path.join(output_dir, name + FORMATS[fmt][1])
+
+
+def layer_size(path):
+    """图层文件大小（字节），Shapefile包含所有附属文件"""
+    base, ext = os.path.splitext(path)
+    if ext == '.shp':
+        return sum(os.path.getsize(base + sidecar) for sidecar in SHAPEFILE_SIDECARS
+                   if os.path.exists(base + sidecar))
+    return os.path.getsize(path)
+
+
+def _remove_layer(path):
+    base, ext = os.path.splitext(path)
+    for sidecar in (SHAPEFILE_SIDECARS if ext == '.shp' else (ext,)):
+        if os.path.exists(base + sidecar):
+            os.remove(base + sidecar)
+
+
+def write_layer(gdf, output_dir, name, fmt='fgb', layer=None, append=False):
+    """
+    将GeoDataFrame写为一个图层
+    :param gdf: GeoDataFrame
+    :param output_dir: 输出目录
+    :param name: 文件名（不含扩展名）
+    :param fmt: 'fgb'、'gpkg'或'shp'
+    :param layer: GeoPackage中的图层名，默认与文件名相同
+    :param append: 为True时在已有的GeoPackage中追加图层（仅gpkg），否则覆盖已有文件
+    :return: 输出文件路径
+    """
+    path = layer_path(output_dir, name, fmt)
+    driver, _, layer_options = FORMATS[fmt]
+    if fmt == 'shp':
+        too_long = [column for column in gdf.columns if column != gdf.geometry.name and len(column) > 10]
+        if too_long:
+            logger.warning(f"Shapefile字段名超过10个字符，将被截断: {too_long}")
+    if not (append and fmt == 'gpkg'):
+        _remove_layer(path)
+    gdf.to_file(path, driver=driver, layer=(layer or name) if fmt == 'gpkg' else None,
+                engine='pyogrio', layer_options=layer_options)
+    return path
+
+
+def write_layers(gdf, output_dir, name, formats):
+    """
+    将同一个GeoDataFrame按多种格式输出
+    :param formats: 格式列表，例如['fgb', 'shp']
+    :return: 输出文件路径列表
+    """
+    return [write_layer(gdf, output_dir, name, fmt) for fmt in formats]
+
+
+def write_timestep_layers(geometry_store, depth_data, output_dir, fmt='fgb', name='depth_timestep',
+                          wgs84=False, threshold=None):
+    """
+    逐时间步输出水深图层，几何来自网格几何缓存，只附加每个时间步的水深数组
+    GeoPackage把所有时间步作为同一个文件中的多个图层（name_0、name_1...），其他格式每个时间步一个文件
+    :param geometry_store: geometry_store.CellGeometryStore
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID
+    :param threshold: 不为None时只输出水深大于该值的网格
+    :return: 输出文件路径列表
+    """
+    paths = []
+    for i, depth in enumerate(depth_data):
+        index = None if threshold is None else (depth > threshold).nonzero()[0]
+        gdf = geometry_store.to_geodataframe({'cell_id': np.arange(len(depth)), 'depth': depth},
+                                             wgs84=wgs84, include_original=False, index=index)
+        if fmt == 'gpkg':
+            path = write_layer(gdf, output_dir, name, fmt, layer=f"{name}_{i}", append=i > 0)
+            if i == 0:
+                paths.append(path)
+        else:
+            paths.append(write_layer(gdf, output_dir, f"{name}_{i}", fmt))
+    return paths
@@ -1,35 +1,39 @@
+import numpy as np
+
 from hdf_handler import HDFHandler
 from post_processor import PostProcessor
 
 from logger import logger
 
 
-def velocity_to_cells(cells_facepoint_indexes_data, velocity_data, cells_number):
-    cells_velocity = []
-    # velocity_row代表每个时间步下的facepoint流速数据
-    for time_step, velocity_row in enumerate(velocity_data):
-        cells_velocity_perstep = []  # 存储每一步的每个cells的流速
-        # cell_row代表每个cell的facepoint index数据
-        for cell_index, cell_row in enumerate(cells_facepoint_indexes_data):
-            if cell_index == cells_number:
-                break
-            facepoint_velocity_sum = 0  # 用于记录每个cells网格顶点的流速和
-            flag = True  # flag用于判断循环是正常结束还是被打断
-            # facepoint_index
-            for index, facepoint_index in enumerate(cell_row):
-                if facepoint_index == -1:  # facepoint_index
-                    flag = False
-                    break
-                facepoint_velocity_sum += velocity_row[facepoint_index]
-            if flag:
-                cell_velocity = facepoint_velocity_sum / (index + 1)
-            else:
-                cell_velocity = facepoint_velocity_sum / index
-
-            cells_velocity_perstep.append(cell_velocity)
-
-        cells_velocity.append(cells_velocity_perstep)
-        logger.info(f'已处理{time_step + 1}个时间步')
+def velocity_to_cells(cells_facepoint_indexes_data, velocity_data, cells_number, block_size=36, dtype=np.float32):
+    """
+    将网格顶点（facepoint）的流速平均到网格
+    用补齐为-1的Cells FacePoint Indexes一次取出所有网格的顶点流速，按掩码求平均，时间步按块处理
+    :param cells_facepoint_indexes_data: Cells FacePoint Indexes，(网格数, 最大顶点数)，不足的位置为-1
+    :param velocity_data: 顶点流速，行代表时间步，列代表facepoint；可以是ndarray或h5py数据集（按块读取，不整体载入内存）
+    :param cells_number: 真实网格数
+    :param block_size: 每块的时间步数
+    :param dtype: 计算和输出的数据类型
+    :return: 网格流速，(时间步数, 网格数)的数组
+    """
+    indexes = np.asarray(cells_facepoint_indexes_data[:cells_number])
+    valid = indexes >= 0
+    counts = valid.sum(axis=1)
+    # -1的位置取第0个顶点，再由掩码置零
+    safe_indexes = np.where(valid, indexes, 0)
+    weights = valid.astype(dtype)
+    # 没有有效顶点的网格流速记为0
+    inverse_counts = np.divide(1, counts, out=np.zeros(len(counts), dtype=dtype), where=counts > 0).astype(dtype)
+
+    num_steps = velocity_data.shape[0]
+    cells_velocity = np.empty((num_steps, cells_number), dtype=dtype)
+    for start in range(0, num_steps, block_size):
+        block = np.asarray(velocity_data[start:start + block_size], dtype=dtype)
+        # (块内时间步数, 网格数, 最大顶点数)
+        gathered = block[:, safe_indexes]
+        cells_velocity[start:start + len(block)] = np.einsum('tcf,cf->tc', gathered, weights) * inverse_counts
+        logger.info(f'已处理{min(start + block_size, num_steps)}个时间步')
     return cells_velocity
 
 
@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+"""
+受影响村庄统计
+将村庄点（或小面积村庄面）一次性匹配到模型网格，结果按村庄压缩存储（CSR格式：indptr、网格FID），编译为二进制缓存(.npz)，
+村庄shp或网格shp变化时自动重新匹配；每次计算只需按网格FID从逐网格淹没统计中取值，再按村庄分段求最大水深和最早过水时间步
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from geometry_store import load_geometry_store, shp_signature
+from logger import logger
+
+
+_lock = threading.Lock()
+# 进程内缓存：{(村庄shp绝对路径, 网格shp绝对路径): (签名, VillageIndex)}
+_indexes = {}
+
+
+class VillageIndex:
+    """
+    村庄与网格的对应关系：第i个村庄对应的网格FID为cells[indptr[i]:indptr[i+1]]
+    """
+
+    def __init__(self, names, indptr, cells):
+        self.names = names
+        self.indptr = indptr
+        self.cells = cells
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def matched(self):
+        """匹配到网格的村庄"""
+        return np.diff(self.indptr) > 0
+
+
+def build_village_index(villages, geometry_store, max_distance=50.0):
+    """
+    将村庄匹配到网格：村庄点落在的网格，或村庄面相交的所有网格；落在网格范围外的村庄点取max_distance以内最近的网格
+    :param villages: 村庄GeoDataFrame，坐标系需与geometry_store一致
+    :param geometry_store: geometry_store.CellGeometryStore
+    :param max_distance: 网格范围外的村庄最多匹配多远的网格（模型坐标系单位，一般为m）
+    :return: (indptr, cells)
+    """
+    geometry = np.asarray(villages.geometry.values)
+    village_ids, cell_ids = geometry_store.tree.query(geometry, predicate='intersects')
+
+    # 网格范围外（如河道边界以外）的村庄就近匹配
+    outside = np.setdiff1d(np.arange(len(geometry)), village_ids)
+    if len(outside) and max_distance:
+        nearest = geometry_store.tree.query_nearest(geometry[outside], max_distance=max_distance, all_matches=False)
+        village_ids = np.concatenate([village_ids, outside[nearest[0]]])
+        cell_ids = np.concatenate([cell_ids, nearest[1]])
+
+    order = np.lexsort((cell_ids, village_ids))
+    village_ids, cell_ids = village_ids[order], cell_ids[order]
+    indptr = np.zeros(len(geometry) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(village_ids, minlength=len(geometry)), out=indptr[1:])
+    return indptr, cell_ids.astype(np.int32)
+
+
+def load_village_index(village_shp, mesh_shp, name_field="NAME", max_distance=50.0, cache_file=None):
+    """
+    加载村庄与网格的对应关系，进程内只在村庄shp或网格shp变化时重新匹配
+    :param village_shp: 村庄点（或面）shp路径
+    :param mesh_shp: 参考shp网格路径
+    :param name_field: 村庄名称字段
+    :param max_distance: 见build_village_index
+    :param cache_file: 二进制缓存文件路径，默认与村庄shp同目录的.cells.npz
+    :return: VillageIndex
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(village_shp)[0] + ".cells.npz"
+    signature = shp_signature(village_shp) + shp_signature(mesh_shp) + (int(max_distance * 1000),)
+    key = (os.path.abspath(village_shp), os.path.abspath(mesh_shp))
+    with _lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        index = None
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cache:
+                    if tuple(cache['signature'].tolist()) == tuple(signature):
+                        index = VillageIndex(cache['names'], cache['indptr'], cache['cells'])
+            except Exception as e:
+                logger.warning(f"村庄网格对应关系缓存读取失败，将重新匹配: {e}")
+        if index is None:
+            import geopandas as gpd
+
+            geometry_store = load_geometry_store(mesh_shp)
+            villages = gpd.read_file(village_shp)
+            if villages.crs is not None and geometry_store.crs is not None:
+                villages = villages.to_crs(geometry_store.crs)
+            if name_field not in villages.columns:
+                raise KeyError(f"村庄shp中未找到名称字段'{name_field}'，可用的列: {villages.columns.tolist()}")
+            names = villages[name_field].astype(str).to_numpy(dtype='U')
+            indptr, cells = build_village_index(villages, geometry_store, max_distance)
+            index = VillageIndex(names, indptr, cells)
+            try:
+                np.savez(cache_file, signature=np.array(signature, dtype=np.int64),
+                         names=names, indptr=indptr, cells=cells)
+                logger.info(f"村庄网格对应关系已编译为缓存: {cache_file}")
+            except OSError as e:
+                logger.warning(f"村庄网格对应关系缓存写入失败: {e}")
+        _indexes[key] = (signature, index)
+        logger.info(f"成功加载{len(index)}个村庄，匹配到网格的村庄数: {int(index.matched.sum())}")
+        return index
+
+
+def village_impacts(index, cell_stats, time_date_stamp, flood_depth=0.2):
+    """
+    统计受影响村庄
+    :param index: VillageIndex
+    :param cell_stats: flood_stats.compute_cell_stats的返回值
+    :param time_date_stamp: 时间戳数组，用于将时间步序号转换为时间
+    :param flood_depth: 村庄对应网格的最大水深超过该值视为受影响(m)，最早淹没时间为首次超过该值的时刻；
+        必须是cell_stats的阈值之一（config.py中的FLOOD_STATS_THRESHOLDS）
+    :return: 受影响村庄列表，按最大水深从大到小排列，每项为{'name', 'max_depth', 'first_flood_time'}
+    """
+    level = np.flatnonzero(np.isclose(cell_stats['thresholds'], flood_depth))
+    if len(level) == 0:
+        raise ValueError(f"逐网格统计的阈值{cell_stats['thresholds'].tolist()}中没有{flood_depth}m，"
+                         f"无法确定村庄的最早淹没时间")
+    if len(index.cells) == 0:
+        return []
+    matched = index.matched
+    starts = index.indptr[:-1][matched]
+
+    max_depth = np.zeros(len(index), dtype=np.float32)
+    max_depth[matched] = np.maximum.reduceat(cell_stats['max_depth'][index.cells], starts)
+
+    # 从未超过flood_depth的网格（-1）不参与最早时间步的比较
+    first_above = cell_stats['first_above_step'][level[0]][index.cells].astype(np.int64)
+    first_above[first_above < 0] = np.iinfo(np.int64).max
+    first_step = np.full(len(index), -1, dtype=np.int64)
+    first_step[matched] = np.minimum.reduceat(first_above, starts)
+    first_step[first_step == np.iinfo(np.int64).max] = -1
+
+    time_strs = [t.decode('utf-8') if isinstance(t, bytes) else str(t) for t in time_date_stamp]
+    affected = np.flatnonzero(max_depth > flood_depth)
+    affected = affected[np.argsort(-max_depth[affected], kind='stable')]
+    return [
+        {'name': str(index.names[i]),
+         'max_depth': round(float(max_depth[i]), 3),
+         'first_flood_time': time_strs[first_step[i]] if first_step[i] >= 0 else None}
+        for i in affected
+    ]
+
+
+def format_village_info(impacts):
+    """受影响村庄列表转为写入FLOOD_REHEARSAL.VILLAGE_INFO的JSON字符串，没有受影响村庄时为"0"（与原默认值一致）"""
+    if not impacts:
+        return "0"
+    return json.dumps(impacts, ensure_ascii=False)
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+"""
+热启动（restart文件）缓存
+安全泄量试算每次都要先模拟12小时佛子岭零出流的预热期把库区河段蓄满，预热期只由初始条件（起始时刻和预热期的入流过程）决定，
+因此每组初始条件只计算一次预热期，把HEC-RAS在预热期末写出的restart文件按初始条件的签名缓存起来，
+之后的试算从预热期末开始，直接读取缓存的restart文件作为初始条件
+
+注意：b01中restart相关的键（ras_handler_safety_discharge.RASHandler.modify_restart）和restart文件的位置沿用Windows版HEC-RAS的约定，
+尚未在Linux计算引擎上核实；Linux计算引擎在wrk_source下计算，因此restart文件在模型目录和wrk_source中都查找、都复制一份。
+启用热启动前应先单独计算一次预热期，确认能找到restart文件，否则每次都会在报错后退回冷启动
+"""
+import glob
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from logger import logger
+
+
+# 预热期时长(h)
+SPINUP_HOURS = 12
+# 试算时复制到模型目录中的restart文件名
+WARM_START_FILE = "warm_start.rst"
+# 查找和放置restart文件的目录（相对模型目录）：模型目录本身，以及remove_hdf_results放置.p01.tmp.hdf的wrk_source
+RESTART_DIRS = ("", "wrk_source")
+
+_lock = threading.Lock()
+
+
+def spinup_key(ymdhm_start, *series):
+    """
+    初始条件的签名
+    :param ymdhm_start: 预热期开始时刻，yyyy-mm-dd hh:mm
+    :param series: 预热期内的各边界流量过程
+    :return: 十六进制字符串
+    """
+    digest = hashlib.sha1(ymdhm_start.encode())
+    for values in series:
+        digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def cached_restart(cache_dir, key):
+    """
+    :return: 缓存的restart文件路径，没有时返回None
+    """
+    path = os.path.join(cache_dir, f"{key}.rst")
+    return path if os.path.exists(path) else None
+
+
+def find_restart(model_dir, since):
+    """
+    查找模型目录（及wrk_source）中since之后写出的最新restart文件
+    :param since: 时间戳，预热期计算开始的时刻
+    :return: 文件路径，没有时返回None
+    """
+    candidates = [path for sub in RESTART_DIRS for path in glob.glob(os.path.join(model_dir, sub, "*.rst"))
+                  if os.path.basename(path) != WARM_START_FILE and os.path.getmtime(path) >= since]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def save_restart(cache_dir, key, model_dir, since):
+    """
+    把预热期计算写出的restart文件存入缓存
+    :return: 缓存的restart文件路径
+    :raises FileNotFoundError: 预热期计算没有写出restart文件
+    """
+    restart = find_restart(model_dir, since)
+    if restart is None:
+        raise FileNotFoundError(f"{model_dir}及其{'、'.join(sub for sub in RESTART_DIRS if sub)}中没有找到预热期计算写出的"
+                                f"restart文件，请核实b01中写出restart文件的设置")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.rst")
+    with _lock:
+        # 先写临时文件再改名，避免并发读取到写了一半的文件
+        shutil.copyfile(restart, path + ".tmp")
+        os.replace(path + ".tmp", path)
+    logger.info(f"预热期restart文件已缓存: {path}")
+    return path
+
+
+def attach_restart(restart_file, model_dir):
+    """
+    把缓存的restart文件复制到模型目录和wrk_source，供b01引用
+    :return: restart文件的文件名（b01中按相对路径引用）
+    """
+    for sub in RESTART_DIRS:
+        os.makedirs(os.path.join(model_dir, sub), exist_ok=True)
+        shutil.copyfile(restart_file, os.path.join(model_dir, sub, WARM_START_FILE))
+    return WARM_START_FILE
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+"""
+模型工作目录池
+HEC-RAS计算会就地改写b01、.p01.hdf并在模型目录中写出结果，同一个目录不能同时跑两个计算；
+把模型目录复制成若干份相互独立的工作目录，每个计算从池中独占借用一份，用完归还，多个计算即可并行
+工作目录在第一次借用时才复制，之后复用；每份工作目录记录复制时模型文件（b01、.p01.hdf、.g01）的签名，
+借用时签名与模型目录不一致（模型已更新）则重新复制
+"""
+import fnmatch
+import json
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+
+from logger import logger
+
+
+# 复制模型目录时跳过的文件和目录：计算日志、restart缓存、上次计算的临时结果
+IGNORE_PATTERNS = ('ras_jobs', 'restart', '*.tmp.hdf', '*.log')
+# 计算签名的模型文件，任一文件的mtime或大小变化时工作目录重新复制
+SIGNATURE_PATTERNS = ('*.b01', '*.p01.hdf', '*.g01', '*.g01.hdf')
+# 工作目录中记录签名的文件
+SIGNATURE_FILE = '.model_signature.json'
+
+
+def model_signature(model_dir, patterns=SIGNATURE_PATTERNS):
+    """模型目录中匹配patterns的文件的mtime和大小，{文件名: [mtime_ns, size]}"""
+    signature = {}
+    for name in sorted(os.listdir(model_dir)):
+        if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            stat = os.stat(os.path.join(model_dir, name))
+            signature[name] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+def _read_signature(workspace):
+    try:
+        with open(os.path.join(workspace, SIGNATURE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class WorkspacePool:
+    """若干份相互独立的模型工作目录"""
+
+    def __init__(self, model_dir, root, size, ignore=IGNORE_PATTERNS):
+        """
+        :param model_dir: 模型目录
+        :param root: 工作目录的存放目录，第k份工作目录为root/ws{k}
+        :param size: 工作目录份数，即最多同时运行的计算数
+        :param ignore: 复制模型目录时跳过的文件名模式
+        """
+        self.model_dir = model_dir
+        self.root = root
+        self.size = size
+        self.ignore = ignore
+        self._free = queue.Queue()
+        self._lock = threading.Lock()
+        for k in range(size):
+            self._free.put(os.path.join(root, f"ws{k}"))
+
+    def _ensure(self, workspace):
+        """工作目录不存在，或复制后模型目录中的b01、.p01.hdf、.g01有变化时，从模型目录重新复制"""
+        with self._lock:
+            signature = model_signature(self.model_dir)
+            if os.path.isdir(workspace):
+                if _read_signature(workspace) == signature:
+                    return
+                logger.info(f"模型目录{self.model_dir}已更新，重新复制工作目录: {workspace}")
+                shutil.rmtree(workspace)
+            os.makedirs(self.root, exist_ok=True)
+            # 上次复制中断时留下的临时目录
+            shutil.rmtree(workspace + ".tmp", ignore_errors=True)
+            shutil.copytree(self.model_dir, workspace + ".tmp", ignore=shutil.ignore_patterns(*self.ignore))
+            with open(os.path.join(workspace + ".tmp", SIGNATURE_FILE), 'w', encoding='utf-8') as f:
+                json.dump(signature, f)
+            os.replace(workspace + ".tmp", workspace)
+            logger.info(f"已从{self.model_dir}复制模型工作目录: {workspace}")
+
+    @contextmanager
+    def acquire(self):
+        """
+        借用一份工作目录，没有空闲的工作目录时等待
+        :return: 工作目录路径
+        """
+        workspace = self._free.get()
+        try:
+            self._ensure(workspace)
+            yield workspace
+        finally:
+            self._free.put(workspace)
@@ -0,0 +1,157 @@
+# -*- coding: UTF-8 -*-
+"""
+分区（乡镇等行政区）淹没统计
+由分区面shp和网格几何一次性计算每个网格与每个分区的相交面积，按分区压缩存储为稀疏权重（CSR格式：indptr、网格FID、相交面积），
+编译为二进制缓存(.npz)，分区shp或网格shp变化时自动重新计算；
+每个时间步块只需按网格FID取值后按分区分段求和，得到各分区逐时间步的淹没面积、平均水深和最大水深
+"""
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from geometry_store import load_geometry_store, shp_signature
+from logger import logger
+
+
+_lock = threading.Lock()
+# 进程内缓存：{(分区shp绝对路径, 网格shp绝对路径): (签名, ZoneIndex)}
+_indexes = {}
+
+
+class ZoneIndex:
+    """
+    分区与网格的稀疏权重：第i个分区包含的网格FID为cells[indptr[i]:indptr[i+1]]，weights为对应的相交面积(m²)
+    """
+
+    def __init__(self, names, indptr, cells, weights):
+        self.names = names
+        self.indptr = indptr
+        self.cells = cells
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def zone_area(self):
+        """各分区被模型网格覆盖的面积(m²)"""
+        area = np.zeros(len(self), dtype=np.float64)
+        matched = np.diff(self.indptr) > 0
+        if matched.any():
+            area[matched] = np.add.reduceat(self.weights, self.indptr[:-1][matched])
+        return area
+
+
+def build_zone_index(zones, geometry_store):
+    """
+    计算每个分区与网格的相交面积
+    :param zones: 分区GeoDataFrame，坐标系需与geometry_store一致
+    :param geometry_store: geometry_store.CellGeometryStore
+    :return: (indptr, cells, weights)
+    """
+    geometry = np.asarray(zones.geometry.values)
+    zone_ids, cell_ids = geometry_store.tree.query(geometry, predicate='intersects')
+    weights = shapely.area(shapely.intersection(geometry[zone_ids], geometry_store.geometry[cell_ids]))
+    # 只在边界上接触的网格相交面积为0，不计入
+    keep = weights > 0
+    zone_ids, cell_ids, weights = zone_ids[keep], cell_ids[keep], weights[keep]
+
+    order = np.lexsort((cell_ids, zone_ids))
+    zone_ids, cell_ids, weights = zone_ids[order], cell_ids[order], weights[order]
+    indptr = np.zeros(len(geometry) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(zone_ids, minlength=len(geometry)), out=indptr[1:])
+    return indptr, cell_ids.astype(np.int32), weights.astype(np.float64)
+
+
+def load_zone_index(zone_shp, mesh_shp, name_field="NAME", cache_file=None):
+    """
+    加载分区与网格的稀疏权重，进程内只在分区shp或网格shp变化时重新计算
+    :param zone_shp: 分区面shp路径
+    :param mesh_shp: 参考shp网格路径
+    :param name_field: 分区名称字段
+    :param cache_file: 二进制缓存文件路径，默认与分区shp同目录的.cells.npz
+    :return: ZoneIndex
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(zone_shp)[0] + ".cells.npz"
+    signature = shp_signature(zone_shp) + shp_signature(mesh_shp)
+    key = (os.path.abspath(zone_shp), os.path.abspath(mesh_shp))
+    with _lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        index = None
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cache:
+                    if tuple(cache['signature'].tolist()) == tuple(signature):
+                        index = ZoneIndex(cache['names'], cache['indptr'], cache['cells'], cache['weights'])
+            except Exception as e:
+                logger.warning(f"分区网格权重缓存读取失败，将重新计算: {e}")
+        if index is None:
+            import geopandas as gpd
+
+            geometry_store = load_geometry_store(mesh_shp)
+            zones = gpd.read_file(zone_shp)
+            if zones.crs is not None and geometry_store.crs is not None:
+                zones = zones.to_crs(geometry_store.crs)
+            if name_field not in zones.columns:
+                raise KeyError(f"分区shp中未找到名称字段'{name_field}'，可用的列: {zones.columns.tolist()}")
+            names = zones[name_field].astype(str).to_numpy(dtype='U')
+            index = ZoneIndex(names, *build_zone_index(zones, geometry_store))
+            try:
+                np.savez(cache_file, signature=np.array(signature, dtype=np.int64), names=names,
+                         indptr=index.indptr, cells=index.cells, weights=index.weights)
+                logger.info(f"分区网格权重已编译为缓存: {cache_file}")
+            except OSError as e:
+                logger.warning(f"分区网格权重缓存写入失败: {e}")
+        _indexes[key] = (signature, index)
+        logger.info(f"成功加载{len(index)}个分区，相交网格数: {len(index.cells)}")
+        return index
+
+
+def compute_zone_stats(index, depth_data, flood_depth=0.2, block_size=36):
+    """
+    按时间步分块计算各分区的淹没统计
+    :param index: ZoneIndex
+    :param depth_data: 水深数据，行代表时间步，列代表网格FID；可以是ndarray或h5py数据集（按块读取）
+    :param flood_depth: 水深超过该值的网格视为淹没(m)
+    :param block_size: 每块的时间步数
+    :return: 字典，wet_area（km²）、mean_depth（淹没部分按面积加权的平均水深，m）、max_depth（淹没网格的最大水深，m）
+    均为(时间步数, 分区数)，names为分区名称
+    """
+    num_steps = depth_data.shape[0]
+    wet_area = np.zeros((num_steps, len(index)), dtype=np.float64)
+    mean_depth = np.zeros((num_steps, len(index)), dtype=np.float32)
+    max_depth = np.zeros((num_steps, len(index)), dtype=np.float32)
+    matched = np.diff(index.indptr) > 0
+    starts = index.indptr[:-1][matched]
+    if len(starts):
+        for start in range(0, num_steps, block_size):
+            stop = min(start + block_size, num_steps)
+            depth = np.asarray(depth_data[start:stop], dtype=np.float32)[:, index.cells]
+            depth[depth <= flood_depth] = 0
+            wet_weights = (depth > 0) * index.weights
+            block_area = np.add.reduceat(wet_weights, starts, axis=1)
+            block_volume = np.add.reduceat(depth * wet_weights, starts, axis=1)
+            wet_area[start:stop, matched] = block_area / 1e6
+            mean_depth[start:stop, matched] = np.divide(block_volume, block_area, out=np.zeros_like(block_area),
+                                                        where=block_area > 0)
+            max_depth[start:stop, matched] = np.maximum.reduceat(depth, starts, axis=1)
+    return {'names': index.names, 'wet_area': wet_area, 'mean_depth': mean_depth, 'max_depth': max_depth}
+
+
+def write_zone_stats(group, zone_stats):
+    """
+    将分区淹没统计写入HDF5组（data/2DFlowAreas/Zones）
+    :param group: h5py组
+    """
+    zones_group = group.create_group('Zones')
+    zones_group.create_dataset('Name', data=np.array([name.encode('utf-8') for name in zone_stats['names']]))
+    zones_group.create_dataset('WetArea', data=zone_stats['wet_area'])
+    zones_group.create_dataset('MeanDepth', data=zone_stats['mean_depth'])
+    zones_group.create_dataset('MaxDepth', data=zone_stats['max_depth'])
+    return zones_group